@@ -0,0 +1,86 @@
+#  Copyright 2023 SkyAPM org
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Soak test of URI Drain with max_clusters under high cardinality traffic: every URI is a random combination of
+dictionary words, so clusters keep getting evicted. The number of tree nodes, the cluster ids referenced by the tree and
+the traced memory must stay flat once max_clusters is reached.
+
+python -m demo.benchmark_eviction_soak [rounds] [uris per round]
+"""
+
+import gc
+import random
+import sys
+import time
+import tracemalloc
+
+from models.uri_drain.uri_drain import Drain
+from models.uri_drain.word_splitter import word_spell
+
+max_clusters = 1024
+# the words are bounded so the token caches settle, their combinations are not
+vocabulary_size = 3000
+
+
+def count_tree(node):
+    nodes, cluster_refs = 1, len(node.cluster_ids)
+    for child in node.key_to_child_node.values():
+        child_nodes, child_cluster_refs = count_tree(child)
+        nodes += child_nodes
+        cluster_refs += child_cluster_refs
+    return nodes, cluster_refs
+
+
+def generate_uris(words, count: int):
+    uris = []
+    for _ in range(count):
+        token_count = random.randint(1, 5)
+        uris.append('/' + '/'.join(random.choice(words) for _ in range(token_count)))
+    return uris
+
+
+def run(rounds: int, round_size: int):
+    random.seed(42)
+    words = sorted(word for word in word_spell.word_frequency.keys() if word.isalpha() and 4 <= len(word) <= 8)
+    words = random.sample(words, vocabulary_size)
+    drain = Drain(max_clusters=max_clusters, combine_min_url_count=3, extra_delimiters=['/'], param_str='{var}',
+                  leaf_split_threshold=64)
+
+    tracemalloc.start()
+    memory = []
+    for round_index in range(rounds):
+        uris = generate_uris(words, round_size)
+        start_time = time.perf_counter()
+        for uri in uris:
+            drain.add_log_message(uri)
+        took = time.perf_counter() - start_time
+        del uris
+        gc.collect()
+
+        nodes, cluster_refs = count_tree(drain.root_node)
+        memory.append(tracemalloc.get_traced_memory()[0])
+        print(f'round {round_index + 1:3}: {len(drain.id_to_cluster)} clusters, {nodes} tree nodes, '
+              f'{cluster_refs} cluster ids in tree, {memory[-1] / 10 ** 6:.2f} MB traced, '
+              f'{took / round_size * 10 ** 6:.1f} us/uri')
+    tracemalloc.stop()
+
+    # the first rounds fill the clusters up to max_clusters, compare the growth of the rest
+    half = len(memory) // 2
+    print(f'traced memory growth over the second half: {(memory[-1] - memory[half]) / 10 ** 6:+.2f} MB, '
+          f'over the first half: {(memory[half] - memory[0]) / 10 ** 6:+.2f} MB')
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 20, int(sys.argv[2]) if len(sys.argv) > 2 else 20000)
@@ -0,0 +1,78 @@
+#  Copyright 2023 SkyAPM org
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Compares the fast_match candidate counts and the latency of URI Drain without and with leaf splitting,
+on Endpoint200_hard.txt style URIs sharing deep prefixes (/api/v1/...).
+
+python -m demo.benchmark_leaf_split [uri count]
+"""
+
+import random
+import sys
+import time
+from os.path import dirname, join
+
+from models.uri_drain.uri_drain import Drain
+
+split_thresholds = [0, 16, 64]
+
+
+def generate_uris(count: int):
+    with open(join(dirname(__file__), 'Endpoint200_hard.txt')) as f:
+        words = sorted({token for line in f for token in line.strip().split('/') if token.isalpha() and len(token) > 2})
+    random.seed(42)
+    resources = random.sample(words, min(60, len(words)))
+    actions = random.sample(words, min(40, len(words)))
+    uris = []
+    for _ in range(count):
+        resource, action = random.choice(resources), random.choice(actions)
+        uri_id = random.choice([str(random.randint(1, 10 ** 6)), f'{random.randint(1, 999)}abc', 'xyz123'])
+        uris.append(random.choice([
+            f'/api/v1/{resource}/{uri_id}',
+            f'/api/v1/{resource}/{uri_id}/{action}',
+            f'/api/v1/{resource}/{action}/{uri_id}',
+        ]))
+    return uris
+
+
+def run(uris, leaf_split_threshold: int):
+    drain = Drain(combine_min_url_count=3, extra_delimiters=['/'], param_str='{var}', uri_cache_capacity=0,
+                  leaf_split_threshold=leaf_split_threshold)
+    candidate_counts = []
+    fast_match = drain.fast_match
+
+    def counting_fast_match(cluster_ids, *args, **kwargs):
+        candidate_counts.append(len(cluster_ids))
+        return fast_match(cluster_ids, *args, **kwargs)
+
+    drain.fast_match = counting_fast_match
+    start_time = time.perf_counter()
+    for uri in uris:
+        drain.add_log_message(uri)
+    took = time.perf_counter() - start_time
+
+    candidate_counts.sort()
+    print(f'leaf_split_threshold={leaf_split_threshold:<4} '
+          f'latency {took / len(uris) * 10 ** 6:8.1f} us/uri, '
+          f'fast_match candidates mean {sum(candidate_counts) / len(candidate_counts):7.1f} '
+          f'p99 {candidate_counts[int(len(candidate_counts) * 0.99)]:5} max {candidate_counts[-1]:5}, '
+          f'{len(drain.cluster_patterns)} patterns')
+    return sorted(drain.cluster_patterns)
+
+
+if __name__ == '__main__':
+    uris = generate_uris(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
+    results = [run(uris, threshold) for threshold in split_thresholds]
+    print(f'same patterns: {all(result == results[0] for result in results)}')
@@ -0,0 +1,79 @@
+#  Copyright 2023 SkyAPM org
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Feeds many services in turn through the worker's miner cache, with and without a memory budget. With the budget,
+the least recently fed miners are saved and unloaded, so the resident memory stays flat as services keep coming.
+
+python -m demo.benchmark_miner_unloading [services] [memory budget in MB]
+"""
+
+import gc
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from models.uri_drain.persistence_handler import ServiceFilePersistenceHandler
+from models.uri_drain.snapshot_writer import get_shared_writer
+from models.uri_drain.template_miner import TemplateMiner
+from models.uri_drain.template_miner_config import TemplateMinerConfig
+from models.uri_drain.word_splitter import word_spell
+from servers.simple.worker import MinerCache, create_defaultdict_with_key
+
+uris_per_service = 2000
+
+
+def resident_memory_mb() -> float:
+    with open('/proc/self/statm') as file:
+        return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+
+
+def run(service_count: int, memory_budget_mb: float):
+    random.seed(42)
+    words = sorted(word for word in word_spell.word_frequency.keys() if word.isalpha() and 4 <= len(word) <= 8)
+    snapshot_dir = tempfile.mkdtemp()
+    config = TemplateMinerConfig()
+    config.drain_extra_delimiters = ['/']
+    config.snapshot_file_dir = snapshot_dir
+    config.snapshot_background_write = True
+
+    def create_miner(service):
+        return TemplateMiner(ServiceFilePersistenceHandler(snapshot_dir, service), config)
+
+    if memory_budget_mb > 0:
+        miners = MinerCache(create_miner, int(memory_budget_mb * 1024 * 1024))
+    else:
+        miners = create_defaultdict_with_key(create_miner)
+    print(f'memory budget: {f"{memory_budget_mb} MB" if memory_budget_mb > 0 else "unlimited"}')
+    start_time = time.perf_counter()
+    for index in range(service_count):
+        service = f'service-{index}'
+        vocabulary = random.sample(words, 100)
+        uris = ['/' + '/'.join(random.sample(vocabulary, 3)) for _ in range(uris_per_service)]
+        miner = miners[service]
+        miner.add_log_messages(uris)
+        miners[service] = miner
+        if (index + 1) % (service_count // 10 or 1) == 0:
+            gc.collect()
+            print(f'  {index + 1:5} services, {len(miners):5} loaded, {resident_memory_mb():7.1f} MB resident')
+    print(f'  took {time.perf_counter() - start_time:.1f} s')
+    get_shared_writer().flush()
+    shutil.rmtree(snapshot_dir)
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 500, float(sys.argv[2]) if len(sys.argv) > 2 else 0)
@@ -0,0 +1,106 @@
+#  Copyright 2023 SkyAPM org
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Compares the latency of fetchAllPatterns reads from the manager proxy of URIDrainResults and from the shared memory
+pattern store, with several processes polling at once like the OAP nodes do.
+
+python -m demo.benchmark_pattern_store [pattern count] [polling process counts...]
+
+Each poll reads the version of a service, and its patterns when the version changed since the last poll.
+The patterns of every service are fetched once published, then once more after an update.
+"""
+
+import sys
+import time
+from multiprocessing import Event, Process, Queue
+
+from servers.simple.pattern_store import SharedPatternStore
+from servers.simple.results_manager import ProxyURIDrainResultsManager, URIDrainResults
+
+service_count = 100
+polls = 2000
+
+
+def poll_services(shared_results_object, versions: dict):
+    version_took = fetch_took = 0.0
+    fetches = 0
+    for i in range(polls):
+        service = f'service-{i % service_count}'
+        start_time = time.perf_counter()
+        version = shared_results_object.get_version(service=service)
+        version_took += time.perf_counter() - start_time
+        if versions.get(service) != version:
+            start_time = time.perf_counter()
+            shared_results_object.get_dict_field(service)
+            fetch_took += time.perf_counter() - start_time
+            fetches += 1
+            versions[service] = version
+    return version_took / polls, fetch_took / max(fetches, 1)
+
+
+def poll(shared_results_object, published: Event, updated: Event, results: Queue):
+    versions = {}
+    published.wait()
+    version_took, first_fetch_took = poll_services(shared_results_object, versions)
+    results.put(None)
+    updated.wait()
+    _, update_fetch_took = poll_services(shared_results_object, versions)
+    results.put((version_took, first_fetch_took, update_fetch_took))
+
+
+def run(name: str, shared_results_object, pattern_count: int, process_count: int):
+    published, updated, results = Event(), Event(), Queue()
+    processes = [Process(target=poll, args=(shared_results_object, published, updated, results))
+                 for _ in range(process_count)]
+    for process in processes:
+        process.start()
+    # published once the pollers run, so they read the patterns they didn't see yet like the server process does
+    for index in range(service_count):
+        shared_results_object.set_dict_field(service=f'service-{index}',
+                                             value=[f'/api/v1/resource{n}/{{var}}' for n in range(pattern_count)])
+    published.set()
+    for _ in processes:
+        results.get()
+    # then a pattern is added to every service, which the pollers fetch again
+    for index in range(service_count):
+        shared_results_object.update_dict_field(service=f'service-{index}', added=['/api/v2/{var}'], removed=[])
+    updated.set()
+    took = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    version_took, first_fetch_took, update_fetch_took = (sum(column) / process_count for column in zip(*took))
+    print(f'  {name:<13} {process_count:2} pollers: get_version {version_took * 10 ** 6:7.1f} us, '
+          f'get_dict_field {first_fetch_took * 10 ** 6:7.1f} us, '
+          f'after an update {update_fetch_took * 10 ** 6:7.1f} us')
+
+
+if __name__ == '__main__':
+    pattern_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    process_counts = [int(arg) for arg in sys.argv[2:]] or [1, 4]
+    print(f'{service_count} services of {pattern_count} patterns')
+
+    ProxyURIDrainResultsManager.register("URIDrainResults", URIDrainResults)
+    manager = ProxyURIDrainResultsManager()
+    manager.start()
+    try:
+        for count in process_counts:
+            run('manager proxy', manager.URIDrainResults(), pattern_count, count)
+            store = SharedPatternStore.create()
+            try:
+                run('shared memory', store, pattern_count, count)
+            finally:
+                store.unlink()
+    finally:
+        manager.shutdown()
@@ -0,0 +1,62 @@
+#  Copyright 2023 SkyAPM org
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Compares the file per service and the SQLite persistence backends for many services: the time to write a snapshot
+and the patterns of every service through the background writer, and the time to list the services at startup.
+
+python -m demo.benchmark_persistence_backends [services]
+"""
+
+import json
+import shutil
+import sys
+import tempfile
+import time
+
+from demo.benchmark_snapshot_format import build_drain
+from models.uri_drain.snapshot_format import dump_drain
+from models.uri_drain.snapshot_writer import SnapshotWriter
+from models.uri_drain.template_miner import create_persistence_handler, load_existing_services
+from models.uri_drain.template_miner_config import TemplateMinerConfig
+
+
+def run(service_count: int):
+    drain = build_drain(100)
+    state = dump_drain(drain)
+    patterns = json.dumps(drain.cluster_patterns).encode('utf-8')
+    for backend in ('file', 'sqlite'):
+        config = TemplateMinerConfig()
+        config.snapshot_file_dir = tempfile.mkdtemp()
+        config.snapshot_backend = backend
+        handlers = [create_persistence_handler(config, f'service-{index}') for index in range(service_count)]
+
+        writer = SnapshotWriter()
+        start_time = time.perf_counter()
+        for persistence_handler in handlers:
+            writer.submit_state(persistence_handler, state, False, 'benchmark')
+            writer.submit_patterns(persistence_handler, patterns, len(drain.cluster_patterns))
+        writer.flush()
+        write_took = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        services = load_existing_services(config)
+        list_took = time.perf_counter() - start_time
+        assert len(services) == service_count
+        print(f'{backend:<7} {service_count} services: write {write_took:6.2f} s, list {list_took * 1000:7.1f} ms')
+        shutil.rmtree(config.snapshot_file_dir)
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,95 @@
+#  Copyright 2023 SkyAPM org
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Compares the save time, load time and size of the binary snapshot format with the former
+jsonpickle + zlib + base64 snapshots, for Drains of 1k, 10k and 100k clusters.
+
+python -m demo.benchmark_snapshot_format [cluster counts...]
+
+Building the Drain of 100k clusters takes several minutes, the snapshots of the Drains are timed only.
+"""
+
+import base64
+import random
+import sys
+import time
+import zlib
+
+import jsonpickle
+
+from models.uri_drain.snapshot_format import dump_drain, restore_drain
+from models.uri_drain.uri_drain import Drain, clear_interned_tokens
+from models.uri_drain.word_splitter import word_spell
+
+cluster_counts = [1000, 10000, 100000]
+
+
+def build_drain(cluster_count: int) -> Drain:
+    random.seed(42)
+    words = sorted(word for word in word_spell.word_frequency.keys() if word.isalpha() and 4 <= len(word) <= 8)
+    drain = Drain(max_clusters=cluster_count, combine_min_url_count=3, extra_delimiters=['/'], param_str='{var}',
+                  leaf_split_threshold=64)
+    while drain.clusters_counter < cluster_count:
+        uri = '/' + '/'.join(random.sample(words, 3))
+        drain.add_log_message(uri)
+        # a quarter of the clusters get parameters and url samples
+        if drain.clusters_counter % 4 == 0:
+            for _ in range(3):
+                drain.add_log_message(f'{uri}/{random.randint(1, 10 ** 6)}')
+    return drain
+
+
+def jsonpickle_save(drain: Drain) -> bytes:
+    return base64.b64encode(zlib.compress(jsonpickle.dumps(drain, keys=True).encode('utf-8')))
+
+
+def jsonpickle_load(drain: Drain, state: bytes):
+    loaded_drain = jsonpickle.loads(zlib.decompress(base64.b64decode(state)), keys=True)
+    drain.restore_clusters(loaded_drain.id_to_cluster, loaded_drain.clusters_counter, loaded_drain.root_node,
+                           loaded_drain.token_dictionary)
+
+
+def binary_save(drain: Drain) -> bytes:
+    return dump_drain(drain)
+
+
+def binary_load(drain: Drain, state: bytes):
+    restore_drain(drain, state)
+
+
+def run(cluster_count: int):
+    drain = build_drain(cluster_count)
+    patterns = sorted(drain.cluster_patterns)
+    print(f'{len(drain.id_to_cluster)} clusters, {len(drain.token_dictionary)} tokens')
+    for name, save, load in (('jsonpickle', jsonpickle_save, jsonpickle_load), ('binary', binary_save, binary_load)):
+        start_time = time.perf_counter()
+        state = save(drain)
+        save_took = time.perf_counter() - start_time
+
+        restored = Drain(max_clusters=cluster_count, combine_min_url_count=3, extra_delimiters=['/'],
+                         param_str='{var}')
+        # load as a process just started, whose tokens are not classified yet
+        clear_interned_tokens()
+        start_time = time.perf_counter()
+        load(restored, state)
+        load_took = time.perf_counter() - start_time
+        assert sorted(restored.cluster_patterns) == patterns
+        print(f'  {name:<10} save {save_took * 1000:8.1f} ms, load {load_took * 1000:8.1f} ms, '
+              f'{len(state) / 1024:9.1f} KiB')
+
+
+if __name__ == '__main__':
+    for count in [int(arg) for arg in sys.argv[1:]] or cluster_counts:
+        run(count)
@@ -0,0 +1,427 @@
+# Copyright 2023 SkyAPM org
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import base64
+import os
+import threading
+import time
+import zlib
+
+import jsonpickle
+import pytest
+from cachetools import LRUCache
+
+from models.uri_drain import snapshot_format, uri_drain
+from models.uri_drain.persistence_handler import PersistenceHandler, ServiceFilePersistenceHandler
+from models.uri_drain.snapshot_format import dump_drain, is_binary_snapshot, restore_drain
+from models.uri_drain.snapshot_writer import SnapshotWriter
+from models.uri_drain.sqlite_persistence_handler import SqlitePersistenceHandler, get_store
+from models.uri_drain.template_miner import TemplateMiner, create_persistence_handler, iter_existing_miners, \
+    load_existing_patterns, load_existing_services
+from models.uri_drain.template_miner_config import TemplateMinerConfig
+from models.uri_drain.uri_drain import Drain, clear_interned_tokens, intern_token
+
+demo_dir = os.path.join(os.path.dirname(__file__), '..', '..', 'demo')
+
+
+def load_demo_uris(file_name):
+    with open(os.path.join(demo_dir, file_name)) as f:
+        return f.read().splitlines()
+
+
+def assert_statistics_match_clusters(drain):
+    assert drain.pattern_count == len(drain.clusters)
+    assert drain.total_cluster_size == sum(cluster.size for cluster in drain.id_to_cluster.values())
+    assert drain.publishable_cluster_count == sum(
+        1 for cluster in drain.id_to_cluster.values()
+        if cluster.latest_urls and len(cluster.latest_urls) >= drain.combine_min_url_count)
+
+
+@pytest.mark.parametrize('max_clusters', [None, 16])
+def test_statistics_follow_clusters(max_clusters):
+    drain = Drain(max_clusters=max_clusters, combine_min_url_count=3, extra_delimiters=['/'], param_str='{var}')
+    for uri in load_demo_uris('Endpoint200_hard.txt'):
+        drain.add_log_message(uri)
+        assert_statistics_match_clusters(drain)
+
+    if max_clusters is not None:
+        assert len(drain.id_to_cluster) == max_clusters
+
+
+def test_pattern_changes_follow_clusters():
+    drain = Drain(max_clusters=32, combine_min_url_count=3, extra_delimiters=['/'], param_str='{var}')
+    published, revision = set(), 0
+    for index, uri in enumerate(load_demo_uris('Endpoint200_hard_3k_repeat.txt')):
+        drain.add_log_message(uri)
+        if index % 50:
+            continue
+        changes = drain.get_pattern_changes(revision)
+        assert changes.revision >= revision
+        published = published.difference(changes.removed).union(changes.added)
+        revision = changes.revision
+        assert published == set(cluster.get_template() for cluster in drain.clusters)
+        assert published == set(drain.cluster_patterns)
+
+    revision = drain.refresh_patterns()
+    assert drain.get_pattern_changes(revision + 1) is None
+    assert drain.get_pattern_changes(revision) == (revision, [], [])
+
+
+@pytest.mark.parametrize("max_clusters", [None, 8])
+def test_batch_matches_one_by_one(max_clusters):
+    uris = load_demo_uris('Endpoint100_trivial_3k_repeat.txt')
+    if max_clusters is None:
+        uris = sorted(uris)
+    one_by_one = Drain(max_clusters=max_clusters, combine_min_url_count=3, extra_delimiters=['/'], param_str='{var}')
+    for uri in uris:
+        one_by_one.add_log_message(uri)
+    batch = Drain(max_clusters=max_clusters, combine_min_url_count=3, extra_delimiters=['/'], param_str='{var}')
+    result = batch.add_log_messages(uris)
+
+    assert result['message_count'] == len(uris)
+    assert result['unique_message_count'] == len(set(uris))
+    if max_clusters is None:
+        assert sum(result['change_counts'].values()) == len(set(uris))
+    else:
+        # the same clusters are evicted
+        assert batch.id_to_cluster.keys_by_recency() == one_by_one.id_to_cluster.keys_by_recency()
+    assert sorted(batch.cluster_patterns) == sorted(one_by_one.cluster_patterns)
+    assert batch.get_total_cluster_size() == one_by_one.get_total_cluster_size()
+    assert_statistics_match_clusters(batch)
+
+
+def test_uri_cache_invalidation():
+    drain = Drain(max_clusters=2, combine_min_url_count=3, extra_delimiters=['/'], param_str='{var}')
+    cluster, _ = drain.add_log_message('/api/users/abc123')
+    assert drain.add_cached_message('/api/users/abc123', 1) is cluster
+
+    # the template of the cluster changes, so the cached entry must not be used anymore
+    _, change_type = drain.add_log_message('/api/users/def456')
+    assert change_type == 'cluster_template_changed'
+    assert drain.add_cached_message('/api/users/abc123', 1) is None
+    assert drain.add_log_message('/api/users/abc123') == (cluster, 'none')
+
+    # the cluster gets evicted by newer ones
+    drain.add_log_message('/api/orders')
+    drain.add_log_message('/api/books/list/all')
+    assert cluster.cluster_id not in drain.id_to_cluster
+    assert drain.add_cached_message('/api/users/abc123', 1) is None
+    assert_statistics_match_clusters(drain)
+
+
+def test_cluster_urls_stop_at_publishable_count():
+    drain = Drain(combine_min_url_count=3, extra_delimiters=['/'], param_str='{var}')
+    for user_id in range(10):
+        cluster, _ = drain.add_log_message(f'/api/users/abc{user_id}')
+    assert cluster.latest_urls == ('/api/users/abc0', '/api/users/abc1', '/api/users/abc2')
+    assert drain.cluster_patterns == ['/api/users/{var}']
+
+    # snapshots of former versions hold the urls in an LRUCache
+    cluster.latest_urls = LRUCache(4)
+    cluster.latest_urls.update({'/api/users/abc8': True, '/api/users/abc9': True})
+    drain.restore_clusters(drain.id_to_cluster, drain.clusters_counter, drain.root_node, drain.token_dictionary)
+    assert cluster.latest_urls == ('/api/users/abc8', '/api/users/abc9')
+    assert sorted(drain.cluster_patterns) == ['/api/users/abc8', '/api/users/abc9']
+
+
+def test_interned_token_classification():
+    assert intern_token('orders') is intern_token('orders')
+    orders, version, domain, number = (intern_token(token) for token in ('orders', 'v12', 'www.apache.org', '42'))
+    assert orders.word_correct and not orders.has_digits
+    assert version.is_version and version.has_digits and not version.is_digit
+    assert domain.has_dot and not domain.word_correct
+    assert number.is_digit and not number.is_version
+
+
+def test_token_dictionary_compaction(monkeypatch):
+    uris = load_demo_uris('Endpoint200_hard_3k_repeat.txt')
+    reference = Drain(max_clusters=64, combine_min_url_count=3, extra_delimiters=['/'], param_str='{var}')
+    for uri in uris:
+        reference.add_log_message(uri)
+
+    monkeypatch.setattr(Drain, 'min_token_dictionary_compaction_size', 64)
+    drain = Drain(max_clusters=64, combine_min_url_count=3, extra_delimiters=['/'], param_str='{var}')
+    for uri in uris:
+        drain.add_log_message(uri)
+
+    assert len(drain.token_dictionary) < len(reference.token_dictionary)
+    assert drain.token_dictionary.tokens[0] == '{var}'
+    assert sorted(drain.cluster_patterns) == sorted(reference.cluster_patterns)
+    for cluster in drain.id_to_cluster.values():
+        assert all(token_id < len(drain.token_dictionary) for token_id in cluster.template_ids)
+
+
+@pytest.mark.parametrize('max_clusters', [None, 32])
+def test_numpy_match_engine_matches_python(monkeypatch, max_clusters):
+    pytest.importorskip('numpy')
+    from models.uri_drain.leaf_matcher import VectorLeafMatcher
+    monkeypatch.setattr(VectorLeafMatcher, 'min_leaf_size', 1)
+
+    drains = [Drain(max_clusters=max_clusters, combine_min_url_count=3, extra_delimiters=['/'], param_str='{var}',
+                    uri_cache_capacity=0, match_engine=match_engine) for match_engine in ('python', 'numpy')]
+    for uri in load_demo_uris('Endpoint200_hard.txt') + load_demo_uris('Endpoint100_counterexamples.txt'):
+        if not uri.strip():
+            continue
+        python_result, numpy_result = (drain.add_log_message(uri) for drain in drains)
+        assert python_result[0].cluster_id == numpy_result[0].cluster_id
+        assert python_result[1] == numpy_result[1]
+        python_match, numpy_match = (drain.match(uri, 'fallback') for drain in drains)
+        assert getattr(python_match, 'cluster_id', None) == getattr(numpy_match, 'cluster_id', None)
+
+
+@pytest.mark.parametrize('max_clusters', [None, 32])
+def test_leaf_splitting_matches_unsplit(max_clusters):
+    drains = [Drain(max_clusters=max_clusters, combine_min_url_count=3, extra_delimiters=['/'], param_str='{var}',
+                    uri_cache_capacity=0, leaf_split_threshold=leaf_split_threshold)
+              for leaf_split_threshold in (0, 2)]
+    for uri in load_demo_uris('Endpoint200_hard.txt') + load_demo_uris('Endpoint100_counterexamples.txt'):
+        if not uri.strip():
+            continue
+        unsplit_result, split_result = (drain.add_log_message(uri) for drain in drains)
+        assert unsplit_result[0].cluster_id == split_result[0].cluster_id
+        assert unsplit_result[1] == split_result[1]
+        unsplit_match, split_match = (drain.match(uri, 'fallback') for drain in drains)
+        assert getattr(unsplit_match, 'cluster_id', None) == getattr(split_match, 'cluster_id', None)
+    assert drains[1].leaf_splitter.leaf_indexes
+
+
+def test_evicted_clusters_leave_the_tree():
+    drain = Drain(max_clusters=16, combine_min_url_count=3, extra_delimiters=['/'], param_str='{var}',
+                  leaf_split_threshold=2)
+    for uri in load_demo_uris('Endpoint200_hard.txt'):
+        drain.add_log_message(uri)
+
+    tree_cluster_ids = []
+    nodes = [drain.root_node]
+    while nodes:
+        node = nodes.pop()
+        assert node is drain.root_node or node.cluster_ids or node.key_to_child_node
+        tree_cluster_ids.extend(node.cluster_ids)
+        nodes.extend(node.key_to_child_node.values())
+    assert sorted(tree_cluster_ids) == sorted(drain.id_to_cluster)
+    assert set(drain.cluster_id_to_tree_path) == set(drain.id_to_cluster)
+    assert set(drain.leaf_splitter.cluster_id_to_leaf) <= set(drain.id_to_cluster)
+
+
+
+@pytest.mark.parametrize('journal_max_records', [1000, 5])
+def test_journal_restores_clusters(tmp_path, journal_max_records):
+    config = TemplateMinerConfig()
+    config.drain_extra_delimiters = ['/']
+    config.drain_combine_min_url_count = 3
+    config.drain_max_clusters = 16
+    config.snapshot_journal_enabled = True
+    config.snapshot_journal_max_records = journal_max_records
+    miner = TemplateMiner(ServiceFilePersistenceHandler(str(tmp_path), 'service'), config)
+    for uri in load_demo_uris('Endpoint200_hard.txt'):
+        miner.add_log_message(uri)
+    # journal the sizes added by the messages since the last change
+    miner.save_state('test')
+
+    restored = TemplateMiner(ServiceFilePersistenceHandler(str(tmp_path), 'service'), config).drain
+    drain = miner.drain
+    assert {cluster_id: (cluster.get_template(), cluster.size, cluster.latest_urls)
+            for cluster_id, cluster in drain.id_to_cluster.items()} == \
+           {cluster_id: (cluster.get_template(), cluster.size, cluster.latest_urls)
+            for cluster_id, cluster in restored.id_to_cluster.items()}
+    assert restored.cluster_id_to_tree_path.keys() == drain.cluster_id_to_tree_path.keys()
+    assert restored.clusters_counter == drain.clusters_counter
+    assert sorted(restored.cluster_patterns) == sorted(drain.cluster_patterns)
+
+
+def test_journal_falls_back_to_full_states(tmp_path):
+    class StateOnlyPersistenceHandler(ServiceFilePersistenceHandler):
+        # claims a journal, but keeps none
+        append_journal = PersistenceHandler.append_journal
+
+    config = TemplateMinerConfig()
+    config.drain_extra_delimiters = ['/']
+    config.snapshot_journal_enabled = True
+    miner = TemplateMiner(StateOnlyPersistenceHandler(str(tmp_path), 'service'), config)
+    for uri in load_demo_uris('Endpoint200_hard.txt'):
+        miner.add_log_message(uri)
+    assert not miner.journal_enabled
+    miner.save_state('test')
+
+    restored = TemplateMiner(ServiceFilePersistenceHandler(str(tmp_path), 'service'), config).drain
+    assert sorted(restored.cluster_patterns) == sorted(miner.drain.cluster_patterns)
+    assert restored.get_total_cluster_size() == miner.drain.get_total_cluster_size()
+
+
+def test_saved_patterns_load_without_state(tmp_path):
+    config = TemplateMinerConfig()
+    config.drain_extra_delimiters = ['/']
+    config.drain_combine_min_url_count = 3
+    config.snapshot_file_dir = str(tmp_path)
+    config.snapshot_journal_enabled = True
+    config.snapshot_lazy_load = True
+    persistence_handler = ServiceFilePersistenceHandler(str(tmp_path), 'service')
+    miner = TemplateMiner(persistence_handler, config)
+    for uri in load_demo_uris('Endpoint200_hard.txt'):
+        miner.add_log_message(uri)
+    assert load_existing_patterns(config) == {'service': miner.drain.cluster_patterns}
+
+    # the patterns of a state saved without them are saved on its first load,
+    # journal the urls added since the last change first
+    miner.save_state('test')
+    os.remove(persistence_handler.patterns_file_path)
+    assert sorted(load_existing_patterns(config)['service']) == sorted(miner.drain.cluster_patterns)
+    assert os.path.isfile(persistence_handler.patterns_file_path)
+
+
+def test_sqlite_backend_restores_services(tmp_path):
+    config = TemplateMinerConfig()
+    config.drain_extra_delimiters = ['/']
+    config.snapshot_file_dir = str(tmp_path)
+    config.snapshot_backend = 'sqlite'
+    config.snapshot_journal_enabled = True
+    config.snapshot_background_write = True
+    uris = load_demo_uris('Endpoint200_hard.txt')
+    miners = {service: TemplateMiner(create_persistence_handler(config, service), config) for service in ('a', 'b')}
+    for service, miner in miners.items():
+        miner.add_log_messages(uris if service == 'a' else uris[:20])
+        miner.save_state('periodic')
+        miner.flush()
+
+    assert sorted(load_existing_services(config)) == ['a', 'b']
+    for metadata in get_store(str(tmp_path)).load_service_metadata():
+        drain = miners[metadata.service].drain
+        assert metadata.pattern_count == len(drain.cluster_patterns) and metadata.version >= 1
+        restored = TemplateMiner(create_persistence_handler(config, metadata.service), config).drain
+        assert sorted(restored.cluster_patterns) == sorted(drain.cluster_patterns)
+    assert not os.path.exists(os.path.join(tmp_path, 'services'))
+    assert [service for service, _ in iter_existing_miners(config, lambda service: service == 'b')] == ['b']
+
+
+def test_snapshot_writer_throttles_outside_transactions(tmp_path):
+    store = get_store(str(tmp_path))
+    handlers = [SqlitePersistenceHandler(str(tmp_path), service) for service in ('a', 'b')]
+    # the second state waits half a second for the rate cap
+    writer = SnapshotWriter(max_bytes_per_sec=2000)
+    for persistence_handler in handlers:
+        writer.submit_state(persistence_handler, b'x' * 1000, False, 'test')
+    time.sleep(0.1)
+    start_time = time.monotonic()
+    store.execute('SELECT 1')
+    assert time.monotonic() - start_time < 0.2
+    assert writer.flush(10)
+    assert [persistence_handler.load_state() for persistence_handler in handlers] == [b'x' * 1000] * 2
+
+
+def test_binary_snapshot_restores_clusters(tmp_path):
+    drain = Drain(max_clusters=32, combine_min_url_count=3, extra_delimiters=['/'], param_str='{var}')
+    for uri in load_demo_uris('Endpoint200_hard.txt'):
+        drain.add_log_message(uri)
+
+    for compress in (True, False):
+        restored = Drain(max_clusters=32, combine_min_url_count=3, extra_delimiters=['/'], param_str='{var}')
+        restore_drain(restored, dump_drain(drain, compress))
+        assert restored.id_to_cluster.keys_by_recency() == drain.id_to_cluster.keys_by_recency()
+        assert sorted(restored.cluster_patterns) == sorted(drain.cluster_patterns)
+        assert restored.cluster_id_to_tree_path.keys() == drain.cluster_id_to_tree_path.keys()
+        for cluster_id, cluster in drain.id_to_cluster.items():
+            restored_cluster = restored.id_to_cluster.get(cluster_id)
+            assert (restored_cluster.get_template(), restored_cluster.size, restored_cluster.latest_urls) == \
+                   (cluster.get_template(), cluster.size, cluster.latest_urls)
+
+    # snapshots of former versions are jsonpickle dumps
+    config = TemplateMinerConfig()
+    config.drain_extra_delimiters = ['/']
+    config.drain_combine_min_url_count = 3
+    config.drain_max_clusters = 32
+    persistence_handler = ServiceFilePersistenceHandler(str(tmp_path), 'service')
+    persistence_handler.save_state(base64.b64encode(zlib.compress(jsonpickle.dumps(drain, keys=True).encode())))
+    miner = TemplateMiner(persistence_handler, config)
+    assert miner.drain.cluster_patterns == drain.cluster_patterns
+    miner.save_state('test')
+    assert is_binary_snapshot(persistence_handler.load_state())
+
+
+def test_binary_snapshot_keeps_eviction_order():
+    uris = load_demo_uris('Endpoint200_hard.txt')
+    half = len(uris) // 2
+    drain = Drain(max_clusters=20, combine_min_url_count=3, extra_delimiters=['/'], param_str='{var}')
+    for uri in uris[:half]:
+        drain.add_log_message(uri)
+    restored = Drain(max_clusters=20, combine_min_url_count=3, extra_delimiters=['/'], param_str='{var}')
+    restore_drain(restored, dump_drain(drain))
+    assert restored.id_to_cluster.keys_by_recency() == drain.id_to_cluster.keys_by_recency()
+
+    # the restored drain evicts the same clusters as the uninterrupted one
+    for uri in uris[half:]:
+        drain.add_log_message(uri)
+        restored.add_log_message(uri)
+    assert restored.id_to_cluster.keys_by_recency() == drain.id_to_cluster.keys_by_recency()
+    assert sorted(restored.cluster_patterns) == sorted(drain.cluster_patterns)
+
+
+def test_snapshot_word_flags_checked_when_words_change(monkeypatch):
+    drain = Drain(combine_min_url_count=3, extra_delimiters=['/'], param_str='{var}')
+    for uri in load_demo_uris('Endpoint200_hard.txt'):
+        drain.add_log_message(uri)
+    state = dump_drain(drain)
+    checked_tokens = []
+
+    def check_all_word_correct(token):
+        checked_tokens.append(token)
+        return False
+
+    monkeypatch.setattr(uri_drain, 'check_all_word_correct', check_all_word_correct)
+    for fingerprint_changed in (False, True):
+        if fingerprint_changed:
+            monkeypatch.setattr(snapshot_format, 'words_fingerprint', lambda: 'changed')
+        clear_interned_tokens()
+        restored = Drain(combine_min_url_count=3, extra_delimiters=['/'], param_str='{var}')
+        checked_tokens.clear()
+        restore_drain(restored, state)
+        if fingerprint_changed:
+            assert len(checked_tokens) == len(drain.token_dictionary) - 1
+        else:
+            assert not checked_tokens
+            assert [token.word_correct for token in restored.token_dictionary.tokens] == \
+                   [token.word_correct for token in drain.token_dictionary.tokens]
+    clear_interned_tokens()
+
+
+
+def test_snapshot_writer_collapses_pending_states(tmp_path):
+    class BlockingPersistenceHandler(ServiceFilePersistenceHandler):
+        saved_states = []
+        writing, release = threading.Event(), threading.Event()
+
+        def save_state(self, state):
+            self.writing.set()
+            self.release.wait(10)
+            self.saved_states.append(state)
+            super().save_state(state)
+
+    persistence_handler = BlockingPersistenceHandler(str(tmp_path), 'service')
+    writer = SnapshotWriter()
+    writer.submit_state(persistence_handler, b'state 0', False, 'test')
+    assert persistence_handler.writing.wait(10)
+    # written while the first state is being written, only the last state and the journal following it remain
+    writer.submit_state(persistence_handler, b'state 1', False, 'test')
+    writer.submit_journal(persistence_handler, b'journal 1')
+    writer.submit_state(persistence_handler, b'state 2', False, 'test')
+    writer.submit_journal(persistence_handler, b'journal 2')
+    persistence_handler.release.set()
+    assert writer.flush(10)
+
+    assert persistence_handler.saved_states == [b'state 0', b'state 2']
+    assert persistence_handler.load_state() == b'state 2'
+    assert persistence_handler.load_journal() == [b'journal 2']
+    assert os.listdir(os.path.join(tmp_path, 'services')) == [os.path.basename(persistence_handler.file_path)]
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
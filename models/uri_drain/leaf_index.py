@@ -0,0 +1,214 @@
+# Copyright 2023 SkyAPM org
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import bisect
+from typing import Dict, List, Optional, Sequence
+
+
+class LeafIndex:
+    """
+    A bucket of the clusters of a prefix tree leaf, split by their template token at a position once it grows
+    above the split threshold. cluster_ids keeps the order of the leaf (ascending cluster ids) and is replaced,
+    never mutated, when clusters are added or removed.
+    """
+    __slots__ = ["cluster_ids", "position", "word_buckets", "other_bucket"]
+
+    def __init__(self, cluster_ids: List[int]):
+        self.cluster_ids = cluster_ids
+        # position of the token the bucket is split on, None while it isn't split
+        self.position: Optional[int] = None
+        # clusters whose template token is a correct word, by token id
+        self.word_buckets: Dict[int, LeafIndex] = {}
+        # clusters whose template token is the parameter or not a word
+        self.other_bucket: Optional[LeafIndex] = None
+
+    def buckets(self) -> List["LeafIndex"]:
+        return [*self.word_buckets.values(), self.other_bucket]
+
+    def walk(self):
+        yield self
+        if self.position is not None:
+            for bucket in self.buckets():
+                yield from bucket.walk()
+
+
+EMPTY_LEAF_INDEX = LeafIndex([])
+
+
+class LeafSplitter:
+    """
+    Modified:: Adaptive index of the prefix tree leaves holding more clusters than the split threshold,
+    so a log message is only scored against the clusters that can match it.
+
+    Drain.get_seq_distance rejects a cluster whose template token differs from the log token when either of them
+    is a correct word (the parameter token excepted on the template side). So at the split position a log token
+    which is a correct word can only match the clusters with the very same token, any other log token only the
+    clusters with the parameter or a token which is not a word. The clusters left out would be rejected, or at
+    most score 0 by a domain mismatch, which only passes the similarity threshold of log messages whose tokens
+    all contain digits; those are matched against the whole leaf, so the matched clusters stay the same.
+    """
+
+    def __init__(self, drain, param_token_id: int, threshold: int):
+        self.drain = drain
+        self.param_token_id = param_token_id
+        self.threshold = threshold
+        self.leaf_indexes: Dict[object, LeafIndex] = {}
+        self.cluster_id_to_leaf: Dict[int, object] = {}
+
+    def clear(self):
+        self.leaf_indexes.clear()
+        self.cluster_id_to_leaf.clear()
+
+    def is_word(self, token_id: int) -> bool:
+        return token_id != self.param_token_id and self.drain.token_dictionary.tokens[token_id].word_correct
+
+    def find_candidates(self, leaf, tokens: Sequence):
+        """
+        :param leaf: prefix tree leaf the log message got to
+        :param tokens: parsed tokens of the log message
+        :return: the leaf itself or the bucket of it holding the clusters which can match the log message
+        """
+        if len(leaf.cluster_ids) <= self.threshold or all(token.has_digits for token in tokens):
+            return leaf
+        token_to_id = self.drain.token_dictionary.token_to_id
+        bucket = self.get_leaf_index(leaf)
+        while bucket.position is not None:
+            position = bucket.position
+            token_id = token_to_id.get(tokens[position])
+            if tokens[position].word_correct and token_id != self.param_token_id:
+                bucket = bucket.word_buckets.get(token_id, EMPTY_LEAF_INDEX)
+            else:
+                bucket = bucket.other_bucket
+        return bucket
+
+    def get_leaf_index(self, leaf) -> LeafIndex:
+        leaf_index = self.leaf_indexes.get(leaf)
+        if leaf_index is not None and leaf_index.cluster_ids is leaf.cluster_ids:
+            return leaf_index
+        if leaf_index is not None:
+            self.forget_leaf(leaf)
+
+        leaf_index = LeafIndex(leaf.cluster_ids)
+        for cluster_id in leaf.cluster_ids:
+            self.cluster_id_to_leaf[cluster_id] = leaf
+        # the tokens before are the path of the leaf in the prefix tree
+        self.split(leaf_index, self.drain.max_node_depth - 1)
+        self.leaf_indexes[leaf] = leaf_index
+        return leaf_index
+
+    def split(self, bucket: LeafIndex, position: int):
+        """Split the bucket on the token position, and its buckets above the threshold on the following ones."""
+        id_to_cluster = self.drain.id_to_cluster
+        clusters = [cluster for cluster in map(id_to_cluster.get, bucket.cluster_ids) if cluster is not None]
+        # all clusters of a leaf have the same token count
+        if not clusters or position >= len(clusters[0].template_ids):
+            return
+
+        bucket.position = position
+        bucket.word_buckets = {}
+        bucket.other_bucket = LeafIndex([])
+        for cluster in clusters:
+            self.bucket_of(bucket, cluster).cluster_ids.append(cluster.cluster_id)
+        for child in bucket.buckets():
+            if len(child.cluster_ids) > self.threshold:
+                self.split(child, position + 1)
+
+    def bucket_of(self, bucket: LeafIndex, cluster) -> LeafIndex:
+        token_id = cluster.template_ids[bucket.position]
+        if not self.is_word(token_id):
+            return bucket.other_bucket
+        word_bucket = bucket.word_buckets.get(token_id)
+        if word_bucket is None:
+            word_bucket = bucket.word_buckets[token_id] = LeafIndex([])
+        return word_bucket
+
+    def add_cluster(self, leaf, cluster, stale_removed: bool):
+        """The cluster was added to the leaf, whose cluster_ids got replaced."""
+        leaf_index = self.leaf_indexes.get(leaf)
+        if leaf_index is None:
+            return
+        if stale_removed:
+            self.forget_leaf(leaf)
+            return
+
+        self.cluster_id_to_leaf[cluster.cluster_id] = leaf
+        leaf_index.cluster_ids = leaf.cluster_ids
+        bucket = leaf_index
+        while bucket.position is not None:
+            bucket = self.bucket_of(bucket, cluster)
+            bucket.cluster_ids = bucket.cluster_ids + [cluster.cluster_id]
+        if len(bucket.cluster_ids) > self.threshold:
+            self.split_following(leaf_index, bucket, cluster)
+
+    def move_cluster(self, cluster, old_template_ids):
+        """The template of the cluster changed, move it to the buckets of its new template."""
+        leaf_index = self.leaf_indexes.get(self.cluster_id_to_leaf.get(cluster.cluster_id))
+        if leaf_index is None:
+            return
+        cluster_id = cluster.cluster_id
+        self.remove_from_buckets(leaf_index, cluster_id, old_template_ids)
+
+        bucket = leaf_index
+        while bucket.position is not None:
+            bucket = self.bucket_of(bucket, cluster)
+            cluster_ids = bucket.cluster_ids.copy()
+            # keep the order of the leaf
+            bisect.insort(cluster_ids, cluster_id)
+            bucket.cluster_ids = cluster_ids
+        if len(bucket.cluster_ids) > self.threshold:
+            self.split_following(leaf_index, bucket, cluster)
+
+    def remove_cluster(self, leaf, cluster):
+        """The cluster was removed from the leaf, whose cluster_ids got replaced."""
+        self.cluster_id_to_leaf.pop(cluster.cluster_id, None)
+        leaf_index = self.leaf_indexes.get(leaf)
+        if leaf_index is None:
+            return
+        leaf_index.cluster_ids = leaf.cluster_ids
+        self.remove_from_buckets(leaf_index, cluster.cluster_id, cluster.template_ids)
+
+    def remove_from_buckets(self, leaf_index: LeafIndex, cluster_id: int, template_ids):
+        """Remove the cluster from the buckets its template leads to, dropping the word buckets left empty."""
+        bucket = leaf_index
+        while bucket.position is not None:
+            token_id = template_ids[bucket.position]
+            parent = bucket
+            bucket = parent.word_buckets[token_id] if self.is_word(token_id) else parent.other_bucket
+            bucket.cluster_ids = [other_id for other_id in bucket.cluster_ids if other_id != cluster_id]
+            if not bucket.cluster_ids and bucket is not parent.other_bucket:
+                del parent.word_buckets[token_id]
+                if self.drain.leaf_matcher is not None:
+                    for empty_bucket in bucket.walk():
+                        self.drain.leaf_matcher.forget_leaf(empty_bucket)
+                break
+
+    def split_following(self, leaf_index: LeafIndex, bucket: LeafIndex, cluster):
+        """Split the bucket on the position following the one of its parent, if there is any."""
+        position = self.drain.max_node_depth - 1
+        parent = leaf_index
+        while parent is not bucket:
+            position = parent.position + 1
+            parent = self.bucket_of(parent, cluster)
+        if position < len(cluster.template_ids):
+            self.split(bucket, position)
+
+    def forget_leaf(self, leaf):
+        leaf_index = self.leaf_indexes.pop(leaf, None)
+        if leaf_index is None:
+            return
+        for cluster_id in leaf_index.cluster_ids:
+            self.cluster_id_to_leaf.pop(cluster_id, None)
+        if self.drain.leaf_matcher is not None:
+            for bucket in leaf_index.walk():
+                self.drain.leaf_matcher.forget_leaf(bucket)
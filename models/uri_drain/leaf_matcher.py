@@ -0,0 +1,145 @@
+# Copyright 2023 SkyAPM org
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, Drain falls back to the python match engine without it
+    np = None
+
+
+class LeafMatrix:
+    """
+    The templates of the clusters of a prefix tree leaf as a token id matrix, one row per token position and
+    one column per cluster, with the per position flags the similarity rules of Drain.get_seq_distance depend on.
+    """
+    __slots__ = ["cluster_ids", "clusters", "template_ids", "word_mask", "domain_mask", "weights", "param_counts"]
+
+    def __init__(self, cluster_ids: List[int], clusters: list, tokens: list, param_token_id: int):
+        # the list of the leaf the matrix was built from, leaves replace the list when their clusters change
+        self.cluster_ids = cluster_ids
+        self.clusters = clusters
+        self.template_ids = np.ascontiguousarray(
+            np.array([cluster.template_ids for cluster in clusters], dtype=np.int64).T)
+
+        # classify each distinct token once
+        unique_ids, inverse = np.unique(self.template_ids, return_inverse=True)
+        unique_tokens = [tokens[token_id] for token_id in unique_ids.tolist()]
+        word_correct = np.array([token.word_correct for token in unique_tokens], dtype=bool)
+        is_digit = np.array([token.is_digit for token in unique_tokens], dtype=bool)
+        has_dot = np.array([token.has_dot for token in unique_tokens], dtype=bool)
+        inverse = inverse.reshape(self.template_ids.shape)
+
+        is_param = self.template_ids == param_token_id
+        # template token is a correct word and not the parameter, a different incoming token rejects the cluster
+        self.word_mask = word_correct[inverse] & ~is_param
+        # domain of the first two tokens, a different incoming token is a domain mismatch
+        self.domain_mask = has_dot[inverse][:2]
+        # similarity added by an equal incoming token, the parameter only adds to the parameter count
+        self.weights = np.where(is_param, 0.0, np.where(is_digit[inverse], 0.5, 1.0))
+        self.param_counts = is_param.sum(axis=0)
+
+
+class VectorLeafMatcher:
+    """
+    Modified:: Scores all clusters of a prefix tree leaf against a log message in one numpy pass,
+    with exactly the results of Drain.get_seq_distance and the candidate selection of Drain.fast_match.
+    """
+    # leaves with fewer clusters are scored by the python loop, the numpy overhead outweighs the gain there
+    min_leaf_size = 32
+
+    def __init__(self, drain, param_token_id: int):
+        if np is None:
+            raise ImportError("numpy is required by the numpy match engine")
+        self.drain = drain
+        self.param_token_id = param_token_id
+        self.leaf_matrices: Dict[object, LeafMatrix] = {}
+        self.cluster_id_to_leaf: Dict[int, object] = {}
+
+    def clear(self):
+        self.leaf_matrices.clear()
+        self.cluster_id_to_leaf.clear()
+
+    def forget_cluster(self, cluster_id: int):
+        """The cluster changed its template or was removed, the matrix of its leaf must be rebuilt."""
+        leaf = self.cluster_id_to_leaf.pop(cluster_id, None)
+        if leaf is not None:
+            self.leaf_matrices.pop(leaf, None)
+
+    def forget_leaf(self, leaf):
+        """The leaf is not used anymore."""
+        self.leaf_matrices.pop(leaf, None)
+
+    def get_leaf_matrix(self, leaf) -> LeafMatrix:
+        matrix = self.leaf_matrices.get(leaf)
+        if matrix is not None and matrix.cluster_ids is leaf.cluster_ids:
+            return matrix
+
+        drain = self.drain
+        clusters = []
+        for cluster_id in leaf.cluster_ids:
+            cluster = drain.id_to_cluster.get(cluster_id)
+            if cluster is not None:
+                clusters.append(cluster)
+                self.cluster_id_to_leaf[cluster_id] = leaf
+        matrix = LeafMatrix(leaf.cluster_ids, clusters, drain.token_dictionary.tokens, self.param_token_id)
+        self.leaf_matrices[leaf] = matrix
+        return matrix
+
+    def best_match(self, leaf, tokens: Sequence, token_ids: Sequence[int], include_params: bool) -> Tuple[
+            Optional[object], float]:
+        """
+        :param leaf: prefix tree node whose clusters are the candidates
+        :param tokens: parsed tokens of the log message
+        :param token_ids: ids of the tokens in the token dictionary of the Drain
+        :return: the best candidate and its similarity, (None, -1) if every candidate is rejected
+        """
+        matrix = self.get_leaf_matrix(leaf)
+        if not matrix.clusters:
+            return None, -1
+
+        cluster_count = len(matrix.clusters)
+        sim_tokens = np.zeros(cluster_count)
+        domain_mismatch = np.zeros(cluster_count, dtype=bool)
+        rejected = np.zeros(cluster_count, dtype=bool)
+        # get_seq_distance stops at the first position of either a domain mismatch or a rejection,
+        # a cluster is only rejected if it wasn't stopped by a domain mismatch before
+        for index, (token_id, token) in enumerate(zip(token_ids, tokens)):
+            mismatch = matrix.template_ids[index] != token_id
+            if index < 2:
+                domain_mismatch |= mismatch & matrix.domain_mask[index] & ~rejected
+            if token.word_correct:
+                rejected |= mismatch & ~domain_mismatch
+            else:
+                rejected |= mismatch & matrix.word_mask[index] & ~domain_mismatch
+            sim_tokens += np.where(mismatch, 0.0, matrix.weights[index])
+
+        param_counts = matrix.param_counts
+        if include_params:
+            sim_tokens += param_counts
+        sims = sim_tokens / len(tokens)
+
+        sims[domain_mismatch] = 0.0
+        sims[rejected] = -1.0
+        param_counts = np.where(domain_mismatch, 0, np.where(rejected, -1, param_counts))
+
+        # fast_match keeps the first candidate with the highest similarity, then the highest parameter count
+        max_sim = sims.max()
+        candidates = sims == max_sim
+        max_param_count = param_counts[candidates].max()
+        if max_sim == -1 and max_param_count == -1:
+            return None, -1
+        best = np.flatnonzero(candidates & (param_counts == max_param_count))[0]
+        return matrix.clusters[best], float(max_sim)
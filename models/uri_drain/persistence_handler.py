@@ -1,8 +1,28 @@
 # SPDX-License-Identifier: MIT
 import base64
+import contextlib
 import os
 from abc import ABC, abstractmethod
 from pathlib import Path
+from typing import List, Optional
+
+
+# suffix of the files being written, base64 encoded service names never contain a dot
+TEMP_FILE_SUFFIX = '.tmp'
+
+
+def fsync_directory(path):
+    """Persist the entries of the directory, e.g. a file renamed into it. Not supported on every platform."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
 
 
 class PersistenceHandler(ABC):
@@ -19,19 +39,59 @@ class PersistenceHandler(ABC):
     def get_service(self):
         pass
 
+    def batch(self):
+        """
+        Context of a batch of writes, e.g. of several services, that the handler may commit together.
+        Handlers sharing a storage return nested contexts of the same batch.
+        """
+        return contextlib.nullcontext()
+
+    # optional journal of the changes saved after the last full state, handlers without it
+    # get a full state saved on every change
+    def supports_journal(self) -> bool:
+        return False
+
+    def append_journal(self, record: bytes) -> bool:
+        """:return: False if the record isn't kept, the changes must be saved in a full state instead"""
+        return False
+
+    def load_journal(self) -> List[bytes]:
+        return []
+
+    def clear_journal(self):
+        pass
+
+    # optional patterns of the last saved state, published at startup before the state itself is loaded,
+    # the pattern count is the length of the encoded list
+    def save_patterns(self, patterns: bytes, pattern_count: int):
+        pass
+
+    def load_patterns(self) -> Optional[bytes]:
+        return None
+
 
 class ServiceFilePersistenceHandler(PersistenceHandler):
 
     def __init__(self, base_dir, service):
         self.service_name = service
-        self.file_path = os.path.join(base_dir, 'services', base64.b64encode(service.encode('utf-8')).decode('utf-8'))
+        file_name = base64.b64encode(service.encode('utf-8')).decode('utf-8')
+        self.file_path = os.path.join(base_dir, 'services', file_name)
+        # kept apart from the services directory, which lists the services
+        self.journal_file_path = os.path.join(base_dir, 'journals', file_name)
+        self.patterns_file_path = os.path.join(base_dir, 'patterns', file_name)
         path = Path(self.file_path)
         path.parent.mkdir(parents=True, exist_ok=True)
         path.touch(exist_ok=True)
 
     def save_state(self, state):
-        with open(self.file_path, 'wb') as file:
+        # written aside and renamed over the former state, so a crash never leaves a truncated state behind
+        temp_file_path = self.file_path + TEMP_FILE_SUFFIX
+        with open(temp_file_path, 'wb') as file:
             file.write(state)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_file_path, self.file_path)
+        fsync_directory(os.path.dirname(self.file_path))
 
     def load_state(self):
         with open(self.file_path, 'rb') as file:
@@ -40,6 +100,40 @@ class ServiceFilePersistenceHandler(PersistenceHandler):
     def get_service(self):
         return self.service_name
 
+    def supports_journal(self) -> bool:
+        return True
+
+    def append_journal(self, record: bytes) -> bool:
+        Path(self.journal_file_path).parent.mkdir(parents=True, exist_ok=True)
+        with open(self.journal_file_path, 'ab') as file:
+            file.write(record + b'\n')
+        return True
+
+    def load_journal(self) -> List[bytes]:
+        if not os.path.isfile(self.journal_file_path):
+            return []
+        with open(self.journal_file_path, 'rb') as file:
+            return file.read().splitlines()
+
+    def clear_journal(self):
+        if os.path.isfile(self.journal_file_path):
+            os.remove(self.journal_file_path)
+
+    def save_patterns(self, patterns: bytes, pattern_count: int):
+        # renamed over the former patterns so they are never read half written, a lost update only
+        # makes the patterns published at startup older than the state
+        Path(self.patterns_file_path).parent.mkdir(parents=True, exist_ok=True)
+        temp_file_path = self.patterns_file_path + TEMP_FILE_SUFFIX
+        with open(temp_file_path, 'wb') as file:
+            file.write(patterns)
+        os.replace(temp_file_path, self.patterns_file_path)
+
+    def load_patterns(self) -> Optional[bytes]:
+        if not os.path.isfile(self.patterns_file_path):
+            return None
+        with open(self.patterns_file_path, 'rb') as file:
+            return file.read()
+
 
 class ServicePersistentLoader:
 
@@ -50,6 +144,8 @@ class ServicePersistentLoader:
         services = []
         if os.path.isdir(self.file_path):
             for entry in os.listdir(self.file_path):
+                if entry.endswith(TEMP_FILE_SUFFIX):
+                    continue
                 if os.path.isfile(os.path.join(self.file_path, entry)):
                     services.append(base64.b64decode(entry.encode('utf-8')).decode('utf-8'))
         return services
@@ -0,0 +1,244 @@
+# Copyright 2023 SkyAPM org
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Binary snapshot format of the Drain state.
+
+A snapshot is a header (MAGIC, format version, flags) followed by the body, zlib compressed when FLAG_COMPRESSED is
+set. The body is the list of fields of the schema of its version, each one a typed column of values:
+the token dictionary, the cluster table, the prefix tree in pre-order
+and the url samples of the clusters. Adding a field means adding a new version with its own schema.
+"""
+
+import struct
+import sys
+import zlib
+from array import array
+from typing import List, NamedTuple, Optional
+
+from models.uri_drain.uri_drain import Drain, LogCluster, LogClusterCache, Node, Token, TokenDictionary, \
+    interned_tokens
+from models.uri_drain.word_splitter import words_fingerprint
+
+MAGIC = b'URIDRAIN'
+FORMAT_VERSION = 3
+FLAG_COMPRESSED = 1
+
+HEADER = struct.Struct('<8sHH')
+COLUMN_HEADER = struct.Struct('<cQ')
+
+# column type of a list of strings, stored as their utf-8 lengths ('I') followed by the joined utf-8 bytes
+STRINGS = 's'
+
+SCHEMAS = {
+    1: (
+        ("clusters_counter", 'Q'),
+        # token id -> token, the parameter token first
+        ("tokens", STRINGS),
+        # cluster table, one entry per cluster
+        ("cluster_ids", 'Q'),
+        ("cluster_sizes", 'Q'),
+        ("template_lengths", 'I'),
+        ("template_ids", 'I'),
+        ("url_counts", 'I'),
+        ("urls", STRINGS),
+        # prefix tree in pre-order, one entry per node but the root: children of the root are keyed by token count,
+        # the deeper nodes by token id
+        ("root_child_count", 'I'),
+        ("node_keys", 'I'),
+        ("node_child_counts", 'I'),
+        ("node_cluster_counts", 'I'),
+        ("node_cluster_ids", 'Q'),
+    ),
+}
+SCHEMAS[2] = SCHEMAS[1] + (
+    # sequence number of the last journal record included in the snapshot
+    ("journal_sequence", 'Q'),
+)
+SCHEMAS[3] = SCHEMAS[2] + (
+    # whether each token is made of correct words, trusted on load while the known words have the same fingerprint
+    ("words_fingerprint", STRINGS),
+    ("token_word_correct", 'B'),
+)
+
+SnapshotState = NamedTuple("SnapshotState", [("id_to_cluster", dict), ("clusters_counter", int),
+                                             ("root_node", Node), ("token_dictionary", TokenDictionary),
+                                             ("journal_sequence", int)])
+
+
+def is_binary_snapshot(data: bytes) -> bool:
+    return data[:len(MAGIC)] == MAGIC
+
+
+def dump_drain(drain: Drain, compress: bool = True) -> bytes:
+    """Serialize the clusters, the prefix tree and the token dictionary of the Drain."""
+    columns = {name: [] if typecode == STRINGS else array(typecode) for name, typecode in SCHEMAS[FORMAT_VERSION]}
+    columns["clusters_counter"].append(drain.clusters_counter)
+    columns["journal_sequence"].append(drain.journal_sequence)
+    columns["tokens"] = [str(token) for token in drain.token_dictionary.tokens]
+    columns["words_fingerprint"] = [words_fingerprint()]
+    columns["token_word_correct"] = bytes(token.word_correct for token in drain.token_dictionary.tokens)
+
+    id_to_cluster = drain.id_to_cluster
+    # written from the least to the most recently used, load_drain inserts them back in this order so the restored
+    # cache evicts the same clusters as the live one would
+    cluster_ids = id_to_cluster.keys_by_recency() if isinstance(id_to_cluster, LogClusterCache) \
+        else list(id_to_cluster)
+    columns["cluster_ids"].extend(cluster_ids)
+    cluster_sizes, template_lengths, template_ids = \
+        columns["cluster_sizes"], columns["template_lengths"], columns["template_ids"]
+    url_counts, urls = columns["url_counts"], columns["urls"]
+    for cluster_id in cluster_ids:
+        cluster = id_to_cluster.get(cluster_id)
+        cluster_sizes.append(cluster.size)
+        template_lengths.append(len(cluster.template_ids))
+        template_ids.extend(cluster.template_ids)
+        url_counts.append(len(cluster.latest_urls))
+        urls.extend(cluster.latest_urls)
+
+    node_keys, node_child_counts = columns["node_keys"], columns["node_child_counts"]
+    node_cluster_counts, node_cluster_ids = columns["node_cluster_counts"], columns["node_cluster_ids"]
+    stack = [(int(key), child) for key, child in reversed(drain.root_node.key_to_child_node.items())]
+    while stack:
+        key, node = stack.pop()
+        node_keys.append(key)
+        node_child_counts.append(len(node.key_to_child_node))
+        node_cluster_counts.append(len(node.cluster_ids))
+        node_cluster_ids.extend(node.cluster_ids)
+        stack.extend(reversed(node.key_to_child_node.items()))
+    columns["root_child_count"].append(len(drain.root_node.key_to_child_node))
+
+    body = b''.join(encode_column(columns[name], typecode) for name, typecode in SCHEMAS[FORMAT_VERSION])
+    snapshot = HEADER.pack(MAGIC, FORMAT_VERSION, 0) + body
+    return compress_snapshot(snapshot) if compress else snapshot
+
+
+def restore_drain(drain: Drain, data: bytes):
+    """Restore the Drain from a snapshot written by dump_drain."""
+    snapshot = load_drain(data, drain.param_str, drain.max_clusters)
+    drain.restore_clusters(snapshot.id_to_cluster, snapshot.clusters_counter, snapshot.root_node,
+                           snapshot.token_dictionary)
+    drain.journal_sequence = snapshot.journal_sequence
+
+
+def compress_snapshot(data: bytes) -> bytes:
+    """Compress an uncompressed snapshot, e.g. off the thread that dumped it."""
+    magic, version, flags = HEADER.unpack_from(data)
+    if flags & FLAG_COMPRESSED:
+        return data
+    return HEADER.pack(magic, version, flags | FLAG_COMPRESSED) + zlib.compress(memoryview(data)[HEADER.size:])
+
+
+def load_drain(data: bytes, param_str: str, max_clusters: Optional[int]) -> SnapshotState:
+    """
+    Deserialize a snapshot written by dump_drain, the result is meant to be passed to Drain.restore_clusters.
+    :param max_clusters: max number of clusters of the Drain the state is restored to
+    """
+    magic, version, flags = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("not a binary Drain snapshot")
+    schema = SCHEMAS.get(version)
+    if schema is None:
+        raise ValueError(f"unsupported Drain snapshot version {version}")
+    body = memoryview(data)[HEADER.size:]
+    if flags & FLAG_COMPRESSED:
+        body = memoryview(zlib.decompress(body))
+
+    offset = 0
+    columns = {}
+    for name, typecode in schema:
+        columns[name], offset = decode_column(body, offset, typecode)
+
+    token_dictionary = TokenDictionary(param_str)
+    # the tokens are interned by Drain.restore_clusters, which refreshes the dictionary anyway,
+    # the ones not interned yet are only checked again if the known words changed since the snapshot
+    if columns.get("words_fingerprint") == [words_fingerprint()]:
+        # the tokens interned already are shared by the services restored before
+        interned_token = interned_tokens.get
+        token_dictionary.tokens = [interned_token(token) or Token(token, bool(word_correct))
+                                   for token, word_correct in zip(columns["tokens"], columns["token_word_correct"])]
+    else:
+        token_dictionary.tokens = columns["tokens"]
+
+    id_to_cluster = {} if max_clusters is None else LogClusterCache(maxsize=max_clusters)
+    template_ids, urls = columns["template_ids"], columns["urls"]
+    template_offset = url_offset = 0
+    for cluster_id, size, template_length, url_count in zip(columns["cluster_ids"], columns["cluster_sizes"],
+                                                            columns["template_lengths"], columns["url_counts"]):
+        cluster = LogCluster.__new__(LogCluster)
+        cluster.token_dictionary = token_dictionary
+        cluster.template_ids = template_ids[template_offset:template_offset + template_length]
+        cluster.cluster_id = cluster_id
+        cluster.size = size
+        cluster.latest_urls = tuple(urls[url_offset:url_offset + url_count])
+        template_offset += template_length
+        url_offset += url_count
+        id_to_cluster[cluster_id] = cluster
+
+    root_node = Node()
+    nodes = iter(zip(columns["node_keys"], columns["node_child_counts"], columns["node_cluster_counts"]))
+    node_cluster_ids = columns["node_cluster_ids"].tolist()
+    cluster_id_offset = 0
+
+    def read_children(parent: Node, child_count: int, key_type):
+        nonlocal cluster_id_offset
+        for _ in range(child_count):
+            key, grandchild_count, cluster_count = next(nodes)
+            node = Node()
+            parent.key_to_child_node[key_type(key)] = node
+            if cluster_count:
+                node.cluster_ids = node_cluster_ids[cluster_id_offset:cluster_id_offset + cluster_count]
+                cluster_id_offset += cluster_count
+            read_children(node, grandchild_count, int)
+
+    read_children(root_node, columns["root_child_count"][0], str)
+    journal_sequence = columns["journal_sequence"][0] if "journal_sequence" in columns else 0
+    return SnapshotState(id_to_cluster, columns["clusters_counter"][0], root_node, token_dictionary, journal_sequence)
+
+
+def encode_column(values, typecode: str) -> bytes:
+    if typecode == STRINGS:
+        encoded = [value.encode('utf-8') for value in values]
+        return encode_column(array('I', map(len, encoded)), 'I') + encode_column(b''.join(encoded), 'B')
+    if typecode == 'B':
+        return COLUMN_HEADER.pack(b'B', len(values)) + values
+    if sys.byteorder == 'big':
+        values = array(typecode, values)
+        values.byteswap()
+    return COLUMN_HEADER.pack(typecode.encode(), len(values)) + values.tobytes()
+
+
+def decode_column(body: memoryview, offset: int, typecode: str):
+    if typecode == STRINGS:
+        lengths, offset = decode_column(body, offset, 'I')
+        blob, offset = decode_column(body, offset, 'B')
+        values: List[str] = []
+        position = 0
+        for length in lengths:
+            values.append(str(blob[position:position + length], 'utf-8'))
+            position += length
+        return values, offset
+
+    stored_typecode, count = COLUMN_HEADER.unpack_from(body, offset)
+    if stored_typecode.decode() != typecode:
+        raise ValueError(f"corrupted Drain snapshot, expected a column of type {typecode}")
+    offset += COLUMN_HEADER.size
+    if typecode == 'B':
+        return bytes(body[offset:offset + count]), offset + count
+    values = array(typecode)
+    end = offset + count * values.itemsize
+    values.frombytes(body[offset:end])
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values, end
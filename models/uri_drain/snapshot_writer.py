@@ -0,0 +1,184 @@
+# Copyright 2023 SkyAPM org
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import atexit
+import contextlib
+import itertools
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Set
+
+import logger
+from models.uri_drain.persistence_handler import PersistenceHandler
+from models.uri_drain.snapshot_format import compress_snapshot
+
+logger = logger.init_logger(name=__name__)
+
+# a full state (WRITE_STATE), a journal record (WRITE_JOURNAL) or the patterns (WRITE_PATTERNS) of a service,
+# the reason is logged if it fails, the pattern count is the number of patterns written
+PendingWrite = NamedTuple("PendingWrite", [("kind", str), ("data", bytes), ("compress", bool), ("reason", str),
+                                           ("pattern_count", int)])
+WRITE_STATE = "state"
+WRITE_JOURNAL = "journal"
+WRITE_PATTERNS = "patterns"
+
+
+class SnapshotWriter:
+    """
+    Writes the snapshots and journal records of all services on a background thread, off the URI processing path.
+
+    The writes of a service are written in the order they were submitted. A full state makes the states and journal
+    records of the service still pending before it useless, so they are dropped: repeated snapshots of a busy service
+    collapse into one.
+    The written bytes are capped at max_bytes_per_sec across all services, 0 doesn't cap them.
+    The writes of a service are written in a batch of its persistence handler, e.g. in one transaction, entered
+    only once they are compressed and throttled so a shared storage isn't held while the writer waits.
+    """
+
+    # max number of services taken off the pending writes at once
+    max_batch_size = 64
+
+    def __init__(self, max_bytes_per_sec: float = 0):
+        self.max_bytes_per_sec = max_bytes_per_sec
+        self.condition = threading.Condition()
+        # persistence handler -> writes pending for its service, services are written in the order they got pending
+        self.pending: Dict[PersistenceHandler, List[PendingWrite]] = {}
+        # persistence handlers whose writes are being written
+        self.writing: Set[PersistenceHandler] = set()
+        self.thread: Optional[threading.Thread] = None
+        # earliest time of the next write under the rate cap
+        self.next_write_time = 0.0
+
+    def submit_state(self, persistence_handler: PersistenceHandler, state: bytes, compress: bool, reason: str):
+        """
+        Write the full state of the service, then clear its journal.
+        :param state: an uncompressed binary snapshot, compressed by the writer thread if compress is set
+        """
+        with self.condition:
+            # the patterns pending are kept, they aren't part of the state
+            writes = [PendingWrite(WRITE_STATE, state, compress, reason, 0)]
+            writes.extend(pending_write for pending_write in self.pending.get(persistence_handler, ())
+                          if pending_write.kind == WRITE_PATTERNS)
+            self.pending[persistence_handler] = writes
+            self.start()
+            self.condition.notify_all()
+
+    def submit_journal(self, persistence_handler: PersistenceHandler, record: bytes):
+        with self.condition:
+            self.pending.setdefault(persistence_handler, []).append(PendingWrite(WRITE_JOURNAL, record, False, "", 0))
+            self.start()
+            self.condition.notify_all()
+
+    def submit_patterns(self, persistence_handler: PersistenceHandler, patterns: bytes, pattern_count: int):
+        """Write the patterns of the service, replacing its patterns still pending."""
+        with self.condition:
+            writes = [pending_write for pending_write in self.pending.get(persistence_handler, ())
+                      if pending_write.kind != WRITE_PATTERNS]
+            writes.append(PendingWrite(WRITE_PATTERNS, patterns, False, "", pattern_count))
+            self.pending[persistence_handler] = writes
+            self.start()
+            self.condition.notify_all()
+
+    def flush(self, timeout: Optional[float] = None, persistence_handler: Optional[PersistenceHandler] = None) -> bool:
+        """
+        Wait until the submitted writes are written.
+        :param persistence_handler: wait for the writes of its service only
+        :return: False if they aren't written when the timeout expires
+        """
+        if persistence_handler is None:
+            def written():
+                return not self.pending and not self.writing
+        else:
+            def written():
+                return persistence_handler not in self.pending and persistence_handler not in self.writing
+        with self.condition:
+            return self.condition.wait_for(written, timeout)
+
+    def start(self):
+        # the thread doesn't survive a fork, e.g. into the worker process, so it is checked on every submit
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self.run, name="snapshot-writer", daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending)
+                batch = {}
+                for persistence_handler in list(itertools.islice(self.pending, self.max_batch_size)):
+                    batch[persistence_handler] = self.pending.pop(persistence_handler)
+                self.writing = set(batch)
+            try:
+                self.write_batch(batch)
+            except Exception as e:
+                logger.error(f"Failed to write the snapshots of {len(batch)} services: {e}")
+            finally:
+                with self.condition:
+                    self.writing = set()
+                    self.condition.notify_all()
+
+    def write_batch(self, batch: Dict[PersistenceHandler, List[PendingWrite]]):
+        for persistence_handler, writes in batch.items():
+            pending_write = None
+            try:
+                data = []
+                for pending_write in writes:
+                    data.append(self.prepare(pending_write))
+                # a short transaction per service, the other threads and processes wait for the storage meanwhile
+                with persistence_handler.batch():
+                    for pending_write, write_data in zip(writes, data):
+                        self.write(persistence_handler, pending_write, write_data)
+            except Exception as e:
+                logger.error(f"Failed to write the snapshot of service <{persistence_handler.get_service()}>, "
+                             f"reason: {pending_write.reason if pending_write else ''}: {e}")
+
+    def prepare(self, pending_write: PendingWrite) -> bytes:
+        """The data to write, compressed if needed, once it fits under the rate cap."""
+        data = compress_snapshot(pending_write.data) if pending_write.compress else pending_write.data
+        self.wait_for_rate(len(data))
+        return data
+
+    def write(self, persistence_handler: PersistenceHandler, pending_write: PendingWrite, data: bytes):
+        if pending_write.kind == WRITE_JOURNAL:
+            if not persistence_handler.append_journal(data):
+                # the miner only journals to handlers supporting it, the changes wait for the next full state
+                logger.error(f"The journal record of service <{persistence_handler.get_service()}> isn't kept")
+            return
+        if pending_write.kind == WRITE_PATTERNS:
+            persistence_handler.save_patterns(data, pending_write.pattern_count)
+            return
+        persistence_handler.save_state(data)
+        persistence_handler.clear_journal()
+
+    def wait_for_rate(self, size: int):
+        if self.max_bytes_per_sec <= 0:
+            return
+        now = time.monotonic()
+        if self.next_write_time > now:
+            time.sleep(self.next_write_time - now)
+            now = self.next_write_time
+        self.next_write_time = now + size / self.max_bytes_per_sec
+
+
+shared_writer: Optional[SnapshotWriter] = None
+
+
+def get_shared_writer(max_bytes_per_sec: float = 0) -> SnapshotWriter:
+    """The writer shared by the template miners of the process, created with the rate cap of the first caller."""
+    global shared_writer
+    if shared_writer is None:
+        shared_writer = SnapshotWriter(max_bytes_per_sec)
+        # daemon threads are stopped at exit, the pending snapshots are written first
+        atexit.register(shared_writer.flush)
+    return shared_writer
@@ -0,0 +1,178 @@
+# Copyright 2023 SkyAPM org
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Persistence of all the services in a single SQLite database in WAL mode, instead of a file per service.
+
+The snapshot and the patterns of a service are stored in the columns of its row, next to the metadata of the service,
+which is indexed apart from the blobs so the services are listed without reading their snapshots.
+The writes made in a batch are committed in one transaction. Several processes may share the database, e.g. the
+workers, a writer waits up to BUSY_TIMEOUT_MS for the transaction of another one to commit.
+"""
+
+import contextlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+from models.uri_drain.persistence_handler import PersistenceHandler
+
+DATABASE_FILE_NAME = 'uri_drain.db'
+# max time a statement waits for the database locked by another connection before it fails
+BUSY_TIMEOUT_MS = 30000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS services (
+    service TEXT PRIMARY KEY,
+    state BLOB,
+    patterns BLOB,
+    version INTEGER NOT NULL DEFAULT 0,
+    pattern_count INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS services_metadata ON services (service, version, pattern_count, updated_at);
+CREATE TABLE IF NOT EXISTS journals (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    service TEXT NOT NULL,
+    record BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS journals_service ON journals (service, id);
+"""
+
+# version is the number of states saved, updated_at the time of the last write of the service
+ServiceMetadata = NamedTuple("ServiceMetadata", [("service", str), ("version", int), ("pattern_count", int),
+                                                 ("updated_at", float)])
+
+
+class SqliteStore:
+    """
+    The database of the services, shared by their persistence handlers. The connection is shared by the threads of the
+    process, one at a time, and opened again in a forked process.
+    """
+
+    def __init__(self, database_path: str):
+        self.database_path = database_path
+        self.lock = threading.RLock()
+        self.connection: Optional[sqlite3.Connection] = None
+        self.pid = None
+        # depth of the nested batches, the transaction is committed when the outermost one exits
+        self.batch_depth = 0
+
+    def connect(self) -> sqlite3.Connection:
+        if self.connection is None or self.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.database_path) or '.', exist_ok=True)
+            # transactions are begun explicitly, every statement out of a batch is committed on its own
+            self.connection = sqlite3.connect(self.database_path, isolation_level=None, check_same_thread=False)
+            self.connection.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            # a commit survives a crash of the process, the last ones may be lost on a power failure
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.connection.executescript(SCHEMA)
+            self.pid = os.getpid()
+        return self.connection
+
+    def execute(self, sql: str, parameters=()) -> list:
+        """Run the statement, the rows it selects are fetched before another thread gets the connection."""
+        with self.lock:
+            return self.connect().execute(sql, parameters).fetchall()
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Commit the writes made inside the batch in one transaction, batches can be nested."""
+        with self.lock:
+            connection = self.connect()
+            if self.batch_depth == 0:
+                # the write lock is taken up front, a deferred transaction upgraded later fails at once when
+                # another connection is writing, without waiting the busy timeout
+                connection.execute('BEGIN IMMEDIATE')
+            self.batch_depth += 1
+            try:
+                yield
+            except BaseException:
+                self.batch_depth -= 1
+                if self.batch_depth == 0:
+                    connection.execute('ROLLBACK')
+                raise
+            self.batch_depth -= 1
+            if self.batch_depth == 0:
+                connection.execute('COMMIT')
+
+    def load_services(self) -> List[str]:
+        return [metadata.service for metadata in self.load_service_metadata()]
+
+    def load_service_metadata(self) -> List[ServiceMetadata]:
+        rows = self.execute('SELECT service, version, pattern_count, updated_at FROM services '
+                            'INDEXED BY services_metadata')
+        return [ServiceMetadata(*row) for row in rows]
+
+
+stores: Dict[str, SqliteStore] = {}
+stores_lock = threading.Lock()
+
+
+def get_store(base_dir: str) -> SqliteStore:
+    """The store of the database in base_dir, shared by the handlers of the process."""
+    database_path = os.path.join(base_dir, DATABASE_FILE_NAME)
+    with stores_lock:
+        store = stores.get(database_path)
+        if store is None:
+            store = stores[database_path] = SqliteStore(database_path)
+        return store
+
+
+class SqlitePersistenceHandler(PersistenceHandler):
+
+    def __init__(self, base_dir, service):
+        self.service_name = service
+        self.store = get_store(base_dir)
+        self.store.execute('INSERT OR IGNORE INTO services (service, updated_at) VALUES (?, ?)',
+                           (service, time.time()))
+
+    def save_state(self, state):
+        self.store.execute('UPDATE services SET state = ?, version = version + 1, updated_at = ? WHERE service = ?',
+                           (state, time.time(), self.service_name))
+
+    def load_state(self):
+        rows = self.store.execute('SELECT state FROM services WHERE service = ?', (self.service_name,))
+        return bytes(rows[0][0]) if rows and rows[0][0] is not None else None
+
+    def get_service(self):
+        return self.service_name
+
+    def batch(self):
+        return self.store.batch()
+
+    def supports_journal(self) -> bool:
+        return True
+
+    def append_journal(self, record: bytes) -> bool:
+        self.store.execute('INSERT INTO journals (service, record) VALUES (?, ?)', (self.service_name, record))
+        return True
+
+    def load_journal(self) -> List[bytes]:
+        rows = self.store.execute('SELECT record FROM journals WHERE service = ? ORDER BY id', (self.service_name,))
+        return [bytes(row[0]) for row in rows]
+
+    def clear_journal(self):
+        self.store.execute('DELETE FROM journals WHERE service = ?', (self.service_name,))
+
+    def save_patterns(self, patterns: bytes, pattern_count: int):
+        self.store.execute('UPDATE services SET patterns = ?, pattern_count = ?, updated_at = ? WHERE service = ?',
+                           (patterns, pattern_count, time.time(), self.service_name))
+
+    def load_patterns(self) -> Optional[bytes]:
+        rows = self.store.execute('SELECT patterns FROM services WHERE service = ?', (self.service_name,))
+        return bytes(rows[0][0]) if rows and rows[0][0] is not None else None
@@ -1,12 +1,13 @@
 # SPDX-License-Identifier: MIT
 
 import base64
+import json
 import logger
 import re
 import time
 import zlib
-from collections import defaultdict
-from typing import Optional, List, NamedTuple
+from collections import defaultdict, Counter
+from typing import Callable, Dict, Optional, List, NamedTuple, Iterable, Iterator, Tuple
 
 import jsonpickle
 from cachetools import LRUCache, cachedmethod
@@ -15,8 +16,11 @@ from cachetools import LRUCache, cachedmethod
 from models.uri_drain.masking import LogMasker
 from models.uri_drain.persistence_handler import PersistenceHandler, ServicePersistentLoader, \
     ServiceFilePersistenceHandler
+from models.uri_drain.snapshot_format import dump_drain, is_binary_snapshot, restore_drain
+from models.uri_drain.snapshot_writer import get_shared_writer
+from models.uri_drain.sqlite_persistence_handler import SqlitePersistenceHandler, get_store
 from models.uri_drain.template_miner_config import TemplateMinerConfig
-from models.uri_drain.uri_drain import Drain, LogCluster
+from models.uri_drain.uri_drain import Drain, LogCluster, LogClusterCache
 from models.utils.simple_profiler import SimpleProfiler, NullProfiler, Profiler
 
 logger = logger.init_logger(name=__name__)
@@ -26,16 +30,104 @@ config_filename = 'drain3.ini'
 ExtractedParameter = NamedTuple("ExtractedParameter", [("value", str), ("mask_name", str)])
 
 
+def create_persistence_handler(config: TemplateMinerConfig, service: str) -> Optional[PersistenceHandler]:
+    """MODIFIED:: The persistence handler of the service in the configured snapshot backend."""
+    if config.snapshot_file_dir is None:
+        return None
+    if config.snapshot_backend == "file":
+        return ServiceFilePersistenceHandler(config.snapshot_file_dir, service)
+    if config.snapshot_backend == "sqlite":
+        return SqlitePersistenceHandler(config.snapshot_file_dir, service)
+    raise ValueError(f"Invalid snapshot backend: {config.snapshot_backend}, must be either 'file' or 'sqlite'")
+
+
+def load_existing_services(config: TemplateMinerConfig) -> List[str]:
+    if config.snapshot_backend == "sqlite":
+        return get_store(config.snapshot_file_dir).load_services()
+    return ServicePersistentLoader(config.snapshot_file_dir).load_services()
+
+
 def load_existing_miners(config: TemplateMinerConfig = None):
+    miners = defaultdict(TemplateMiner)
+    miners.update(iter_existing_miners(config))
+    return miners
+
+
+def iter_existing_miners(config: TemplateMinerConfig,
+                         owns_service: Callable[[str], bool] = None) -> Iterator[Tuple[str, "TemplateMiner"]]:
+    """
+    MODIFIED:: Load the miners of the existing services one by one, logging the progress.
+    :param owns_service: whether the caller loads the service, e.g. a worker loading its own services only
+    """
     if config.snapshot_file_dir is None:
         return
-    existing_services = ServicePersistentLoader(config.snapshot_file_dir).load_services()
-    miners = defaultdict(TemplateMiner)
+    existing_services = load_existing_services(config)
+    if owns_service is not None:
+        existing_services = [service for service in existing_services if owns_service(service)]
     if len(existing_services) > 0:
         logger.info(f'Detected {len(existing_services)} services from disk')
+        progress = RestoreProgress(len(existing_services))
         for service in existing_services:
-            miners[service] = TemplateMiner(ServiceFilePersistenceHandler(config.snapshot_file_dir, service), config)
-    return miners
+            miner = TemplateMiner(create_persistence_handler(config, service), config)
+            progress.restored(miner.loaded_state_size)
+            yield service, miner
+        progress.report()
+
+
+class RestoreProgress:
+    """MODIFIED:: Logs the progress and the throughput of loading the services, at most every report_interval_sec."""
+
+    report_interval_sec = 5
+
+    def __init__(self, service_count: int):
+        self.service_count = service_count
+        self.restored_count = 0
+        self.restored_bytes = 0
+        self.start_time = self.last_report_time = time.time()
+
+    def restored(self, state_size: int):
+        self.restored_count += 1
+        self.restored_bytes += state_size
+        if time.time() - self.last_report_time >= self.report_interval_sec:
+            self.report()
+
+    def report(self):
+        self.last_report_time = time.time()
+        took = max(self.last_report_time - self.start_time, 1e-6)
+        logger.info(f'Loaded {self.restored_count}/{self.service_count} services in {took:.1f} seconds, '
+                    f'{self.restored_count / took:.1f} services/s, {self.restored_bytes / took / 1024 / 1024:.1f} MB/s')
+
+
+def load_existing_patterns(config: TemplateMinerConfig = None,
+                           owns_service: Callable[[str], bool] = None) -> Dict[str, List[str]]:
+    """
+    MODIFIED:: Load the patterns saved aside the state of the existing services, without loading their states.
+    The states are loaded once the services are fed again. The state of a service saved without its patterns
+    is loaded here once, to save its patterns.
+    :param owns_service: whether the caller loads the service, see iter_existing_miners
+    """
+    if config.snapshot_file_dir is None:
+        return {}
+    existing_services = load_existing_services(config)
+    if owns_service is not None:
+        existing_services = [service for service in existing_services if owns_service(service)]
+    existing_patterns = {}
+    if len(existing_services) > 0:
+        logger.info(f'Detected {len(existing_services)} services from disk, loading their patterns')
+        for service in existing_services:
+            persistence_handler = create_persistence_handler(config, service)
+            patterns = persistence_handler.load_patterns()
+            if patterns is not None:
+                try:
+                    existing_patterns[service] = json.loads(patterns)
+                    continue
+                except ValueError:
+                    logger.warning(f"Failed to read the saved patterns of service <{service}>, loading its state")
+            miner = TemplateMiner(persistence_handler, config)
+            existing_patterns[service] = miner.drain.cluster_patterns
+            miner.save_patterns()
+            miner.flush()
+    return existing_patterns
 
 
 class TemplateMiner:
@@ -93,14 +185,32 @@ class TemplateMiner:
             # param_extra=param_extra,  # MODIFIED:: for URI Drain < It is now a dict since contains multiple types
             parametrize_numeric_tokens=self.config.parametrize_numeric_tokens,
             customized_words_file=self.config.customized_words_file,
+            uri_cache_capacity=self.config.drain_uri_cache_capacity,
+            match_engine=self.config.drain_match_engine,
+            leaf_split_threshold=self.config.drain_leaf_split_threshold,
         )
 
         self.masker = LogMasker(self.config.masking_instructions, self.config.mask_prefix, self.config.mask_suffix)
         self.parameter_extraction_cache = LRUCache(self.config.parameter_extraction_cache_capacity)
         self.last_save_time = time.time()
 
+        # MODIFIED:: changes are appended to a journal between full snapshots when the persistence supports it
+        self.journal_enabled = persistence_handler is not None and self.config.snapshot_journal_enabled \
+            and persistence_handler.supports_journal()
+        self.journal_record_count = 0
+        # size of the saved state loaded, 0 if none
+        self.loaded_state_size = 0
+        # number of messages added since the state was last saved, the state is up to date on disk while it is 0
+        self.unsaved_message_count = 0
+        # pattern revision of the drain whose patterns were saved last, None if they weren't saved by this miner
+        self.saved_pattern_revision = None
+        self.snapshot_writer = get_shared_writer(self.config.snapshot_max_write_mb_per_sec * 1024 * 1024) \
+            if persistence_handler is not None and self.config.snapshot_background_write else None
+
         if persistence_handler is not None:
             self.load_state()
+        if self.journal_enabled:
+            self.drain.start_journal()
 
     def load_state(self):
         logger.info(f"Checking for saved state of service {self.persistence_handler.get_service()}")
@@ -108,45 +218,128 @@ class TemplateMiner:
         state = self.persistence_handler.load_state()
         if state is None or state == b'':
             logger.info(f"Saved state not found of service {self.persistence_handler.get_service()}")
-            return
-
+        else:
+            self.load_snapshot(state)
+            self.loaded_state_size = len(state)
+        # a journal left by a run with the journal enabled is replayed even if it is disabled now
+        if self.persistence_handler.supports_journal():
+            self.load_journal()
+
+    def load_snapshot(self, state):
+        # MODIFIED:: snapshots are saved in the binary snapshot format, jsonpickle snapshots still load
+        if is_binary_snapshot(state):
+            restore_drain(self.drain, state)
+        else:
+            self.load_jsonpickle_snapshot(state)
+
+        logger.info(f"Restored {len(self.drain.id_to_cluster)} clusters ({self.drain.pattern_count} patterns) "
+                    f"built from {self.drain.get_total_cluster_size()} messages")
+
+    def load_jsonpickle_snapshot(self, state):
         if self.config.snapshot_compress_state:
             state = zlib.decompress(base64.b64decode(state))
 
         loaded_drain: Drain = jsonpickle.loads(state, keys=True)
 
-        # load all words into clusters
-        if len(loaded_drain.id_to_cluster) > 0:
-            for _, cluster in loaded_drain.id_to_cluster.items():
-                if isinstance(cluster, LogCluster):
-                    cluster.token_words_check()
-
         # json-pickle encoded keys as string by default, so we have to convert those back to int
         # this is only relevant for backwards compatibility when loading a snapshot of drain <= v0.9.1
         # which did not use json-pickle's keys=true
         if len(loaded_drain.id_to_cluster) > 0 and isinstance(next(iter(loaded_drain.id_to_cluster.keys())), str):
             loaded_drain.id_to_cluster = {int(k): v for k, v in list(loaded_drain.id_to_cluster.items())}
             if self.config.drain_max_clusters:
-                cache = LRUCache(maxsize=self.config.drain_max_clusters)
+                cache = LogClusterCache(maxsize=self.config.drain_max_clusters)
                 cache.update(loaded_drain.id_to_cluster)
                 loaded_drain.id_to_cluster = cache
 
-        self.drain.id_to_cluster = loaded_drain.id_to_cluster
-        self.drain.clusters_counter = loaded_drain.clusters_counter
-        self.drain.root_node = loaded_drain.root_node
-
-        logger.info(f"Restored {len(loaded_drain.clusters)} clusters "
-                    f"built from {loaded_drain.get_total_cluster_size()} messages")
+        # snapshots taken before templates were stored as token ids have no token dictionary
+        self.drain.restore_clusters(loaded_drain.id_to_cluster, loaded_drain.clusters_counter, loaded_drain.root_node,
+                                    getattr(loaded_drain, 'token_dictionary', None))
+        self.drain.journal_sequence = getattr(loaded_drain, 'journal_sequence', 0)
+
+    def load_journal(self):
+        records = []
+        for line in self.persistence_handler.load_journal():
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # the last record may have been cut short by a crash, the full state of its clusters is lost
+                logger.warning(f"Skipping the rest of the broken journal of service "
+                               f"{self.persistence_handler.get_service()}")
+                break
+        if not records:
+            return
+        self.drain.replay_journal(records)
+        self.journal_record_count = len(records)
+        logger.info(f"Replayed {len(records)} journal records, {len(self.drain.id_to_cluster)} clusters "
+                    f"({self.drain.pattern_count} patterns) built from {self.drain.get_total_cluster_size()} messages")
 
     def save_state(self, snapshot_reason):
-        state = jsonpickle.dumps(self.drain, keys=True).encode('utf-8')
-        if self.config.snapshot_compress_state:
-            state = base64.b64encode(zlib.compress(state))
+        # the journal is compacted into a full snapshot periodically, or once it has grown too long
+        if self.journal_enabled and snapshot_reason != "periodic" \
+                and self.journal_record_count < self.config.snapshot_journal_max_records:
+            self.save_journal()
+            self.save_patterns()
+            self.unsaved_message_count = 0
+            return
 
-        logger.info(f"Saving state of {len(self.drain.clusters)} clusters "
+        # the changes not journaled yet are part of the snapshot, which records the sequence of their record
+        if self.journal_enabled:
+            self.drain.take_journal()
+        # MODIFIED:: the background writer compresses and writes the snapshot off the URI processing path
+        compress_in_writer = self.snapshot_writer is not None and self.config.snapshot_compress_state
+        state = dump_drain(self.drain, self.config.snapshot_compress_state and not compress_in_writer)
+
+        logger.info(f"Saving state of {len(self.drain.id_to_cluster)} clusters ({self.drain.pattern_count} patterns) "
                     f"with {self.drain.get_total_cluster_size()} messages to service <{self.persistence_handler.get_service()}>, "
                     f"{len(state)} bytes, reason: {snapshot_reason}")
-        self.persistence_handler.save_state(state)
+        if self.snapshot_writer is not None:
+            # the writer clears the journal once the state is written
+            self.snapshot_writer.submit_state(self.persistence_handler, state, compress_in_writer, snapshot_reason)
+            self.journal_record_count = 0
+        else:
+            self.persistence_handler.save_state(state)
+            if self.journal_record_count:
+                self.persistence_handler.clear_journal()
+                self.journal_record_count = 0
+        self.save_patterns()
+        self.unsaved_message_count = 0
+
+    def save_journal(self):
+        record = self.drain.take_journal()
+        if record is None:
+            return
+        record = json.dumps(record, separators=(',', ':')).encode('utf-8')
+        if self.snapshot_writer is not None:
+            self.snapshot_writer.submit_journal(self.persistence_handler, record)
+        elif not self.persistence_handler.append_journal(record):
+            # the handler keeps no journal after all, the changes are saved in full states from now on
+            self.journal_enabled = False
+            self.drain.journal_cluster_ids = None
+            self.save_state("journal not kept")
+            return
+        self.journal_record_count += 1
+
+    def save_patterns(self):
+        """MODIFIED:: Save the patterns aside the state when they changed, see load_existing_patterns."""
+        revision = self.drain.refresh_patterns()
+        if revision == self.saved_pattern_revision:
+            return
+        pattern_count = len(self.drain.cluster_patterns)
+        patterns = json.dumps(self.drain.cluster_patterns, separators=(',', ':')).encode('utf-8')
+        if self.snapshot_writer is not None:
+            self.snapshot_writer.submit_patterns(self.persistence_handler, patterns, pattern_count)
+        else:
+            self.persistence_handler.save_patterns(patterns, pattern_count)
+        self.saved_pattern_revision = revision
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until the snapshots of the service submitted to the background writer are written.
+        :return: False if they aren't written when the timeout expires
+        """
+        if self.snapshot_writer is None:
+            return True
+        return self.snapshot_writer.flush(timeout, self.persistence_handler)
 
     def get_snapshot_reason(self, change_type, cluster_id):
         if change_type != "none":
@@ -173,15 +366,66 @@ class TemplateMiner:
             "cluster_id": cluster.cluster_id,
             "cluster_size": cluster.size,
             "template_mined": cluster.get_template(),
-            "cluster_count": len(self.drain.clusters)
+            "cluster_count": self.drain.pattern_count
         }
 
         if self.persistence_handler is not None:
             self.profiler.start_section("save_state")
+            self.unsaved_message_count += 1
             snapshot_reason = self.get_snapshot_reason(change_type, cluster.cluster_id)
             if snapshot_reason:
                 self.save_state(snapshot_reason)
                 self.last_save_time = time.time()
+            # the patterns change without a snapshot, e.g. once a cluster gets enough urls to be published,
+            # they are saved at once only if they are published at startup, otherwise with the next snapshot
+            if self.config.snapshot_lazy_load:
+                self.save_patterns()
+            self.profiler.end_section()
+
+        self.profiler.end_section("total")
+        self.profiler.report(self.config.profiling_report_sec)
+        return result
+
+    def add_log_messages(self, log_messages: Iterable[str]) -> dict:
+        """
+        Mask and add a batch of log messages. Each distinct message is masked once, and clustered once unless
+        max_clusters is set, see Drain.add_log_messages. The state is saved at most once, after the whole batch.
+
+        :param log_messages: log messages of the batch, may contain repetitions
+        :return: summary of the batch, see Drain.add_log_messages
+        """
+        self.profiler.start_section("total")
+
+        self.profiler.start_section("mask")
+        if self.drain.max_clusters is None:
+            masked_messages = Counter()
+            for log_message, count in Counter(log_messages).items():
+                masked_messages[self.masker.mask(log_message)] += count
+        else:
+            # the order of the messages decides the clusters evicted, it is kept
+            masked = {log_message: None for log_message in log_messages}
+            for log_message in masked:
+                masked[log_message] = self.masker.mask(log_message)
+            masked_messages = [masked[log_message] for log_message in log_messages]
+        self.profiler.end_section()
+
+        self.profiler.start_section("drain")
+        result = self.drain.add_log_messages(masked_messages)
+        self.profiler.end_section("drain")
+
+        if self.persistence_handler is not None:
+            self.profiler.start_section("save_state")
+            self.unsaved_message_count += result["message_count"]
+            changed_cluster_ids = result["changed_cluster_ids"]
+            change_type = "batch_changed" if changed_cluster_ids else "none"
+            snapshot_reason = self.get_snapshot_reason(change_type, f"{len(changed_cluster_ids)} clusters")
+            if snapshot_reason:
+                self.save_state(snapshot_reason)
+                self.last_save_time = time.time()
+            # the patterns change without a snapshot, e.g. once a cluster gets enough urls to be published,
+            # they are saved at once only if they are published at startup, otherwise with the next snapshot
+            if self.config.snapshot_lazy_load:
+                self.save_patterns()
             self.profiler.end_section()
 
         self.profiler.end_section("total")
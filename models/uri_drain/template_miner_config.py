@@ -22,6 +22,19 @@ class TemplateMinerConfig:
         self.snapshot_interval_minutes = 5
         self.snapshot_compress_state = True
         self.snapshot_file_dir = None
+        self.snapshot_backend = "file"
+        self.snapshot_journal_enabled = False
+        self.snapshot_journal_max_records = 1000
+        self.snapshot_background_write = False
+        self.snapshot_max_write_mb_per_sec = 0
+        self.snapshot_lazy_load = False
+        self.snapshot_memory_budget_mb = 0
+        self.feed_coalesce_window_sec = 1.0
+        self.feed_coalesce_max_uris = 10000
+        self.feed_queue_size = 64
+        self.feed_max_wait_sec = 5.0
+        self.worker_count = 1
+        self.worker_max_services = 16384
         self.drain_extra_delimiters = []
         self.drain_sim_th = 0.4
         self.drain_depth = 4
@@ -29,6 +42,9 @@ class TemplateMinerConfig:
         self.drain_max_clusters = None
         self.drain_analysis_min_url_count = 20
         self.drain_combine_min_url_count = 8
+        self.drain_uri_cache_capacity = 3000
+        self.drain_match_engine = "python"
+        self.drain_leaf_split_threshold = 0
         self.masking_instructions = []
         self.mask_prefix = "<"
         self.mask_suffix = ">"
@@ -46,6 +62,8 @@ class TemplateMinerConfig:
         section_snapshot = 'SNAPSHOT'
         section_drain = 'DRAIN'
         section_masking = 'MASKING'
+        section_feed = 'FEED'
+        section_worker = 'WORKER'
 
         self.engine = self.read_config_value(parser, section_drain, 'engine', str, self.engine)
 
@@ -61,6 +79,30 @@ class TemplateMinerConfig:
         file_path = self.read_config_value(parser, section_snapshot, 'file_path', str, None)
         if file_path:
             self.snapshot_file_dir = file_path
+        self.snapshot_backend = self.read_config_value(parser, section_snapshot, 'backend', str, self.snapshot_backend)
+        self.snapshot_journal_enabled = self.read_config_value(parser, section_snapshot, 'journal_enabled', bool,
+                                                               self.snapshot_journal_enabled)
+        self.snapshot_journal_max_records = self.read_config_value(parser, section_snapshot, 'journal_max_records',
+                                                                   int, self.snapshot_journal_max_records)
+        self.snapshot_background_write = self.read_config_value(parser, section_snapshot, 'background_write', bool,
+                                                                self.snapshot_background_write)
+        self.snapshot_max_write_mb_per_sec = self.read_config_value(parser, section_snapshot, 'max_write_mb_per_sec',
+                                                                    float, self.snapshot_max_write_mb_per_sec)
+        self.snapshot_lazy_load = self.read_config_value(parser, section_snapshot, 'lazy_load', bool,
+                                                         self.snapshot_lazy_load)
+        self.snapshot_memory_budget_mb = self.read_config_value(parser, section_snapshot, 'memory_budget_mb', float,
+                                                                self.snapshot_memory_budget_mb)
+
+        self.feed_coalesce_window_sec = self.read_config_value(parser, section_feed, 'coalesce_window_sec', float,
+                                                               self.feed_coalesce_window_sec)
+        self.feed_coalesce_max_uris = self.read_config_value(parser, section_feed, 'coalesce_max_uris', int,
+                                                             self.feed_coalesce_max_uris)
+        self.feed_queue_size = self.read_config_value(parser, section_feed, 'queue_size', int, self.feed_queue_size)
+        self.feed_max_wait_sec = self.read_config_value(parser, section_feed, 'max_wait_sec', float,
+                                                        self.feed_max_wait_sec)
+        self.worker_count = max(1, self.read_config_value(parser, section_worker, 'count', int, self.worker_count))
+        self.worker_max_services = self.read_config_value(parser, section_worker, 'max_services', int,
+                                                          self.worker_max_services)
 
         drain_extra_delimiters_str = self.read_config_value(parser, section_drain, 'extra_delimiters', str,
                                                             str(self.drain_extra_delimiters))
@@ -88,6 +130,12 @@ class TemplateMinerConfig:
                                                                   self.drain_combine_min_url_count)
         self.customized_words_file = self.read_config_value(parser, section_drain, 'customized_words_file', str,
                                                             self.customized_words_file)
+        self.drain_uri_cache_capacity = self.read_config_value(parser, section_drain, 'uri_cache_capacity', int,
+                                                               self.drain_uri_cache_capacity)
+        self.drain_match_engine = self.read_config_value(parser, section_drain, 'match_engine', str,
+                                                         self.drain_match_engine)
+        self.drain_leaf_split_threshold = self.read_config_value(parser, section_drain, 'leaf_split_threshold', int,
+                                                                 self.drain_leaf_split_threshold)
 
         masking_instructions = []
         masking_list = json.loads(masking_instructions_str)
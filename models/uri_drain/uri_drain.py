@@ -4,24 +4,66 @@
 # Again, it's further modified to suit URI clustering needs,
 # changes are kept minimal to avoid divergence from Drain3 upstream.
 # TODO Note:: Every change to upstream Drain3 algorithm MUST be commented starting with "Modified::"
-from typing import List, Dict, Sequence
+import bisect
+from array import array
+from collections import deque, Counter
+from typing import List, Dict, Sequence, NamedTuple, Optional, Iterable, Tuple, Mapping
 
 from cachetools import LRUCache, Cache
 
+from models.uri_drain.leaf_index import LeafSplitter
+from models.uri_drain.leaf_matcher import VectorLeafMatcher
 from models.uri_drain.word_splitter import check_all_word_correct, load_customized_words
 from models.utils.simple_profiler import Profiler, NullProfiler
 
 import logger
 
 
+PatternChanges = NamedTuple("PatternChanges", [("revision", int), ("added", list), ("removed", list)])
+
+
+def merge_pattern_changes(changes_list: Iterable[PatternChanges]) -> Tuple[list, list]:
+    """Net patterns added and removed by consecutive changes, oldest first."""
+    # pattern -> True if added, False if removed
+    net_changes = {}
+    for changes in changes_list:
+        for pattern in changes.added:
+            if net_changes.get(pattern) is False:
+                del net_changes[pattern]
+            else:
+                net_changes[pattern] = True
+        for pattern in changes.removed:
+            if net_changes.get(pattern) is True:
+                del net_changes[pattern]
+            else:
+                net_changes[pattern] = False
+    return ([pattern for pattern, is_added in net_changes.items() if is_added],
+            [pattern for pattern, is_added in net_changes.items() if not is_added])
+
+
 class LogCluster:  # TODO Modified:: Changed to URICluster
-    __slots__ = ["log_template_tokens", "cluster_id", "size", "latest_urls"]
+    # Modified:: the template is stored as an array of ids of the token dictionary of the Drain
+    __slots__ = ["template_ids", "token_dictionary", "cluster_id", "size", "latest_urls"]
 
-    def __init__(self, log_template_tokens: list, cluster_id: int, combine_min_url_count: int):
-        self.log_template_tokens = tuple(parse_token_list(log_template_tokens))
+    def __init__(self, log_template_tokens: list, cluster_id: int, token_dictionary: "TokenDictionary"):
+        self.token_dictionary = token_dictionary
+        self.template_ids = token_dictionary.encode(log_template_tokens)
         self.cluster_id = cluster_id
         self.size = 1
-        self.latest_urls = LRUCache(combine_min_url_count+1)
+        # Modified:: the first distinct urls of the cluster, up to the url count making it publishable.
+        # Only their count matters once the cluster is published, so they stop growing there.
+        self.latest_urls = ()
+
+    @property
+    def log_template_tokens(self) -> tuple:
+        return self.token_dictionary.decode(self.template_ids)
+
+    @log_template_tokens.setter
+    def log_template_tokens(self, tokens):
+        # snapshots of former versions restore the tokens before the cluster is attached to a token dictionary,
+        # they are kept as they are until Drain.restore_clusters encodes them
+        token_dictionary = getattr(self, 'token_dictionary', None)
+        self.template_ids = tuple(tokens) if token_dictionary is None else token_dictionary.encode(tokens)
 
     def get_template(self):
         # Modified:: Changed to join by slash instead of space for
@@ -30,10 +72,11 @@ class LogCluster:  # TODO Modified:: Changed to URICluster
         # or http(s)://user:password@www.domain.top_level_domain
         # REASONING:: domain can only appear in the first two tokens, so whenever a dot appears, it must be a domain?
         # Another part of domain handling is done in create_template when they are hiding behind http(s)://
-        first_token = self.log_template_tokens[0]
+        log_template_tokens = self.log_template_tokens
+        first_token = log_template_tokens[0]
         if ':' in first_token:  # It's a URI scheme!
             scheme = first_token
-            path = '/'.join(self.log_template_tokens[1:])
+            path = '/'.join(log_template_tokens[1:])
             # TODO: put this into the config file
             http_methods = ('OPTIONS', 'GET', 'HEAD', 'PUT', 'POST', 'DELETE', 'PATCH', 'TRACE', 'CONNECT')
             if scheme.startswith(http_methods):
@@ -43,42 +86,148 @@ class LogCluster:  # TODO Modified:: Changed to URICluster
 
             return template
         elif first_token[0].isupper() or '.' in first_token:  # It's something like HikariCP/Connection/getConnection
-            return '/'.join(self.log_template_tokens)
+            return '/'.join(log_template_tokens)
         else:
-            template = '/'.join(self.log_template_tokens)
+            template = '/'.join(log_template_tokens)
             return f'/{template}'
 
-    def adding_url(self, url: str):
+    def adding_url(self, url: str, max_url_count: int):
+        if len(self.latest_urls) >= max_url_count:
+            return
         # Remove spaces from the URL to ensure uniqueness
         url = url.replace(' ', '')
-        if self.latest_urls.__contains__(url):
+        if url in self.latest_urls:
             return
-        self.latest_urls[url] = True
+        self.latest_urls += (url,)
 
     def __str__(self):
         # return f"ID={str(self.cluster_id).ljust(5)} : size={str(self.size).ljust(10)}: {self.get_template()}"
         return f"size={str(self.size).ljust(10)}: {self.get_template()}"
 
-    def token_words_check(self):
-        self.log_template_tokens = parse_token_list(self.log_template_tokens)
-
 
 class Token(str):
-    __slots__ = ["token", "word_correct"]
+    """
+    Modified:: A token with its classification computed once, instances are shared through intern_token
+    and must never be modified.
+    """
+    __slots__ = ["word_correct", "has_digits", "is_digit", "is_version", "has_dot"]
+
+    def __new__(cls, token: str, word_correct: Optional[bool] = None):
+        """:param word_correct: whether the token is made of correct words, as checked before, None to check it"""
+        self = super().__new__(cls, token)
+        self.word_correct = check_all_word_correct(token) if word_correct is None else word_correct
+        self.has_digits = any(char.isdigit() for char in token)
+        self.is_digit = token.isdigit()
+        self.is_version = token.startswith('v') and token[1:].isdigit()
+        self.has_dot = '.' in token
+        return self
+
+    def __reduce__(self):
+        return intern_token, (str(self),)
+
+    # snapshots taken by former versions stored the token string a second time in `token`
+    @property
+    def token(self):
+        return str(self)
+
+    @token.setter
+    def token(self, _):
+        pass
+
+
+# Modified:: process wide table of interned tokens, bounded so high cardinality parameters can't grow it forever
+interned_tokens = LRUCache(100000)
+
+
+def intern_token(token: str) -> Token:
+    """Get the shared instance of the token, a Token not interned yet becomes the shared instance."""
+    interned = interned_tokens.get(token)
+    if interned is None:
+        interned = token if type(token) is Token else Token(token)
+        interned_tokens[token] = interned
+    return interned
+
+
+def clear_interned_tokens():
+    """The classification of tokens depends on the known words, so it must be dropped when they change."""
+    interned_tokens.clear()
+
+
+def parse_token_list(tokens: Sequence[str]) -> List[Token]:
+    return [token if type(token) is Token else intern_token(token) for token in tokens]
+
+
+# id of the parameter token in every token dictionary
+PARAM_TOKEN_ID = 0
+# id of tokens missing from a token dictionary, it is never stored
+UNKNOWN_TOKEN_ID = -1
+
+
+class TokenDictionary:
+    """
+    Modified:: Dictionary of the tokens used by the templates and the prefix tree of a Drain,
+    which store token ids instead of tokens. PARAM_TOKEN_ID is reserved for the parameter token.
+    """
 
-    def __new__(cls, token: str, word_correct: bool = False):
-        return super().__new__(cls, token)
+    def __init__(self, param_str: str):
+        self.tokens: List[Token] = [intern_token(param_str)]
+        self.token_to_id: Dict[str, int] = {self.tokens[PARAM_TOKEN_ID]: PARAM_TOKEN_ID}
 
-    def __init__(self, token: str, word_correct: bool):
-        self.token = token
-        self.word_correct = word_correct
+    def __len__(self):
+        return len(self.tokens)
 
+    def __getstate__(self):
+        return {"tokens": [str(token) for token in self.tokens]}
 
-def parse_token_list(tokens: List[str]) -> List[Token]:
-    result = []
-    for token in tokens:
-        result.append(Token(token, check_all_word_correct(token)))
-    return result
+    def __setstate__(self, state):
+        self.tokens = parse_token_list(state["tokens"])
+        self.token_to_id = {token: token_id for token_id, token in enumerate(self.tokens)}
+
+    def get_id(self, token: str) -> int:
+        """Get the id of the token, adding the token if it is not in the dictionary yet."""
+        token_id = self.token_to_id.get(token)
+        if token_id is None:
+            token_id = len(self.tokens)
+            token = intern_token(token)
+            self.tokens.append(token)
+            self.token_to_id[token] = token_id
+        return token_id
+
+    def find_ids(self, tokens: Sequence[str]) -> List[int]:
+        """Get the ids of the tokens without adding them, tokens not in the dictionary get UNKNOWN_TOKEN_ID."""
+        token_to_id = self.token_to_id
+        return [token_to_id.get(token, UNKNOWN_TOKEN_ID) for token in tokens]
+
+    def encode(self, tokens: Sequence[str]) -> array:
+        return array('I', [self.get_id(token) for token in tokens])
+
+    def decode(self, token_ids: Sequence[int]) -> tuple:
+        tokens = self.tokens
+        return tuple(tokens[token_id] for token_id in token_ids)
+
+    def refresh_tokens(self):
+        """
+        Intern the tokens again, so they share the tokens classified with the currently known words.
+        Tokens not interned yet keep their classification, e.g. the ones of a snapshot taken with the same words.
+        """
+        self.tokens = [intern_token(token) for token in self.tokens]
+        self.token_to_id = {token: token_id for token_id, token in enumerate(self.tokens)}
+
+    def compact(self, used_ids: set) -> Dict[int, int]:
+        """
+        Drop the tokens which are not used anymore.
+        :param used_ids: ids still in use
+        :return: old id -> new id of the kept tokens
+        """
+        id_map = {}
+        tokens = []
+        for token_id, token in enumerate(self.tokens):
+            if token_id == PARAM_TOKEN_ID or token_id in used_ids:
+                id_map[token_id] = len(tokens)
+                tokens.append(token)
+        self.tokens = tokens
+        self.token_to_id = {token: token_id for token_id, token in enumerate(tokens)}
+        return id_map
 
 
 class SingleURILogCluster:
@@ -103,6 +252,10 @@ class LogClusterCache(LRUCache):  # TODO Modified:: Changed to URICluster
     cache eviction algorithm when accessing elements.
     """
 
+    # Modified:: Drain registers a callback here to keep its statistics in sync with LRU evictions,
+    # declared on the class so snapshots taken before the callback existed still load
+    on_evict = None
+
     def __missing__(self, key):
         return None
 
@@ -113,16 +266,53 @@ class LogClusterCache(LRUCache):  # TODO Modified:: Changed to URICluster
         """
         return Cache.__getitem__(self, key)
 
+    def keys_by_recency(self) -> List[int]:
+        """
+        Modified:: The keys from the least to the most recently used, the order they are evicted in.
+        Inserting them in this order into an empty cache restores the same eviction order.
+        """
+        return list(self._LRUCache__order)
+
+    def popitem(self):
+        key, cluster = super().popitem()
+        if self.on_evict is not None:
+            self.on_evict(cluster)
+        return key, cluster
+
+    def __getstate__(self):
+        # the callback is bound to a live Drain, it must not end up in snapshots
+        state = self.__dict__.copy()
+        state.pop('on_evict', None)
+        return state
+
 
 class Node:
     __slots__ = ["key_to_child_node", "cluster_ids"]
 
     def __init__(self):
-        self.key_to_child_node: Dict[str, Node] = {}
+        # Modified:: children of the root are keyed by token count, the deeper ones by token id
+        self.key_to_child_node: Dict[object, Node] = {}
         self.cluster_ids: List[int] = []
 
 
 class DrainBase:
+    # Modified:: attributes derived from the clusters, they are rebuilt by restore_clusters instead of being snapshotted
+    derived_state = ("total_cluster_size", "publishable_cluster_count", "pattern_count", "pattern_revision",
+                     "pattern_history", "pattern_refcount", "cluster_id_to_patterns", "dirty_cluster_ids",
+                     "uri_cache", "token_dictionary_compaction_size", "leaf_matcher",
+                     "leaf_splitter", "cluster_id_to_tree_path", "journal_cluster_ids")
+    # number of pattern revisions that get_pattern_changes can diff against
+    max_pattern_history = 100
+    # the token dictionary is compacted when it has grown to twice its size after the last compaction,
+    # but not below this size
+    min_token_dictionary_compaction_size = 4096
+    # patterns are refreshed without a reader once this many clusters are dirty, evicted clusters stay dirty
+    # until then, so they would pile up when nobody reads the patterns
+    max_dirty_cluster_count = 10000
+    # rough memory of a cluster (with its urls, tree and index entries), a token or a uri cache entry, traced on
+    # random URIs, they came out within 10% of each other
+    estimated_entry_memory_size = 480
+
     def __init__(self,
                  depth=4,
                  sim_th=0.4,
@@ -134,7 +324,10 @@ class DrainBase:
                  param_str="{var}",  # Modified:: required param_str
                  # param_extra=None,  # Modified:: Added param_extra
                  parametrize_numeric_tokens=True,
-                 customized_words_file=None):
+                 customized_words_file=None,
+                 uri_cache_capacity=3000,
+                 match_engine="python",
+                 leaf_split_threshold=0):
         """
         Create a new Drain instance.
 
@@ -152,11 +345,19 @@ class DrainBase:
         :param extra_delimiters: delimiters to apply when splitting log message into words (in addition to whitespace).
         :param parametrize_numeric_tokens: whether to treat tokens that contains at least one digit
             as template parameters.
+        :param uri_cache_capacity: max number of already clustered log messages remembered with their cluster,
+            so their repetitions skip the tree search. 0 disables the cache.
+        :param match_engine: "python" scores the candidate clusters of a leaf one by one,
+            "numpy" scores large leaves at once (requires numpy), both select the same clusters.
+        :param leaf_split_threshold: max number of clusters a prefix tree leaf scores a log message against,
+            larger leaves are split on the following token positions. 0 disables splitting.
         """
         # if param_extra is None:
         #     param_extra = {}
         if depth < 3:
             raise ValueError("depth argument must be at least 3")
+        if match_engine not in ("python", "numpy"):
+            raise ValueError(f"unknown match engine {match_engine}")
         self.logger = logger.init_logger(logging_level='DEBUG', name='URIDrainV1')
 
         self.log_cluster_depth = depth
@@ -169,6 +370,8 @@ class DrainBase:
         self.extra_delimiters = extra_delimiters
         self.max_clusters = max_clusters
         self.param_str = param_str
+        self.token_dictionary = TokenDictionary(param_str)
+        self.token_dictionary_compaction_size = self.min_token_dictionary_compaction_size
         # MODIFIED:: Added param_extra
         # self.param_extra = param_extra
         # MODIFIED:: extract this to drain.attributes same as sequence similarity method needs this
@@ -179,7 +382,307 @@ class DrainBase:
         self.id_to_cluster = {} if max_clusters is None else LogClusterCache(maxsize=max_clusters)
         self.clusters_counter = 0
 
-        load_customized_words(customized_words_file)
+        # Modified:: statistics maintained incrementally, so callers don't have to walk all clusters
+        # total_cluster_size: sum of sizes of all tracked clusters
+        # publishable_cluster_count: clusters that have seen at least combine_min_url_count distinct urls
+        # pattern_count: len(self.clusters), publishable clusters plus the single urls of the other clusters
+        self.total_cluster_size = 0
+        self.publishable_cluster_count = 0
+        self.pattern_count = 0
+
+        # Modified:: live pattern set, only clusters marked dirty are re-rendered by refresh_patterns
+        # pattern_refcount: pattern -> number of clusters publishing it, its keys are the current patterns
+        # cluster_id_to_patterns: cluster id -> patterns last published by the cluster
+        # pattern_history: PatternChanges of the latest revisions, oldest first
+        self.pattern_revision = 0
+        self.pattern_history = deque(maxlen=self.max_pattern_history)
+        self.pattern_refcount: Dict[str, int] = {}
+        self.cluster_id_to_patterns: Dict[int, tuple] = {}
+        self.dirty_cluster_ids: Dict[int, None] = {}
+
+        # Modified:: exact message cache, key: log message, value: (cluster id, template ids of the cluster)
+        # An entry is only valid while the cluster is alive and its template ids are the very same object,
+        # templates are always replaced (never mutated) when they change.
+        self.uri_cache_capacity = uri_cache_capacity
+        self.uri_cache = LRUCache(uri_cache_capacity) if uri_cache_capacity > 0 else None
+        # Modified:: vectorised scoring of the candidate clusters of a leaf, None when the python engine is used
+        self.match_engine = match_engine
+        self.leaf_matcher = VectorLeafMatcher(self, PARAM_TOKEN_ID) if match_engine == "numpy" else None
+        # Modified:: adaptive index of the leaves holding too many clusters, None when splitting is disabled
+        self.leaf_split_threshold = leaf_split_threshold
+        self.leaf_splitter = LeafSplitter(self, PARAM_TOKEN_ID, leaf_split_threshold) \
+            if leaf_split_threshold > 0 else None
+        # Modified:: cluster id -> keys of the prefix tree nodes leading to the leaf holding the cluster
+        self.cluster_id_to_tree_path: Dict[int, tuple] = {}
+        # Modified:: ids of the clusters changed or removed since the journal was last taken, None while no journal
+        # is kept, see take_journal
+        self.journal_cluster_ids: Optional[Dict[int, None]] = None
+        # sequence number of the last journal record taken or replayed, records up to it are part of the state
+        self.journal_sequence = 0
+        self.restore_clusters(self.id_to_cluster, self.clusters_counter, self.root_node, self.token_dictionary)
+
+        if load_customized_words(customized_words_file):
+            clear_interned_tokens()
+
+    def restore_clusters(self, id_to_cluster, clusters_counter: int, root_node: Node,
+                         token_dictionary: Optional[TokenDictionary] = None):
+        """
+        Replace the clusters and the prefix tree of this Drain, e.g. with the ones of a loaded snapshot,
+        and recalculate the statistics from them.
+        :param token_dictionary: dictionary of the token ids of the clusters and the prefix tree, None if they
+            still hold the tokens themselves (snapshots of former versions), they are encoded then.
+        """
+        self.id_to_cluster = id_to_cluster
+        self.clusters_counter = clusters_counter
+        self.root_node = root_node
+        if token_dictionary is None:
+            self.token_dictionary = TokenDictionary(self.param_str)
+            self.encode_tokens()
+        else:
+            self.token_dictionary = token_dictionary
+            token_dictionary.refresh_tokens()
+        self.token_dictionary_compaction_size = max(2 * len(self.token_dictionary),
+                                                    self.min_token_dictionary_compaction_size)
+        if isinstance(id_to_cluster, LogClusterCache):
+            id_to_cluster.on_evict = self.on_cluster_evicted
+        self.index_tree_paths()
+
+        self.total_cluster_size = 0
+        self.publishable_cluster_count = 0
+        self.pattern_count = 0
+        max_url_count = self.max_url_count
+        for cluster in id_to_cluster.values():
+            # snapshots of former versions hold the urls in an LRUCache
+            if not isinstance(cluster.latest_urls, tuple) or len(cluster.latest_urls) > max_url_count:
+                cluster.latest_urls = tuple(cluster.latest_urls)[:max_url_count]
+            self.total_cluster_size += cluster.size
+            self.update_url_statistics(0, len(cluster.latest_urls))
+
+        # the revision keeps increasing, so a reader of an older revision sees the replacement as a change
+        for cluster_id in self.cluster_id_to_patterns:
+            self.dirty_cluster_ids[cluster_id] = None
+        for cluster_id in id_to_cluster:
+            self.dirty_cluster_ids[cluster_id] = None
+
+        if self.uri_cache is not None:
+            self.uri_cache.clear()
+        if self.leaf_matcher is not None:
+            self.leaf_matcher.clear()
+        if self.leaf_splitter is not None:
+            self.leaf_splitter.clear()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in self.derived_state:
+            state.pop(name, None)
+        return state
+
+    def encode_tokens(self):
+        """Replace the tokens held by the clusters and the prefix tree with ids of the token dictionary."""
+        token_dictionary = self.token_dictionary
+        for cluster in self.id_to_cluster.values():
+            cluster.token_dictionary = token_dictionary
+            cluster.template_ids = token_dictionary.encode(cluster.template_ids)
+
+        def encode_node(node: Node):
+            node.key_to_child_node = {token_dictionary.get_id(token): child
+                                      for token, child in node.key_to_child_node.items()}
+            for child in node.key_to_child_node.values():
+                encode_node(child)
+
+        for token_count_node in self.root_node.key_to_child_node.values():
+            encode_node(token_count_node)
+
+    def compact_token_dictionary(self):
+        """Drop the tokens no longer used by any cluster or tree node from the token dictionary."""
+        used_ids = set()
+        for cluster in self.id_to_cluster.values():
+            used_ids.update(cluster.template_ids)
+
+        def collect_node(node: Node):
+            used_ids.update(node.key_to_child_node.keys())
+            for child in node.key_to_child_node.values():
+                collect_node(child)
+
+        for token_count_node in self.root_node.key_to_child_node.values():
+            collect_node(token_count_node)
+
+        id_map = self.token_dictionary.compact(used_ids)
+        for cluster in self.id_to_cluster.values():
+            template_ids = array('I', [id_map[token_id] for token_id in cluster.template_ids])
+            # keep unchanged templates, so the uri cache entries of their clusters stay valid
+            if template_ids != cluster.template_ids:
+                cluster.template_ids = template_ids
+
+        def remap_node(node: Node):
+            node.key_to_child_node = {id_map[token_id]: child for token_id, child in node.key_to_child_node.items()}
+            for child in node.key_to_child_node.values():
+                remap_node(child)
+
+        for token_count_node in self.root_node.key_to_child_node.values():
+            remap_node(token_count_node)
+
+        self.token_dictionary_compaction_size = max(2 * len(self.token_dictionary),
+                                                    self.min_token_dictionary_compaction_size)
+        self.index_tree_paths()
+        if self.leaf_matcher is not None:
+            self.leaf_matcher.clear()
+        if self.leaf_splitter is not None:
+            self.leaf_splitter.clear()
+
+    def index_tree_paths(self):
+        """
+        Record the prefix tree path of every cluster, dropping the ids of removed clusters from the leaves
+        and the branches left empty (snapshots of former versions kept them).
+        """
+        id_to_cluster = self.id_to_cluster
+        cluster_id_to_tree_path = {}
+
+        def index_node(node: Node, path: tuple) -> bool:
+            if node.cluster_ids:
+                cluster_ids = [cluster_id for cluster_id in node.cluster_ids if cluster_id in id_to_cluster]
+                if len(cluster_ids) < len(node.cluster_ids):
+                    node.cluster_ids = cluster_ids
+                for cluster_id in cluster_ids:
+                    cluster_id_to_tree_path[cluster_id] = path
+            for key, child in list(node.key_to_child_node.items()):
+                if not index_node(child, path + (key,)):
+                    del node.key_to_child_node[key]
+            return bool(node.cluster_ids or node.key_to_child_node)
+
+        for key, token_count_node in list(self.root_node.key_to_child_node.items()):
+            if not index_node(token_count_node, (key,)):
+                del self.root_node.key_to_child_node[key]
+        self.cluster_id_to_tree_path = cluster_id_to_tree_path
+
+    def remove_from_tree(self, cluster):
+        """Remove the cluster from its leaf, and prune the prefix tree nodes left without clusters."""
+        path = self.cluster_id_to_tree_path.pop(cluster.cluster_id, None)
+        if path is None:
+            return
+        nodes = [self.root_node]
+        for key in path:
+            nodes.append(nodes[-1].key_to_child_node[key])
+        leaf = nodes[-1]
+        leaf.cluster_ids = [cluster_id for cluster_id in leaf.cluster_ids if cluster_id != cluster.cluster_id]
+        if self.leaf_splitter is not None:
+            self.leaf_splitter.remove_cluster(leaf, cluster)
+
+        for depth in range(len(path), 0, -1):
+            node = nodes[depth]
+            if node.cluster_ids or node.key_to_child_node:
+                break
+            del nodes[depth - 1].key_to_child_node[path[depth - 1]]
+            if self.leaf_matcher is not None:
+                self.leaf_matcher.forget_leaf(node)
+            if self.leaf_splitter is not None:
+                self.leaf_splitter.forget_leaf(node)
+
+    def add_to_tree_path(self, cluster, path: tuple):
+        """Add the cluster to the leaf at the given prefix tree path, creating the missing nodes."""
+        node = self.root_node
+        for key in path:
+            child = node.key_to_child_node.get(key)
+            if child is None:
+                child = node.key_to_child_node[key] = Node()
+            node = child
+        # leaves keep their clusters in ascending id order, the order they were created in
+        cluster_ids = node.cluster_ids.copy()
+        bisect.insort(cluster_ids, cluster.cluster_id)
+        node.cluster_ids = cluster_ids
+        self.cluster_id_to_tree_path[cluster.cluster_id] = path
+
+    def start_journal(self):
+        """Record the clusters changed from now on, until they are taken by take_journal."""
+        self.journal_cluster_ids = {}
+
+    def take_journal(self) -> Optional[dict]:
+        """
+        Modified:: Take the changes of the clusters since the journal was started or last taken.
+        A record holds the whole state of each changed cluster and the sequence number of the record.
+        :return: json serializable record, None if no cluster changed
+        """
+        if not self.journal_cluster_ids:
+            return None
+        decode = self.token_dictionary.decode
+        clusters, removed = [], []
+        for cluster_id in self.journal_cluster_ids:
+            cluster = self.id_to_cluster.get(cluster_id)
+            if cluster is None:
+                removed.append(cluster_id)
+                continue
+            path = self.cluster_id_to_tree_path.get(cluster_id)
+            if path is not None:
+                path = [path[0], *decode(path[1:])]
+            clusters.append([cluster_id, list(cluster.log_template_tokens), cluster.size, list(cluster.latest_urls),
+                             path])
+        self.journal_cluster_ids = {}
+        self.journal_sequence += 1
+        return {"sequence": self.journal_sequence, "clusters_counter": self.clusters_counter, "clusters": clusters,
+                "removed": removed}
+
+    def replay_journal(self, records: Iterable[dict]):
+        """
+        Modified:: Apply journal records taken by take_journal, in the order they were taken,
+        on top of the clusters restored from the snapshot they followed.
+        Records already part of the state (up to journal_sequence) are skipped, they would roll clusters back.
+        """
+        token_dictionary = self.token_dictionary
+        for record in records:
+            if record["sequence"] <= self.journal_sequence:
+                continue
+            self.journal_sequence = record["sequence"]
+            for cluster_id in record["removed"]:
+                cluster = self.id_to_cluster.pop(cluster_id, None)
+                if cluster is not None:
+                    self.remove_from_tree(cluster)
+            for cluster_id, template_tokens, size, latest_urls, path in record["clusters"]:
+                cluster = self.id_to_cluster.get(cluster_id)
+                if cluster is None:
+                    cluster = LogCluster(template_tokens, cluster_id, token_dictionary)
+                else:
+                    cluster.template_ids = token_dictionary.encode(template_tokens)
+                cluster.size = size
+                cluster.latest_urls = tuple(latest_urls)
+                self.id_to_cluster[cluster_id] = cluster
+                if path is not None:
+                    path = (path[0], *map(token_dictionary.get_id, path[1:]))
+                if self.cluster_id_to_tree_path.get(cluster_id) != path:
+                    self.remove_from_tree(cluster)
+                    if path is not None:
+                        self.add_to_tree_path(cluster, path)
+            self.clusters_counter = max(self.clusters_counter, record["clusters_counter"])
+        self.restore_clusters(self.id_to_cluster, self.clusters_counter, self.root_node, token_dictionary)
+
+    def on_cluster_evicted(self, cluster):
+        self.total_cluster_size -= cluster.size
+        self.update_url_statistics(len(cluster.latest_urls), 0)
+        self.dirty_cluster_ids[cluster.cluster_id] = None
+        if self.journal_cluster_ids is not None:
+            self.journal_cluster_ids[cluster.cluster_id] = None
+        if self.leaf_matcher is not None:
+            self.leaf_matcher.forget_cluster(cluster.cluster_id)
+        # Modified:: the tree only references live clusters, so its size is bounded by max_clusters too
+        self.remove_from_tree(cluster)
+
+    def update_url_statistics(self, old_url_count: int, new_url_count: int):
+        if old_url_count == new_url_count:
+            return
+        self.pattern_count += self.patterns_of_url_count(new_url_count) - self.patterns_of_url_count(old_url_count)
+        self.publishable_cluster_count += \
+            self.is_publishable(new_url_count) - self.is_publishable(old_url_count)
+
+    @property
+    def max_url_count(self) -> int:
+        """Number of distinct urls a cluster keeps, enough to tell whether it is publishable."""
+        return max(self.combine_min_url_count, 1)
+
+    def is_publishable(self, url_count: int) -> bool:
+        return 0 < url_count and self.combine_min_url_count <= url_count
+
+    def patterns_of_url_count(self, url_count: int) -> int:
+        # a publishable cluster is a single pattern, otherwise each of its urls is a pattern on its own
+        return 1 if self.is_publishable(url_count) else url_count
 
     @property
     def clusters(self):
@@ -188,52 +691,129 @@ class DrainBase:
             if cluster.latest_urls and cluster.latest_urls.__len__() >= self.combine_min_url_count:
                 result.append(cluster)
                 continue
-            for url, _ in cluster.latest_urls.items():
+            for url in cluster.latest_urls:
                 result.append(SingleURILogCluster(url))
         return result
 
     @property
     def cluster_patterns(self):
-        sorted_drain_clusters = sorted(self.clusters, key=lambda it: it.size, reverse=True)
-        return [cluster.get_template() for cluster in sorted_drain_clusters]
+        """
+        Modified:: Patterns of all clusters, served from the live pattern set without rendering every template again.
+        Patterns are listed in the order they first appeared, duplicated patterns are listed once.
+        """
+        self.refresh_patterns()
+        return list(self.pattern_refcount)
+
+    def cluster_publishing_patterns(self, cluster) -> tuple:
+        if cluster is None:
+            return ()
+        if self.is_publishable(len(cluster.latest_urls)):
+            return cluster.get_template(),
+        return cluster.latest_urls
+
+    def refresh_patterns(self) -> int:
+        """
+        Re-render the patterns of the clusters changed since the last refresh and record the resulting
+        added/removed patterns as a new revision.
+        :return: the current pattern revision
+        """
+        if not self.dirty_cluster_ids:
+            return self.pattern_revision
+
+        # pattern -> whether it was published before this refresh, for every pattern touched by the refresh
+        touched = {}
+        for cluster_id in self.dirty_cluster_ids:
+            new_patterns = self.cluster_publishing_patterns(self.id_to_cluster.get(cluster_id))
+            old_patterns = self.cluster_id_to_patterns.pop(cluster_id, ())
+            if new_patterns:
+                self.cluster_id_to_patterns[cluster_id] = new_patterns
+            if new_patterns == old_patterns:
+                continue
+            for pattern in old_patterns:
+                touched.setdefault(pattern, True)
+                count = self.pattern_refcount[pattern] - 1
+                if count:
+                    self.pattern_refcount[pattern] = count
+                else:
+                    del self.pattern_refcount[pattern]
+            for pattern in new_patterns:
+                count = self.pattern_refcount.get(pattern, 0)
+                if not count:
+                    touched.setdefault(pattern, False)
+                self.pattern_refcount[pattern] = count + 1
+        self.dirty_cluster_ids.clear()
+
+        added = [pattern for pattern, existed in touched.items() if not existed and pattern in self.pattern_refcount]
+        removed = [pattern for pattern, existed in touched.items() if existed and pattern not in self.pattern_refcount]
+        if added or removed:
+            self.pattern_revision += 1
+            self.pattern_history.append(PatternChanges(self.pattern_revision, added, removed))
+        return self.pattern_revision
+
+    def get_pattern_changes(self, since_revision: int) -> Optional[PatternChanges]:
+        """
+        Get the patterns added and removed after the given revision.
+        :param since_revision: revision already known by the caller, 0 means no pattern is known yet
+        :return: net changes up to the current revision, or None if since_revision is too old (or unknown),
+            in which case the caller should take the full cluster_patterns instead.
+        """
+        revision = self.refresh_patterns()
+        if since_revision == revision:
+            return PatternChanges(revision, [], [])
+        if since_revision > revision or not self.pattern_history \
+                or since_revision < self.pattern_history[0].revision - 1:
+            return None
+
+        added, removed = merge_pattern_changes(changes for changes in self.pattern_history
+                                               if changes.revision > since_revision)
+        return PatternChanges(revision, added, removed)
 
     @staticmethod
     def has_numbers(s):
         return any(char.isdigit() for char in s)
 
-    def fast_match(self, cluster_ids: Sequence, tokens: list, sim_th: float, include_params: bool):
+    def fast_match(self, cluster_ids: Sequence, tokens: list, sim_th: float, include_params: bool, leaf=None):
         """
         Find the best match for a log message (represented as tokens) versus a list of clusters
         :param cluster_ids: List of clusters to match against (represented by their IDs)
         :param tokens: the log message, separated to tokens.
         :param sim_th: minimum required similarity threshold (None will be returned in no clusters reached it)
         :param include_params: consider tokens matched to wildcard parameters in similarity threshold.
+        :param leaf: the prefix tree node (or bucket of a split one) holding cluster_ids,
+            lets the numpy match engine reuse its matrix
         :return: Best match cluster or None
         """
+        # pre-parse tokens to avoid repeated parsing
+        parsed_token = parse_token_list(tokens)
+        # Modified:: templates are compared by token id, tokens missing from the dictionary match no template token
+        token_ids = self.token_dictionary.find_ids(parsed_token)
+
         # MODIFIED:: Changed to use URI cluster
         # get number of tokens that contain digits
-        digit_tokens = [token for token in tokens if self.has_numbers(token)]
-
-        digit_count = len(digit_tokens)
+        digit_count = sum(1 for token in parsed_token if token.has_digits)
         # MODIFIED:: Taken from DAGDrain paper
         sim_th = 0.5 * ((len(tokens) - digit_count) / len(tokens))
 
         match_cluster = None
 
+        # Modified:: large leaves are scored at once by the numpy match engine, with the same result
+        if leaf is not None and self.leaf_matcher is not None and len(cluster_ids) >= self.leaf_matcher.min_leaf_size:
+            max_cluster, max_sim = self.leaf_matcher.best_match(leaf, parsed_token, token_ids, include_params)
+            if max_sim >= sim_th:
+                match_cluster = max_cluster
+            return match_cluster
+
         max_sim = -1
         max_param_count = -1
         max_cluster = None
 
-        # pre-parse tokens to avoid repeated parsing
-        parsed_token = parse_token_list(tokens)
-
         for cluster_id in cluster_ids:
             # Try to retrieve cluster from cache with bypassing eviction
             # algorithm as we are only testing candidates for a match.
             cluster = self.id_to_cluster.get(cluster_id)
             if cluster is None:
                 continue
-            cur_sim, param_count = self.get_seq_distance(cluster.log_template_tokens, parsed_token, include_params)
+            cur_sim, param_count = self.get_seq_distance(cluster.template_ids, token_ids, parsed_token, include_params)
             # self.logger.debug(f'SIMILARITY = {cur_sim} for c{cluster_id}, {cluster.log_template_tokens} param={param_count}')
             if cur_sim > max_sim or (cur_sim == max_sim and param_count > max_param_count):
                 # todo: this is known caveat
@@ -263,7 +843,7 @@ class DrainBase:
             else:
                 out_str += f'<{token}>'
         else:
-            out_str += f'"{token}"'
+            out_str += f'"{self.token_dictionary.tokens[token]}"'
 
         if len(node.cluster_ids) > 0:
             out_str += f" (cluster_count={len(node.cluster_ids)})"
@@ -291,7 +871,89 @@ class DrainBase:
         :param content:
         :return:
         """
-        content_tokens = self.get_content_as_tokens(content)
+        cluster = self.add_cached_message(content, 1)
+        if cluster is not None:
+            return cluster, "none"
+        return self.add_content_tokens(content, self.get_content_as_tokens(content))
+
+    def add_cached_message(self, content: str, count: int):
+        """
+        Add a log message already absorbed by a cluster whose template didn't change since.
+        :return: the cluster, or None if the message isn't cached (anymore), then it has to be fully added
+        """
+        if self.uri_cache is None:
+            return None
+        cached = self.uri_cache.get(content)
+        if cached is None:
+            return None
+        cluster_id, template_ids = cached
+        cluster = self.id_to_cluster.get(cluster_id)
+        if cluster is None or cluster.template_ids is not template_ids:
+            del self.uri_cache[content]
+            return None
+
+        cluster.size += count
+        self.total_cluster_size += count
+        if self.journal_cluster_ids is not None:
+            self.journal_cluster_ids[cluster_id] = None
+        # Touch cluster to update its state in the cache.
+        # noinspection PyStatementEffect
+        self.id_to_cluster[cluster_id]
+        return cluster
+
+    def add_log_messages(self, contents: Iterable[str]) -> dict:
+        """
+        Modified:: Add a batch of log messages, each distinct message is tokenized and clustered once,
+        its repetitions only add to the size of its cluster.
+        Without max_clusters, messages are processed grouped by token count, keeping the given order within each
+        group; clusters of different token counts never match each other, so grouping doesn't change the templates.
+        With max_clusters, the order the clusters are used in decides which ones are evicted, so the messages are
+        added in the given order and each repetition uses its cluster again, as add_log_message does. The messages
+        of a mapping are added at their first occurrence with all their repetitions at once.
+
+        :param contents: log messages, or a mapping (e.g. Counter) of log message to its number of occurrences
+        :return: summary of the batch
+        """
+        content_counts = Counter(contents)
+
+        if self.max_clusters is None:
+            token_count_to_contents: Dict[int, list] = {}
+            for content, count in content_counts.items():
+                content_tokens = self.get_content_as_tokens(content)
+                token_count_to_contents.setdefault(len(content_tokens), []).append((content, content_tokens, count))
+            ordered_contents = [item for items in token_count_to_contents.values() for item in items]
+        elif isinstance(contents, Mapping):
+            ordered_contents = [(content, None, count) for content, count in content_counts.items()]
+        else:
+            # the repetitions are mostly hits of the uri cache
+            ordered_contents = [(content, None, 1) for content in contents]
+
+        change_counts = Counter()
+        changed_cluster_ids = set()
+        for content, content_tokens, count in ordered_contents:
+            if self.add_cached_message(content, count) is not None:
+                change_counts["none"] += 1
+                continue
+            if content_tokens is None:
+                content_tokens = self.get_content_as_tokens(content)
+            cluster, change_type = self.add_content_tokens(content, content_tokens)
+            if count > 1:
+                cluster.size += count - 1
+                self.total_cluster_size += count - 1
+            change_counts[change_type] += 1
+            if change_type != "none":
+                changed_cluster_ids.add(cluster.cluster_id)
+
+        return {
+            "message_count": sum(content_counts.values()),
+            "unique_message_count": len(content_counts),
+            "change_counts": dict(change_counts),
+            "changed_cluster_ids": sorted(changed_cluster_ids),
+            "cluster_count": self.pattern_count
+        }
+
+    def add_content_tokens(self, content: str, content_tokens: list):
+        content_tokens = parse_token_list(content_tokens)
 
         if self.profiler:
             self.profiler.start_section("tree_search")
@@ -305,7 +967,7 @@ class DrainBase:
                 self.profiler.start_section("create_cluster")
             self.clusters_counter += 1
             cluster_id = self.clusters_counter
-            match_cluster = LogCluster(content_tokens, cluster_id, self.combine_min_url_count)
+            match_cluster = LogCluster(content_tokens, cluster_id, self.token_dictionary)
             self.id_to_cluster[cluster_id] = match_cluster
             self.add_seq_to_prefix_tree(self.root_node, match_cluster)
             update_type = "cluster_created"
@@ -314,22 +976,27 @@ class DrainBase:
         else:
             if self.profiler:
                 self.profiler.start_section("cluster_exist")
-            new_template_tokens = self.create_template(content_tokens, match_cluster.log_template_tokens)
-            if new_template_tokens == "rejected":
+            new_template_ids = self.create_template(content_tokens, match_cluster.template_ids)
+            if new_template_ids == "rejected":
                 # self.logger.debug(f'template reuse rejected for content_tokens = {content_tokens} ')
                 # added, it should be new template tokens
                 update_type = "rejected (create new)"
                 self.clusters_counter += 1
                 cluster_id = self.clusters_counter
-                match_cluster = LogCluster(content_tokens, cluster_id, self.combine_min_url_count)
+                match_cluster = LogCluster(content_tokens, cluster_id, self.token_dictionary)
                 self.id_to_cluster[cluster_id] = match_cluster
                 self.add_seq_to_prefix_tree(self.root_node, match_cluster)
                 match_cluster.size -= 1
-            elif tuple(new_template_tokens) == match_cluster.log_template_tokens:
+            elif new_template_ids == match_cluster.template_ids:
                 update_type = "none"
             else:
-                match_cluster.log_template_tokens = tuple(new_template_tokens)
+                old_template_ids = match_cluster.template_ids
+                match_cluster.template_ids = new_template_ids
                 update_type = "cluster_template_changed"
+                if self.leaf_matcher is not None:
+                    self.leaf_matcher.forget_cluster(match_cluster.cluster_id)
+                if self.leaf_splitter is not None:
+                    self.leaf_splitter.move_cluster(match_cluster, old_template_ids)
             match_cluster.size += 1
             # Touch cluster to update its state in the cache.
             # noinspection PyStatementEffect
@@ -338,14 +1005,32 @@ class DrainBase:
         if self.profiler:
             self.profiler.end_section()
 
-        match_cluster.adding_url(content)
+        self.total_cluster_size += 1
+        url_count = len(match_cluster.latest_urls)
+        match_cluster.adding_url(content, self.max_url_count)
+        new_url_count = len(match_cluster.latest_urls)
+        self.update_url_statistics(url_count, new_url_count)
+        if update_type != "none" or url_count != new_url_count:
+            self.dirty_cluster_ids[match_cluster.cluster_id] = None
+        if self.journal_cluster_ids is not None:
+            self.journal_cluster_ids[match_cluster.cluster_id] = None
+        if self.uri_cache is not None:
+            self.uri_cache[content] = (match_cluster.cluster_id, match_cluster.template_ids)
+        if len(self.token_dictionary) >= self.token_dictionary_compaction_size:
+            self.compact_token_dictionary()
+        if len(self.dirty_cluster_ids) > self.max_dirty_cluster_count:
+            self.refresh_patterns()
         return match_cluster, update_type
 
     def get_total_cluster_size(self):
-        size = 0
-        for c in self.id_to_cluster.values():
-            size += c.size
-        return size
+        return self.total_cluster_size
+
+    def estimate_memory_size(self) -> int:
+        """Modified:: Rough estimate of the bytes taken by the Drain, without walking its clusters."""
+        entry_count = len(self.id_to_cluster) + len(self.token_dictionary)
+        if self.uri_cache is not None:
+            entry_count += len(self.uri_cache)
+        return entry_count * self.estimated_entry_memory_size
 
     def get_clusters_ids_for_seq_len(self, seq_fir):
         """
@@ -382,10 +1067,14 @@ class Drain(DrainBase):
                  param_str="<*>",
                  # param_extra=None,  # Modified:: Added param_extra
                  parametrize_numeric_tokens=True,
-                 customized_words_file=None):
+                 customized_words_file=None,
+                 uri_cache_capacity=3000,
+                 match_engine="python",
+                 leaf_split_threshold=0):
         super().__init__(depth, sim_th, max_children, max_clusters, combine_min_url_count, extra_delimiters, profiler, param_str,
                          # param_extra,
-                         parametrize_numeric_tokens, customized_words_file)
+                         parametrize_numeric_tokens, customized_words_file, uri_cache_capacity, match_engine,
+                         leaf_split_threshold)
 
     def tree_search(self, root_node: Node, tokens: list, sim_th: float, include_params: bool):
 
@@ -403,7 +1092,7 @@ class Drain(DrainBase):
 
         # find the leaf node for this log - a path of nodes matching the first N tokens (N=tree depth)
         cur_node_depth = 1
-        for token in tokens:
+        for token_id in self.token_dictionary.find_ids(tokens[:self.max_node_depth]):
             # at max depth
             if cur_node_depth >= self.max_node_depth:
                 break
@@ -413,22 +1102,27 @@ class Drain(DrainBase):
                 break
 
             key_to_child_node = cur_node.key_to_child_node
-            cur_node = key_to_child_node.get(token)
+            cur_node = key_to_child_node.get(token_id)
             if cur_node is None:  # no exact next token exist, try wildcard node
-                cur_node = key_to_child_node.get(self.param_str)
+                cur_node = key_to_child_node.get(PARAM_TOKEN_ID)
             if cur_node is None:  # no wildcard node exist
                 return None
 
             cur_node_depth += 1
 
+        # Modified:: only the clusters of a large leaf that can match the log message are candidates
+        candidates = cur_node
+        if self.leaf_splitter is not None:
+            candidates = self.leaf_splitter.find_candidates(cur_node, parse_token_list(tokens))
+
         # get best match among all clusters with same prefix, or None if no match is above sim_th
-        cluster = self.fast_match(cur_node.cluster_ids, tokens, sim_th, include_params)
+        cluster = self.fast_match(candidates.cluster_ids, tokens, sim_th, include_params, candidates)
         # FIXME MODIFIED:: print for debugging
         # #self.logger.debug("cluster: ", cluster)
         return cluster
 
     def add_seq_to_prefix_tree(self, root_node, cluster: LogCluster):
-        token_count = len(cluster.log_template_tokens)
+        token_count = len(cluster.template_ids)
         token_count_str = str(token_count)
         if token_count_str not in root_node.key_to_child_node:
             first_layer_node = Node()
@@ -438,46 +1132,58 @@ class Drain(DrainBase):
 
         cur_node = first_layer_node
 
+        # Modified:: keys of the nodes from the root to the leaf of the cluster, to remove it when it gets evicted
+        path = [token_count_str]
+
         # handle case of empty log string
         if token_count == 0:
+            for cluster_id in cur_node.cluster_ids:
+                self.cluster_id_to_tree_path.pop(cluster_id, None)
             cur_node.cluster_ids = [cluster.cluster_id]
+            self.cluster_id_to_tree_path[cluster.cluster_id] = tuple(path)
             return
 
+        tokens = self.token_dictionary.tokens
         current_depth = 1
-        for token in cluster.log_template_tokens:
+        for token in cluster.template_ids:
 
             # if at max depth or this is last token in template - add current log cluster to the leaf node
             if current_depth >= self.max_node_depth or current_depth >= token_count:
+                self.cluster_id_to_tree_path[cluster.cluster_id] = tuple(path)
                 # clean up stale clusters before adding a new one.
                 new_cluster_ids = []
                 for cluster_id in cur_node.cluster_ids:
                     if cluster_id in self.id_to_cluster:
                         new_cluster_ids.append(cluster_id)
+                stale_removed = len(new_cluster_ids) < len(cur_node.cluster_ids)
                 new_cluster_ids.append(cluster.cluster_id)
                 cur_node.cluster_ids = new_cluster_ids
+                if self.leaf_splitter is not None:
+                    self.leaf_splitter.add_cluster(cur_node, cluster, stale_removed)
                 break
 
+            parent_node = cur_node
             # if token not matched in this layer of existing tree.
             if token not in cur_node.key_to_child_node:
                 # MODIFIED:: This is not needed since domain can contain digits
                 # WE SHOULD DO NOTHING SO OVERRIDING THE SETTING
                 self.parametrize_numeric_tokens = False
-                if self.parametrize_numeric_tokens and self.has_numbers(token):
-                    if self.param_str not in cur_node.key_to_child_node:
+                if self.parametrize_numeric_tokens and tokens[token].has_digits:
+                    if PARAM_TOKEN_ID not in cur_node.key_to_child_node:
                         new_node = Node()
-                        cur_node.key_to_child_node[self.param_str] = new_node
+                        cur_node.key_to_child_node[PARAM_TOKEN_ID] = new_node
                         cur_node = new_node
                     else:
-                        cur_node = cur_node.key_to_child_node[self.param_str]
+                        cur_node = cur_node.key_to_child_node[PARAM_TOKEN_ID]
 
                 else:
-                    if self.param_str in cur_node.key_to_child_node:
+                    if PARAM_TOKEN_ID in cur_node.key_to_child_node:
                         if len(cur_node.key_to_child_node) < self.max_children:
                             new_node = Node()
                             cur_node.key_to_child_node[token] = new_node
                             cur_node = new_node
                         else:
-                            cur_node = cur_node.key_to_child_node[self.param_str]
+                            cur_node = cur_node.key_to_child_node[PARAM_TOKEN_ID]
                     else:
                         if len(cur_node.key_to_child_node) + 1 < self.max_children:
                             new_node = Node()
@@ -485,20 +1191,21 @@ class Drain(DrainBase):
                             cur_node = new_node
                         elif len(cur_node.key_to_child_node) + 1 == self.max_children:
                             new_node = Node()
-                            cur_node.key_to_child_node[self.param_str] = new_node
+                            cur_node.key_to_child_node[PARAM_TOKEN_ID] = new_node
                             cur_node = new_node
                         else:
-                            cur_node = cur_node.key_to_child_node[self.param_str]
+                            cur_node = cur_node.key_to_child_node[PARAM_TOKEN_ID]
 
             # if the token is matched
             else:
                 cur_node = cur_node.key_to_child_node[token]
 
+            path.append(token if parent_node.key_to_child_node.get(token) is cur_node else PARAM_TOKEN_ID)
             current_depth += 1
 
-    # seq1 is a template, seq2 is the log to match
+    # seq1 is a template (token ids), seq2 is the log to match (token ids, and the tokens themselves in tokens2)
     # FIXME MODIFIED:: entirely modified for URI matching include_params is false when add_logmessage
-    def get_seq_distance(self, seq1, seq2, include_params: bool):
+    def get_seq_distance(self, seq1, seq2, tokens2: Sequence[Token], include_params: bool):
         """
         Todo this is modified to match uris
         Input (8): /api/v1/invoices/123abc456
@@ -517,26 +1224,26 @@ class Drain(DrainBase):
         if len(seq1) == 0:
             return 1.0, 0
 
+        tokens = self.token_dictionary.tokens
         sim_tokens = 0
         param_count = 0
         # TODO:: This needs a second thought
         # MODIFIED:: modified here to ensure domain is matched
-        for index, (token1, token2) in enumerate(zip(seq1, seq2)):
-            if (index == 0 or index == 1) and '.' in token1 and token1 != token2:
+        for index, (id1, id2, token2) in enumerate(zip(seq1, seq2, tokens2)):
+            token1 = tokens[id1]
+            if (index == 0 or index == 1) and token1.has_dot and id1 != id2:
                 # self.logger.debug('this is domain mismatch!')
                 return 0.0, 0
             # if all new tokens are words, token1(cluster_templates) is not parameter, then we can consider it cannot be combined
-            if token1 != token2 and ((token1 != self.param_str and token1.word_correct) or token2.word_correct):
+            if id1 != id2 and ((id1 != PARAM_TOKEN_ID and token1.word_correct) or token2.word_correct):
                 return -1, -1
             # if token1 in self.possible_params or token1 == self.param_str:
-            if token1 == self.param_str:
+            if id1 == PARAM_TOKEN_ID:
                 param_count += 1
                 continue
-            if token1 == token2:  # changed here 2023
-                if token1.isdigit() and token2.isdigit():  # this is edge case where template is very new and has digits
+            if id1 == id2:  # changed here 2023
+                if token1.is_digit:  # this is edge case where template is very new and has digits
                     sim_tokens += 0.5  # FIXME This maybe tricky to tune, and do we consider token2 or just token1
-                elif token1.isalpha():
-                    sim_tokens += 1
                 else:
                     sim_tokens += 1
         if include_params:
@@ -546,18 +1253,20 @@ class Drain(DrainBase):
         return ret_val, param_count
 
     def create_template(self, seq1, seq2):
-        # MODIFIED::
+        # MODIFIED:: seq1 are the tokens of the log, seq2 the token ids of the template, returns token ids
         assert len(seq1) == len(seq2)
+        seq1 = parse_token_list(seq1)
+        tokens = self.token_dictionary.tokens
         ret_val = list(seq2)
         seq_length = len(seq1)
 
         # TODO, radical assumption if there's absolutely 0 digit in seq1 and seq2, then don't consider them similar?
         # To implement this, we increase the false negative rate, but decrease false positive rate
 
-        for i, (token1, token2) in enumerate(zip(seq1, seq2)):
-            pre_token = ret_val[i - 1] if i > 0 else None
-            sub_token = ret_val[i + 1] if i < len(ret_val) - 1 else None
-            if token1 != token2:
+        for i, (token1, id2) in enumerate(zip(seq1, seq2)):
+            pre_token = tokens[ret_val[i - 1]] if i > 0 else None
+            sub_token = tokens[ret_val[i + 1]] if i < len(ret_val) - 1 else None
+            if token1 != tokens[id2]:
                 if seq_length == 1:  # if an uri is of length 1 then it must not share any similarity with any template
                     return 'rejected'
                 if seq_length == 2:
@@ -565,11 +1274,11 @@ class Drain(DrainBase):
                     # [0]same_domain/[1]FIRST_ACTUAL_TOKEN or
                     # here we assume that FIRST_ACTUAL_TOKEN is not a param,
                     # so we safely reject if they don't match
-                    if i == 1 and '.' in pre_token:
+                    if i == 1 and pre_token.has_dot:
                         return 'rejected'
                 if seq_length == 3:
                     # [0]scheme://[1]same_domain/[2]FIRST_ACTUAL_TOKEN,
-                    if i == 2 and '.' in pre_token:
+                    if i == 2 and pre_token.has_dot:
                         return 'rejected'
                 # First handle domains in uri
                 if i == 1 and ':' in pre_token:  # it means domain mismatch
@@ -633,27 +1342,27 @@ class Drain(DrainBase):
                 #     # self.logger.debug('pre_token is a version number, so current token cannot be a param (assumption)')
                 #     # self.logger.debug(f'tokens of sequence2 = {seq2}')
                 #     return "rejected"
-                if token1.startswith('v') and token1[1:].isdigit():
+                if token1.is_version:
                     # self.logger.debug('token1 is a version number, so current token cannot be a param (assumption)')
                     # self.logger.debug(f'tokens of sequence2 = {seq2}')
                     return "rejected"
-                if pre_token and (not pre_token.startswith('v')) and self.has_numbers(pre_token):
+                if pre_token and (not pre_token.startswith('v')) and pre_token.has_digits:
                     # Based on assumption that no two consecutive tokens can be params(unless the pre token is versioned)
                     # So attempt to change this position must ensure that the previous token is not a param
                     # self.logger.debug('pre_token has numbers, so current token cannot be a param (assumption)')
                     # self.logger.debug(f'tokens of sequence2 = {seq2}')
                     return "rejected"
-                if sub_token and self.has_numbers(sub_token):
+                if sub_token and sub_token.has_digits:
                     # Based on assumption that no two consecutive tokens can be params
                     # So attempt to change this position must ensure that the subsequent token is not a param
                     # self.logger.debug('sub_token has numbers, so current token cannot be a param (assumption)')
                     # self.logger.debug(f'tokens of sequence2 = {seq2}')
                     return "rejected"
 
-                ret_val[i] = self.param_str
+                ret_val[i] = PARAM_TOKEN_ID
 
         # self.logger.debug(f'After change: {ret_val}')
-        return parse_token_list(ret_val)
+        return array('I', ret_val)
 
     def match(self, content: str, full_search_strategy="never"):
         """
@@ -12,13 +12,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
 import re
+from importlib import metadata
 
 from cachetools import LRUCache
 from spellchecker import SpellChecker
 
 last_word_correct_lru = LRUCache(1000)
 word_spell = SpellChecker()
+# words added to the spell checker by load_customized_words
+customized_words = set()
+words_fingerprint_cache = None
 
 
 def split_for_url(text):
@@ -50,18 +55,41 @@ def check_all_word_correct(text):
     return True
 
 
-def load_customized_words(path: str):
-    if not path:
-        return
+def load_customized_words(path: str) -> bool:
     """
     Load custom words from a file and add them to the spell checker.
     Each line in the file should contain one word.
+    :return: whether any word unknown so far has been added
     """
+    if not path:
+        return False
+    added = False
     with open(path, 'r') as file:
         for line in file:
             # ignore the comments and empty lines
             if line.startswith('#') or not line.strip():
                 continue
-            word = line.strip()
-            if word:  # Ensure the line is not empty
-                word_spell.word_frequency.add(word.lower())
+            word = line.strip().lower()
+            if word and word not in word_spell:  # Ensure the line is not empty
+                word_spell.word_frequency.add(word)
+                customized_words.add(word)
+                added = True
+    if added:
+        # cached results may say the new words are not correct
+        last_word_correct_lru.clear()
+        global words_fingerprint_cache
+        words_fingerprint_cache = None
+    return added
+
+
+def words_fingerprint() -> str:
+    """
+    Fingerprint of the known words, the dictionary of the spell checker and the customized words added to it.
+    Words checked while the fingerprint was the same are still correct, or still not.
+    """
+    global words_fingerprint_cache
+    if words_fingerprint_cache is None:
+        digest = hashlib.sha1('\n'.join(sorted(customized_words)).encode('utf-8')).hexdigest()
+        words_fingerprint_cache = f"pyspellchecker-{metadata.version('pyspellchecker')}:" \
+                                  f"{len(word_spell.word_frequency.dictionary)}:{digest}"
+    return words_fingerprint_cache
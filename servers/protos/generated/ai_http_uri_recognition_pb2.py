@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# Generated by the protocol buffer compiler.  DO NOT EDIT!
+# NO CHECKED-IN PROTOBUF GENCODE
+# source: ai_http_uri_recognition.proto
+# Protobuf Python Version: 7.35.1
+"""Generated protocol buffer code."""
+from google.protobuf import descriptor as _descriptor
+from google.protobuf import descriptor_pool as _descriptor_pool
+from google.protobuf import runtime_version as _runtime_version
+from google.protobuf import symbol_database as _symbol_database
+from google.protobuf.internal import builder as _builder
+_runtime_version.ValidateProtobufRuntimeVersion(
+    _runtime_version.Domain.PUBLIC,
+    7,
+    35,
+    1,
+    '',
+    'ai_http_uri_recognition.proto'
+)
+# @@protoc_insertion_point(imports)
+
+_sym_db = _symbol_database.Default()
+
+
+from google.protobuf import empty_pb2 as google_dot_protobuf_dot_empty__pb2
+
+
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x1d\x61i_http_uri_recognition.proto\x1a\x1bgoogle/protobuf/empty.proto\"A\n\x1dHttpUriRecognitionSyncRequest\x12\x0f\n\x07service\x18\x01 \x01(\t\x12\x0f\n\x07version\x18\x02 \x01(\t\"V\n\"HttpUriRecognitionSubscribeRequest\x12\x30\n\x08services\x18\x01 \x03(\x0b\x32\x1e.HttpUriRecognitionSyncRequest\"S\n\x19HttpUriRecognitionRequest\x12\x0f\n\x07service\x18\x01 \x01(\t\x12%\n\x10unrecognizedUris\x18\x02 \x03(\x0b\x32\x0b.HttpRawUri\"q\n\x1dHttpUriRecognitionFeedSummary\x12\x0f\n\x07service\x18\x01 \x01(\t\x12\x14\n\x0creceivedUris\x18\x02 \x01(\x04\x12\x12\n\nqueuedUris\x18\x03 \x01(\x04\x12\x15\n\rqueuedBatches\x18\x04 \x01(\x04\"\x1a\n\nHttpRawUri\x12\x0c\n\x04name\x18\x01 \x01(\t\"I\n\x1aHttpUriRecognitionResponse\x12\x1a\n\x08patterns\x18\x01 \x03(\x0b\x32\x08.Pattern\x12\x0f\n\x07version\x18\x02 \x01(\t\"\x87\x01\n!HttpUriRecognitionChangesResponse\x12\x17\n\x05\x61\x64\x64\x65\x64\x18\x01 \x03(\x0b\x32\x08.Pattern\x12\x19\n\x07removed\x18\x02 \x03(\x0b\x32\x08.Pattern\x12\x0f\n\x07version\x18\x03 \x01(\t\x12\x0c\n\x04\x66ull\x18\x04 \x01(\x08\x12\x0f\n\x07service\x18\x05 \x01(\t\"\x1a\n\x07Pattern\x12\x0f\n\x07pattern\x18\x02 \x01(\t2\xc7\x03\n\x19HttpUriRecognitionService\x12Q\n\x10\x66\x65tchAllPatterns\x12\x1e.HttpUriRecognitionSyncRequest\x1a\x1b.HttpUriRecognitionResponse\"\x00\x12[\n\x13\x66\x65tchPatternChanges\x12\x1e.HttpUriRecognitionSyncRequest\x1a\".HttpUriRecognitionChangesResponse\"\x00\x12`\n\x11subscribePatterns\x12#.HttpUriRecognitionSubscribeRequest\x1a\".HttpUriRecognitionChangesResponse\"\x00\x30\x01\x12\x43\n\x0b\x66\x65\x65\x64RawData\x12\x1a.HttpUriRecognitionRequest\x1a\x16.google.protobuf.Empty\"\x00\x12S\n\x11\x66\x65\x65\x64RawDataStream\x12\x1a.HttpUriRecognitionRequest\x1a\x1e.HttpUriRecognitionFeedSummary\"\x00(\x01\x42\x35\n1org.apache.skywalking.oap.server.ai.pipeline.grpcP\x01\x62\x06proto3')
+
+_globals = globals()
+_builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
+_builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'ai_http_uri_recognition_pb2', _globals)
+if not _descriptor._USE_C_DESCRIPTORS:
+  _globals['DESCRIPTOR']._loaded_options = None
+  _globals['DESCRIPTOR']._serialized_options = b'\n1org.apache.skywalking.oap.server.ai.pipeline.grpcP\001'
+  _globals['_HTTPURIRECOGNITIONSYNCREQUEST']._serialized_start=62
+  _globals['_HTTPURIRECOGNITIONSYNCREQUEST']._serialized_end=127
+  _globals['_HTTPURIRECOGNITIONSUBSCRIBEREQUEST']._serialized_start=129
+  _globals['_HTTPURIRECOGNITIONSUBSCRIBEREQUEST']._serialized_end=215
+  _globals['_HTTPURIRECOGNITIONREQUEST']._serialized_start=217
+  _globals['_HTTPURIRECOGNITIONREQUEST']._serialized_end=300
+  _globals['_HTTPURIRECOGNITIONFEEDSUMMARY']._serialized_start=302
+  _globals['_HTTPURIRECOGNITIONFEEDSUMMARY']._serialized_end=415
+  _globals['_HTTPRAWURI']._serialized_start=417
+  _globals['_HTTPRAWURI']._serialized_end=443
+  _globals['_HTTPURIRECOGNITIONRESPONSE']._serialized_start=445
+  _globals['_HTTPURIRECOGNITIONRESPONSE']._serialized_end=518
+  _globals['_HTTPURIRECOGNITIONCHANGESRESPONSE']._serialized_start=521
+  _globals['_HTTPURIRECOGNITIONCHANGESRESPONSE']._serialized_end=656
+  _globals['_PATTERN']._serialized_start=658
+  _globals['_PATTERN']._serialized_end=684
+  _globals['_HTTPURIRECOGNITIONSERVICE']._serialized_start=687
+  _globals['_HTTPURIRECOGNITIONSERVICE']._serialized_end=1142
+# @@protoc_insertion_point(module_scope)
@@ -0,0 +1,76 @@
+from google.protobuf import empty_pb2 as _empty_pb2
+from google.protobuf.internal import containers as _containers
+from google.protobuf import descriptor as _descriptor
+from google.protobuf import message as _message
+from collections.abc import Iterable as _Iterable, Mapping as _Mapping
+from typing import ClassVar as _ClassVar, Optional as _Optional, Union as _Union
+
+DESCRIPTOR: _descriptor.FileDescriptor
+
+class HttpUriRecognitionSyncRequest(_message.Message):
+    __slots__ = ("service", "version")
+    SERVICE_FIELD_NUMBER: _ClassVar[int]
+    VERSION_FIELD_NUMBER: _ClassVar[int]
+    service: str
+    version: str
+    def __init__(self, service: _Optional[str] = ..., version: _Optional[str] = ...) -> None: ...
+
+class HttpUriRecognitionSubscribeRequest(_message.Message):
+    __slots__ = ("services",)
+    SERVICES_FIELD_NUMBER: _ClassVar[int]
+    services: _containers.RepeatedCompositeFieldContainer[HttpUriRecognitionSyncRequest]
+    def __init__(self, services: _Optional[_Iterable[_Union[HttpUriRecognitionSyncRequest, _Mapping]]] = ...) -> None: ...
+
+class HttpUriRecognitionRequest(_message.Message):
+    __slots__ = ("service", "unrecognizedUris")
+    SERVICE_FIELD_NUMBER: _ClassVar[int]
+    UNRECOGNIZEDURIS_FIELD_NUMBER: _ClassVar[int]
+    service: str
+    unrecognizedUris: _containers.RepeatedCompositeFieldContainer[HttpRawUri]
+    def __init__(self, service: _Optional[str] = ..., unrecognizedUris: _Optional[_Iterable[_Union[HttpRawUri, _Mapping]]] = ...) -> None: ...
+
+class HttpUriRecognitionFeedSummary(_message.Message):
+    __slots__ = ("service", "receivedUris", "queuedUris", "queuedBatches")
+    SERVICE_FIELD_NUMBER: _ClassVar[int]
+    RECEIVEDURIS_FIELD_NUMBER: _ClassVar[int]
+    QUEUEDURIS_FIELD_NUMBER: _ClassVar[int]
+    QUEUEDBATCHES_FIELD_NUMBER: _ClassVar[int]
+    service: str
+    receivedUris: int
+    queuedUris: int
+    queuedBatches: int
+    def __init__(self, service: _Optional[str] = ..., receivedUris: _Optional[int] = ..., queuedUris: _Optional[int] = ..., queuedBatches: _Optional[int] = ...) -> None: ...
+
+class HttpRawUri(_message.Message):
+    __slots__ = ("name",)
+    NAME_FIELD_NUMBER: _ClassVar[int]
+    name: str
+    def __init__(self, name: _Optional[str] = ...) -> None: ...
+
+class HttpUriRecognitionResponse(_message.Message):
+    __slots__ = ("patterns", "version")
+    PATTERNS_FIELD_NUMBER: _ClassVar[int]
+    VERSION_FIELD_NUMBER: _ClassVar[int]
+    patterns: _containers.RepeatedCompositeFieldContainer[Pattern]
+    version: str
+    def __init__(self, patterns: _Optional[_Iterable[_Union[Pattern, _Mapping]]] = ..., version: _Optional[str] = ...) -> None: ...
+
+class HttpUriRecognitionChangesResponse(_message.Message):
+    __slots__ = ("added", "removed", "version", "full", "service")
+    ADDED_FIELD_NUMBER: _ClassVar[int]
+    REMOVED_FIELD_NUMBER: _ClassVar[int]
+    VERSION_FIELD_NUMBER: _ClassVar[int]
+    FULL_FIELD_NUMBER: _ClassVar[int]
+    SERVICE_FIELD_NUMBER: _ClassVar[int]
+    added: _containers.RepeatedCompositeFieldContainer[Pattern]
+    removed: _containers.RepeatedCompositeFieldContainer[Pattern]
+    version: str
+    full: bool
+    service: str
+    def __init__(self, added: _Optional[_Iterable[_Union[Pattern, _Mapping]]] = ..., removed: _Optional[_Iterable[_Union[Pattern, _Mapping]]] = ..., version: _Optional[str] = ..., full: _Optional[bool] = ..., service: _Optional[str] = ...) -> None: ...
+
+class Pattern(_message.Message):
+    __slots__ = ("pattern",)
+    PATTERN_FIELD_NUMBER: _ClassVar[int]
+    pattern: str
+    def __init__(self, pattern: _Optional[str] = ...) -> None: ...
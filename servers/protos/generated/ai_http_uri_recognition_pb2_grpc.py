@@ -0,0 +1,277 @@
+# Generated by the gRPC Python protocol compiler plugin. DO NOT EDIT!
+"""Client and server classes corresponding to protobuf-defined services."""
+import grpc
+import warnings
+from . import ai_http_uri_recognition_pb2 as ai__http__uri__recognition__pb2
+from google.protobuf import empty_pb2 as google_dot_protobuf_dot_empty__pb2
+
+GRPC_GENERATED_VERSION = '1.84.0'
+GRPC_VERSION = grpc.__version__
+_version_not_supported = False
+
+try:
+    from grpc._utilities import first_version_is_lower
+    _version_not_supported = first_version_is_lower(GRPC_VERSION, GRPC_GENERATED_VERSION)
+except ImportError:
+    _version_not_supported = True
+
+if _version_not_supported:
+    raise RuntimeError(
+        f'The grpc package installed is at version {GRPC_VERSION},'
+        + ' but the generated code in ai_http_uri_recognition_pb2_grpc.py depends on'
+        + f' grpcio>={GRPC_GENERATED_VERSION}.'
+        + f' Please upgrade your grpc module to grpcio>={GRPC_GENERATED_VERSION}'
+        + f' or downgrade your generated code using grpcio-tools<={GRPC_VERSION}.'
+    )
+
+
+class HttpUriRecognitionServiceStub:
+    """Missing associated documentation comment in .proto file."""
+
+    def __init__(self, channel):
+        """Constructor.
+
+        Args:
+            channel: A grpc.Channel.
+        """
+        self.fetchAllPatterns = channel.unary_unary(
+                '/HttpUriRecognitionService/fetchAllPatterns',
+                request_serializer=ai__http__uri__recognition__pb2.HttpUriRecognitionSyncRequest.SerializeToString,
+                response_deserializer=ai__http__uri__recognition__pb2.HttpUriRecognitionResponse.FromString,
+                _registered_method=True)
+        self.fetchPatternChanges = channel.unary_unary(
+                '/HttpUriRecognitionService/fetchPatternChanges',
+                request_serializer=ai__http__uri__recognition__pb2.HttpUriRecognitionSyncRequest.SerializeToString,
+                response_deserializer=ai__http__uri__recognition__pb2.HttpUriRecognitionChangesResponse.FromString,
+                _registered_method=True)
+        self.subscribePatterns = channel.unary_stream(
+                '/HttpUriRecognitionService/subscribePatterns',
+                request_serializer=ai__http__uri__recognition__pb2.HttpUriRecognitionSubscribeRequest.SerializeToString,
+                response_deserializer=ai__http__uri__recognition__pb2.HttpUriRecognitionChangesResponse.FromString,
+                _registered_method=True)
+        self.feedRawData = channel.unary_unary(
+                '/HttpUriRecognitionService/feedRawData',
+                request_serializer=ai__http__uri__recognition__pb2.HttpUriRecognitionRequest.SerializeToString,
+                response_deserializer=google_dot_protobuf_dot_empty__pb2.Empty.FromString,
+                _registered_method=True)
+        self.feedRawDataStream = channel.stream_unary(
+                '/HttpUriRecognitionService/feedRawDataStream',
+                request_serializer=ai__http__uri__recognition__pb2.HttpUriRecognitionRequest.SerializeToString,
+                response_deserializer=ai__http__uri__recognition__pb2.HttpUriRecognitionFeedSummary.FromString,
+                _registered_method=True)
+
+
+class HttpUriRecognitionServiceServicer:
+    """Missing associated documentation comment in .proto file."""
+
+    def fetchAllPatterns(self, request, context):
+        """Sync for the pattern recognition dictionary.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def fetchPatternChanges(self, request, context):
+        """Sync only the patterns added and removed since the version at the OAP side.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def subscribePatterns(self, request, context):
+        """Subscribe to the patterns of services instead of polling them: the changes since the versions at the OAP side
+        are sent first, then the changes of every new version as soon as it is published,
+        and a response without service as a heartbeat meanwhile.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def feedRawData(self, request, context):
+        """Feed new raw data and matched patterns to the AI-server.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def feedRawDataStream(self, request_iterator, context):
+        """Feed the raw data of a service in chunks, e.g. to backfill it with historical URIs,
+        all the chunks are of the service of the first one.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+
+def add_HttpUriRecognitionServiceServicer_to_server(servicer, server):
+    rpc_method_handlers = {
+            'fetchAllPatterns': grpc.unary_unary_rpc_method_handler(
+                    servicer.fetchAllPatterns,
+                    request_deserializer=ai__http__uri__recognition__pb2.HttpUriRecognitionSyncRequest.FromString,
+                    response_serializer=ai__http__uri__recognition__pb2.HttpUriRecognitionResponse.SerializeToString,
+            ),
+            'fetchPatternChanges': grpc.unary_unary_rpc_method_handler(
+                    servicer.fetchPatternChanges,
+                    request_deserializer=ai__http__uri__recognition__pb2.HttpUriRecognitionSyncRequest.FromString,
+                    response_serializer=ai__http__uri__recognition__pb2.HttpUriRecognitionChangesResponse.SerializeToString,
+            ),
+            'subscribePatterns': grpc.unary_stream_rpc_method_handler(
+                    servicer.subscribePatterns,
+                    request_deserializer=ai__http__uri__recognition__pb2.HttpUriRecognitionSubscribeRequest.FromString,
+                    response_serializer=ai__http__uri__recognition__pb2.HttpUriRecognitionChangesResponse.SerializeToString,
+            ),
+            'feedRawData': grpc.unary_unary_rpc_method_handler(
+                    servicer.feedRawData,
+                    request_deserializer=ai__http__uri__recognition__pb2.HttpUriRecognitionRequest.FromString,
+                    response_serializer=google_dot_protobuf_dot_empty__pb2.Empty.SerializeToString,
+            ),
+            'feedRawDataStream': grpc.stream_unary_rpc_method_handler(
+                    servicer.feedRawDataStream,
+                    request_deserializer=ai__http__uri__recognition__pb2.HttpUriRecognitionRequest.FromString,
+                    response_serializer=ai__http__uri__recognition__pb2.HttpUriRecognitionFeedSummary.SerializeToString,
+            ),
+    }
+    generic_handler = grpc.method_handlers_generic_handler(
+            'HttpUriRecognitionService', rpc_method_handlers)
+    server.add_generic_rpc_handlers((generic_handler,))
+    server.add_registered_method_handlers('HttpUriRecognitionService', rpc_method_handlers)
+
+
+ # This class is part of an EXPERIMENTAL API.
+class HttpUriRecognitionService:
+    """Missing associated documentation comment in .proto file."""
+
+    @staticmethod
+    def fetchAllPatterns(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/HttpUriRecognitionService/fetchAllPatterns',
+            ai__http__uri__recognition__pb2.HttpUriRecognitionSyncRequest.SerializeToString,
+            ai__http__uri__recognition__pb2.HttpUriRecognitionResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def fetchPatternChanges(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/HttpUriRecognitionService/fetchPatternChanges',
+            ai__http__uri__recognition__pb2.HttpUriRecognitionSyncRequest.SerializeToString,
+            ai__http__uri__recognition__pb2.HttpUriRecognitionChangesResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def subscribePatterns(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(
+            request,
+            target,
+            '/HttpUriRecognitionService/subscribePatterns',
+            ai__http__uri__recognition__pb2.HttpUriRecognitionSubscribeRequest.SerializeToString,
+            ai__http__uri__recognition__pb2.HttpUriRecognitionChangesResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def feedRawData(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/HttpUriRecognitionService/feedRawData',
+            ai__http__uri__recognition__pb2.HttpUriRecognitionRequest.SerializeToString,
+            google_dot_protobuf_dot_empty__pb2.Empty.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def feedRawDataStream(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_unary(
+            request_iterator,
+            target,
+            '/HttpUriRecognitionService/feedRawDataStream',
+            ai__http__uri__recognition__pb2.HttpUriRecognitionRequest.SerializeToString,
+            ai__http__uri__recognition__pb2.HttpUriRecognitionFeedSummary.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
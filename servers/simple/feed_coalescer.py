@@ -0,0 +1,112 @@
+#  Copyright 2023 SkyAPM org
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Coalescing of the feeds of the gRPC process before they are queued to the worker.
+
+The uris fed to a service are merged into one deduplicated batch, queued to the worker owning the service once the
+window has passed or the batch is large enough. The worker queues are bounded: while the queue of the worker is full,
+a feed returns once its batch is queued, and the batches that still find it full after max_wait_sec are shed
+and counted.
+"""
+
+import asyncio
+import queue
+import time
+from typing import Dict, Iterable, List, Optional
+
+import logger
+from servers.simple.worker import worker_index
+
+logger = logger.init_logger(name=__name__)
+
+
+class FeedCoalescer:
+    # seconds between two attempts to put a batch into the full queue
+    retry_interval = 0.01
+
+    def __init__(self, uri_queues: list, window_sec: float, max_uris: int, max_wait_sec: float):
+        """
+        :param uri_queues: the queue of each worker, the batches of a service go to the worker owning it
+        """
+        self.uri_queues = uri_queues
+        self.window_sec = window_sec
+        self.max_uris = max_uris
+        self.max_wait_sec = max_wait_sec
+        # service -> unique uris fed since its last batch, in the order they came
+        self.pending: Dict[str, Dict[str, None]] = {}
+        self.task: Optional[asyncio.Task] = None
+        # metrics
+        self.fed_uris = 0
+        self.queued_uris = 0
+        self.queued_batches = 0
+        self.shed_uris = 0
+        self.shed_batches = 0
+
+    async def feed(self, service: str, uris: Iterable[str]):
+        """
+        Add the uris to the pending batch of the service, returns once queued if the batch is large enough
+        or the worker is behind, so the caller is held back instead of having its uris shed unnoticed.
+        """
+        pending = self.pending.setdefault(service, {})
+        for uri in uris:
+            pending[uri] = None
+            self.fed_uris += 1
+        if len(pending) >= self.max_uris or self.uri_queues[worker_index(service, len(self.uri_queues))].full():
+            await self.flush(service)
+        elif self.task is None or self.task.done():
+            # started in the event loop of the first feed, it stops once nothing is pending
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def flush(self, service: str):
+        pending = self.pending.pop(service, None)
+        if pending:
+            await self.put(service, list(pending))
+
+    async def run(self):
+        while self.pending:
+            await asyncio.sleep(self.window_sec)
+            # the queues are flushed side by side, a full queue only holds back the services of its own worker
+            services_by_queue: Dict[int, List[str]] = {}
+            for service in self.pending:
+                services_by_queue.setdefault(worker_index(service, len(self.uri_queues)), []).append(service)
+            await asyncio.gather(*(self.flush_services(services) for services in services_by_queue.values()))
+
+    async def flush_services(self, services: List[str]):
+        for service in services:
+            await self.flush(service)
+
+    async def put(self, service: str, uris: List[str], shed: bool = True) -> bool:
+        """
+        Queue a batch of uris of the service, waiting while the queue is full.
+        :param shed: drop the batch if the queue is still full after max_wait_sec, instead of waiting on
+        :return: False if the batch is dropped
+        """
+        uri_queue = self.uri_queues[worker_index(service, len(self.uri_queues))]
+        deadline = time.monotonic() + self.max_wait_sec
+        while True:
+            try:
+                uri_queue.put_nowait((uris, service))
+                self.queued_uris += len(uris)
+                self.queued_batches += 1
+                return True
+            except queue.Full:
+                if shed and time.monotonic() >= deadline:
+                    self.shed_uris += len(uris)
+                    self.shed_batches += 1
+                    logger.warning(f'The worker queue is full, dropped {len(uris)} uris of service {service}, '
+                                   f'{self.shed_uris} uris in {self.shed_batches} batches dropped so far '
+                                   f'out of {self.fed_uris} uris fed')
+                    return False
+                await asyncio.sleep(self.retry_interval)
@@ -0,0 +1,109 @@
+#  Copyright 2023 SkyAPM org
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Fan-out of the new pattern versions to the subscribers of subscribePatterns, in the gRPC process.
+
+The hub checks the versions of the subscribed services once per check_interval, for all the subscribers at once,
+and hands the responses of a new version to each subscriber of the service. With a shared results object counting
+its publishes, e.g. the SharedPatternStore, the versions are only checked when something was published.
+"""
+
+import asyncio
+from collections import defaultdict
+from typing import Callable, Dict, Optional, Set
+
+import logger
+
+logger = logger.init_logger(name=__name__)
+
+
+class Subscription:
+    """The services of a subscriber and their versions at its side, with the new versions not sent yet."""
+
+    def __init__(self, versions: Dict[str, str]):
+        # service -> version name at the subscriber side
+        self.versions = versions
+        # service -> responses of a version newer than the one at the subscriber side, the latest one only
+        self.pending = {}
+        self.event = asyncio.Event()
+
+    def notify(self, service: str, responses):
+        self.pending[service] = responses
+        self.event.set()
+
+    def take_pending(self) -> dict:
+        self.event.clear()
+        pending, self.pending = self.pending, {}
+        return pending
+
+
+class PatternHub:
+    # seconds between two checks of the versions of the subscribed services
+    check_interval = 0.02
+
+    def __init__(self, get_responses: Callable, get_publish_count: Optional[Callable] = None):
+        """
+        :param get_responses: service -> responses of its latest version, with version and version_name attributes
+        :param get_publish_count: number of publishes of all the services so far, if the shared results count them
+        """
+        self.get_responses = get_responses
+        self.get_publish_count = get_publish_count
+        self.publish_count = None
+        # service -> subscriptions to it
+        self.subscriptions: Dict[str, Set[Subscription]] = defaultdict(set)
+        # service -> version last handed to its subscriptions
+        self.versions: Dict[str, int] = {}
+        self.task: Optional[asyncio.Task] = None
+
+    def subscribe(self, subscription: Subscription):
+        for service in subscription.versions:
+            self.subscriptions[service].add(subscription)
+        # the versions of the new services are checked on the next check
+        self.publish_count = None
+        # started in the event loop of the first subscriber, it stops once there is no subscriber left
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    def unsubscribe(self, subscription: Subscription):
+        for service in subscription.versions:
+            subscriptions = self.subscriptions.get(service)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self.subscriptions[service]
+                    self.versions.pop(service, None)
+
+    async def run(self):
+        while self.subscriptions:
+            await asyncio.sleep(self.check_interval)
+            try:
+                self.check_versions()
+            except Exception as e:
+                logger.error(f'Failed to check the pattern versions of the subscribed services: {e}')
+
+    def check_versions(self):
+        if self.get_publish_count is not None:
+            publish_count = self.get_publish_count()
+            if publish_count == self.publish_count:
+                return
+            self.publish_count = publish_count
+        for service, subscriptions in list(self.subscriptions.items()):
+            responses = self.get_responses(service)
+            if self.versions.get(service) == responses.version:
+                continue
+            self.versions[service] = responses.version
+            for subscription in subscriptions:
+                if subscription.versions[service] != responses.version_name:
+                    subscription.notify(service, responses)
@@ -0,0 +1,278 @@
+#  Copyright 2023 SkyAPM org
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+A shared memory store of the patterns of all services, replacing the manager proxy of URIDrainResults.
+
+The worker publishes into it and the server reads it directly, without a round trip to another process.
+The index segment holds a slot per service: its name, the version of its patterns and where they are.
+The patterns of a service are pickled in a segment of their own, replaced by a larger one when they outgrow it.
+
+A slot is written by the worker owning the service only, readers don't lock: the sequence number of the slot is odd
+while it is being written (seqlock), a reader retries when it changed during its read, backing off after a few retries.
+The slots are never freed, the patterns of a service stay published once its miner is unloaded. The publishes of the
+services that get no slot raise PatternStoreError and are counted, see get_rejected_count.
+"""
+
+import multiprocessing
+import pickle
+import secrets
+import struct
+import sys
+import time
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, List, Optional, Tuple
+
+import logger
+
+logger = logger.init_logger(name=__name__)
+
+MAGIC = b'URIPATTS'
+# magic, max number of services, number of services, number of publishes of all the services,
+# number of publishes rejected
+HEADER = struct.Struct('<8sIIQQ')
+# sequence number, version, generation of the patterns segment (0 before the first publish), patterns size,
+# service name size, followed by the utf-8 service name
+SLOT = struct.Struct('<QQQQH')
+MAX_SERVICE_NAME_SIZE = 256
+SLOT_SIZE = SLOT.size + MAX_SERVICE_NAME_SIZE
+
+DEFAULT_MAX_SERVICES = 16384
+MIN_SEGMENT_SIZE = 4096
+# reads retried at once while a slot is being written, before backing off
+READ_SPIN_COUNT = 100
+MIN_READ_BACKOFF_SEC = 0.0001
+MAX_READ_BACKOFF_SEC = 0.005
+# a slot still being written after so long means its writer died in the middle
+MAX_READ_WAIT_SEC = 0.05
+
+
+class PatternStoreError(ValueError):
+    """The patterns of a service can't be published, its name is too long or the store is full."""
+
+
+def open_segment(name: str, create: bool = False, size: int = 0) -> SharedMemory:
+    # the segments are removed by unlink() of the store, so they aren't tracked by the resource tracker where possible:
+    # registering every segment attached is a round trip to the tracker process
+    if sys.version_info >= (3, 13):
+        return SharedMemory(name, create=create, size=size, track=False)
+    return SharedMemory(name, create=create, size=size)
+
+
+class SharedPatternStore:
+    """
+    Same interface as URIDrainResults, created by the main process with create() and passed to the processes.
+    """
+
+    def __init__(self, index: SharedMemory, lock):
+        self.index = index
+        # serializes the allocation of slots between the writers
+        self.lock = lock
+        magic, self.max_services, _, _, _ = HEADER.unpack_from(index.buf)
+        if magic != MAGIC:
+            raise ValueError(f"shared memory {index.name} is not a pattern store")
+        # service -> slot, of the slots scanned so far, slots are never freed
+        self.slots: Dict[str, int] = {}
+        self.scanned_count = 0
+        # slot -> patterns segment of the latest generation attached
+        self.segments: Dict[int, SharedMemory] = {}
+        # slot -> version and patterns last read or written, decoded again only when the version changes
+        self.patterns: Dict[int, Tuple[int, List[str]]] = {}
+
+    @classmethod
+    def create(cls, max_services: int = DEFAULT_MAX_SERVICES) -> 'SharedPatternStore':
+        index = open_segment(f'uridrain_{secrets.token_hex(6)}', create=True,
+                             size=HEADER.size + max_services * SLOT_SIZE)
+        HEADER.pack_into(index.buf, 0, MAGIC, max_services, 0, 0, 0)
+        return cls(index, multiprocessing.Lock())
+
+    @classmethod
+    def attach(cls, name: str, lock) -> 'SharedPatternStore':
+        return cls(open_segment(name), lock)
+
+    def __reduce__(self):
+        # with the spawn start method, the processes attach to the same segments
+        return SharedPatternStore.attach, (self.index.name, self.lock)
+
+    def get_version(self, service) -> int:
+        slot = self.find_slot(service)
+        return 0 if slot is None else self.read_slot(slot, False)[0]
+
+    def get_dict_field(self, service) -> List[str]:
+        """The patterns of the service, the list returned is shared and must not be modified."""
+        slot = self.find_slot(service)
+        return [] if slot is None else self.read_slot(slot, True)[1]
+
+    def set_dict_field(self, service, value):
+        if set(self.get_dict_field(service)) ^ set(value):
+            self.write_slot(service, list(value))
+
+    def update_dict_field(self, service, added, removed):
+        """Apply the added and removed patterns of a service."""
+        if not added and not removed:
+            return
+        patterns = self.get_dict_field(service)
+        if removed:
+            removed = set(removed)
+            patterns = [pattern for pattern in patterns if pattern not in removed]
+        self.write_slot(service, patterns + list(added))
+
+    def get_publish_count(self) -> int:
+        """Changes whenever the patterns of a service are published, so readers can skip checking every service."""
+        return HEADER.unpack_from(self.index.buf)[3]
+
+    def get_rejected_count(self) -> int:
+        """Number of publishes rejected so far by all the processes, see PatternStoreError."""
+        return HEADER.unpack_from(self.index.buf)[4]
+
+    def find_slot(self, service) -> Optional[int]:
+        slot = self.slots.get(service)
+        if slot is not None:
+            return slot
+        buf = self.index.buf
+        count = HEADER.unpack_from(buf)[2]
+        for slot in range(self.scanned_count, count):
+            offset = self.slot_offset(slot)
+            name_size = SLOT.unpack_from(buf, offset)[4]
+            self.slots[str(buf[offset + SLOT.size:offset + SLOT.size + name_size], 'utf-8')] = slot
+        self.scanned_count = count
+        return self.slots.get(service)
+
+    def allocate_slot(self, service) -> int:
+        name = service.encode('utf-8')
+        with self.lock:
+            # another writer may have allocated it meanwhile
+            slot = self.find_slot(service)
+            if slot is not None:
+                return slot
+            buf = self.index.buf
+            _, _, slot, publish_count, rejected_count = HEADER.unpack_from(buf)
+            reason = None
+            if len(name) > MAX_SERVICE_NAME_SIZE:
+                reason = f"its name is longer than {MAX_SERVICE_NAME_SIZE} bytes"
+            elif slot >= self.max_services:
+                reason = f"the pattern store is full, max {self.max_services} services, see WORKER_MAX_SERVICES"
+            if reason is not None:
+                HEADER.pack_into(buf, 0, MAGIC, self.max_services, slot, publish_count, rejected_count + 1)
+                raise PatternStoreError(f"Failed to publish the patterns of service <{service}>, {reason}, "
+                                        f"{rejected_count + 1} publishes rejected so far")
+            offset = self.slot_offset(slot)
+            SLOT.pack_into(buf, offset, 0, 0, 0, 0, len(name))
+            buf[offset + SLOT.size:offset + SLOT.size + len(name)] = name
+            # the slot is complete before it is counted, so readers never see it half written
+            HEADER.pack_into(buf, 0, MAGIC, self.max_services, slot + 1, publish_count, rejected_count)
+            self.slots[service] = slot
+            return slot
+
+    def read_slot(self, slot: int, with_patterns: bool) -> Tuple[int, List[str]]:
+        buf = self.index.buf
+        offset = self.slot_offset(slot)
+        retries = 0
+        backoff = MIN_READ_BACKOFF_SEC
+        deadline = None
+        while True:
+            if retries >= READ_SPIN_COUNT:
+                # the writer is slow or gone, the caller may be an event loop: wait a bit longer between reads
+                # and give up after MAX_READ_WAIT_SEC
+                if deadline is None:
+                    deadline = time.monotonic() + MAX_READ_WAIT_SEC
+                elif time.monotonic() >= deadline:
+                    break
+                time.sleep(backoff)
+                backoff = min(2 * backoff, MAX_READ_BACKOFF_SEC)
+            retries += 1
+            sequence, version, generation, size, _ = SLOT.unpack_from(buf, offset)
+            if sequence & 1:
+                continue
+            cached = self.patterns.get(slot)
+            data = None
+            if with_patterns and generation and (cached is None or cached[0] != version):
+                try:
+                    segment = self.attach_segment(slot, generation)
+                except FileNotFoundError:
+                    # replaced by a larger segment meanwhile
+                    continue
+                data = bytes(segment.buf[:size])
+            if SLOT.unpack_from(buf, offset)[0] != sequence:
+                continue
+            if data is not None:
+                cached = (version, pickle.loads(data))
+                self.patterns[slot] = cached
+            elif not generation:
+                cached = (version, [])
+            return version, cached[1] if with_patterns else []
+        logger.error(f"Slot {slot} of the pattern store is still being written, its writer may have died")
+        return self.patterns.get(slot, (0, []))
+
+    def write_slot(self, service, patterns: List[str]):
+        slot = self.find_slot(service)
+        if slot is None:
+            slot = self.allocate_slot(service)
+        data = pickle.dumps(patterns, protocol=pickle.HIGHEST_PROTOCOL)
+        buf = self.index.buf
+        offset = self.slot_offset(slot)
+        sequence, version, generation, _, name_size = SLOT.unpack_from(buf, offset)
+        segment = self.attach_segment(slot, generation) if generation else None
+        replaced = None
+        if segment is None or segment.size < len(data):
+            replaced = segment
+            generation += 1
+            segment = open_segment(self.segment_name(slot, generation), create=True,
+                                   size=max(MIN_SEGMENT_SIZE, 2 * len(data)))
+        SLOT.pack_into(buf, offset, sequence + 1, version, generation, len(data), name_size)
+        segment.buf[:len(data)] = data
+        SLOT.pack_into(buf, offset, sequence + 2, version + 1, generation, len(data), name_size)
+        self.segments[slot] = segment
+        self.patterns[slot] = (version + 1, patterns)
+        with self.lock:
+            _, _, count, publish_count, rejected_count = HEADER.unpack_from(buf)
+            HEADER.pack_into(buf, 0, MAGIC, self.max_services, count, publish_count + 1, rejected_count)
+        if replaced is not None:
+            # the readers still reading it keep their mapping, the others attach the new segment
+            replaced.close()
+            replaced.unlink()
+
+    def attach_segment(self, slot: int, generation: int) -> SharedMemory:
+        name = self.segment_name(slot, generation)
+        segment = self.segments.get(slot)
+        if segment is None or segment.name != name:
+            if segment is not None:
+                segment.close()
+            segment = open_segment(name)
+            self.segments[slot] = segment
+        return segment
+
+    def segment_name(self, slot: int, generation: int) -> str:
+        return f'{self.index.name}_{slot}_{generation}'
+
+    @staticmethod
+    def slot_offset(slot: int) -> int:
+        return HEADER.size + slot * SLOT_SIZE
+
+    def close(self):
+        for segment in self.segments.values():
+            segment.close()
+        self.segments.clear()
+        self.index.close()
+
+    def unlink(self):
+        """Remove the segments of the store, once all processes are done with it."""
+        buf = self.index.buf
+        for slot in range(HEADER.unpack_from(buf)[2]):
+            generation = SLOT.unpack_from(buf, self.slot_offset(slot))[2]
+            if generation:
+                segment = self.attach_segment(slot, generation)
+                segment.unlink()
+        self.close()
+        self.index.unlink()
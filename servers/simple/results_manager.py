@@ -16,6 +16,7 @@
 This is a shared drain3 results manager with proxy class.
 
 This probably should be replaced with redis or memcached in serious use cases.
+The server uses the shared memory store of pattern_store.py instead, which implements the same interface.
 """
 from collections import defaultdict
 import multiprocessing.managers as m
@@ -48,6 +49,18 @@ class URIDrainResults:
             self.versions[service] += 1
             self.results[service] = value
 
+    def update_dict_field(self, service, added, removed):
+        """
+        Apply the added and removed patterns of a service, so only the changes have to be sent over
+        """
+        if not added and not removed:
+            return
+        self.versions[service] += 1
+        if removed:
+            removed = set(removed)
+            self.results[service] = [pattern for pattern in self.results[service] if pattern not in removed]
+        self.results[service].extend(added)
+
     def get_version(self, service):
         return self.versions[service]
 
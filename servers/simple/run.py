@@ -16,9 +16,9 @@ import os
 from os.path import dirname
 import logger
 
-from models.uri_drain.template_miner import load_existing_miners
+from models.uri_drain.template_miner import load_existing_patterns
 from models.uri_drain.template_miner_config import TemplateMinerConfig
-from servers.simple.results_manager import ProxyURIDrainResultsManager, URIDrainResults
+from servers.simple.pattern_store import PatternStoreError, SharedPatternStore
 from servers.simple.server import run_server
 from servers.simple.worker import run_worker
 
@@ -27,10 +27,6 @@ logger = logger.init_logger(name=__name__)
 
 def run():
     logger.info('Starting server from entrypoint...')
-    ProxyURIDrainResultsManager.register("URIDrainResults", URIDrainResults)
-
-    manager = ProxyURIDrainResultsManager()
-    manager.start()
 
     # Load config
     config = TemplateMinerConfig()
@@ -38,26 +34,37 @@ def run():
     logger.info(f'Searching for config file at {config_file}')
     config.load(config_filename=config_file)  # change to config injection from env or other
 
-    # SET DEBUG HERE! < TODO CONFIG FILE
-    shared_results_object = manager.URIDrainResults(debug=False)  # noqa
-    uri_main_queue = multiprocessing.Queue()
-
-    # Load existing miner and clusters
-    miners = load_existing_miners(config)
-    for service in miners:
-        shared_results_object.set_dict_field(service=service, value=miners[service].drain.cluster_patterns)
+    # The worker publishes the patterns into shared memory, the server reads them without a round trip to another process
+    # its index is sized for max_services services up front
+    shared_results_object = SharedPatternStore.create(max_services=config.worker_max_services)
+    # a queue per worker, bounded, the server holds the feeds back or drops them when a worker is behind
+    uri_queues = [multiprocessing.Queue(maxsize=config.feed_queue_size) for _ in range(config.worker_count)]
 
-    producer_process = multiprocessing.Process(target=run_server, args=(uri_main_queue, shared_results_object, config))
-    consumer_process = multiprocessing.Process(target=run_worker,
-                                               args=(uri_main_queue, shared_results_object, config, miners))
+    # Publish the patterns of the existing services, their miners are loaded once fed again,
+    # otherwise the worker loads and publishes them as soon as it has started
+    if config.snapshot_lazy_load:
+        for service, patterns in load_existing_patterns(config).items():
+            try:
+                shared_results_object.set_dict_field(service=service, value=patterns)
+            except PatternStoreError as e:
+                logger.error(e)
 
-    producer_process.start()
-    consumer_process.start()
+    producer_process = multiprocessing.Process(target=run_server, args=(uri_queues, shared_results_object, config))
+    # the services are sharded across the workers, each one owns, loads and saves its services only
+    consumer_processes = [multiprocessing.Process(target=run_worker,
+                                                  args=(uri_queue, shared_results_object, config, index))
+                          for index, uri_queue in enumerate(uri_queues)]
 
-    producer_process.join()
-    consumer_process.join()
+    try:
+        producer_process.start()
+        for consumer_process in consumer_processes:
+            consumer_process.start()
 
-    manager.shutdown()
+        producer_process.join()
+        for consumer_process in consumer_processes:
+            consumer_process.join()
+    finally:
+        shared_results_object.unlink()
 
 
 if __name__ == "__main__":
@@ -14,19 +14,91 @@
 
 import asyncio
 import sys
-from collections import defaultdict
+from collections import defaultdict, deque
 from concurrent import futures
+from typing import Dict, List, Optional
 
 import grpc
 import logger
 from google.protobuf.empty_pb2 import Empty
 
+from models.uri_drain.uri_drain import PatternChanges, merge_pattern_changes
 from servers.protos.generated import ai_http_uri_recognition_pb2
 from servers.protos.generated import ai_http_uri_recognition_pb2_grpc
-from servers.protos.generated.ai_http_uri_recognition_pb2 import Pattern
+from servers.protos.generated.ai_http_uri_recognition_pb2 import HttpUriRecognitionChangesResponse, \
+    HttpUriRecognitionFeedSummary, HttpUriRecognitionResponse, Pattern
+from servers.simple.feed_coalescer import FeedCoalescer
+from servers.simple.pattern_hub import PatternHub, Subscription
 
 logger = logger.init_logger(name=__name__)
 
+# number of versions of a service that fetchPatternChanges can diff against
+MAX_VERSION_HISTORY = 16
+# seconds without a new version after which subscribePatterns sends a heartbeat
+HEARTBEAT_INTERVAL = 10
+# a HttpUriRecognitionChangesResponse without service
+HEARTBEAT = HttpUriRecognitionChangesResponse().SerializeToString()
+# number of uris of the batches of feedRawDataStream
+FEED_BATCH_SIZE = 5000
+
+
+def version_name(version: int) -> str:
+    # OAP side is NULL, so we must not return NULL otherwise it will always be NULL
+    return 'NULL' if version == 0 else str(version)
+
+
+class ServiceResponses:
+    """
+    The serialized responses of a service at a version, built once for all the OAP nodes polling it:
+    the fetchAllPatterns responses with the patterns and the empty one returned when the OAP side has that version
+    already, and the fetchPatternChanges responses since the versions of the history, built when first asked.
+    """
+
+    def __init__(self, service: str, version: int, patterns: List[str], history: deque):
+        self.service = service
+        self.version = version
+        self.version_name = version_name(version)
+        self.patterns = patterns
+        # (previous version, PatternChanges to the next version) of the latest versions, oldest first
+        self.history = history
+        self.full = HttpUriRecognitionResponse(patterns=[Pattern(pattern=pattern) for pattern in patterns],
+                                               version=self.version_name).SerializeToString()
+        self.unchanged = HttpUriRecognitionResponse(patterns=[], version=self.version_name).SerializeToString()
+        # version name at the OAP side -> fetchPatternChanges response, None for the versions not in the history
+        self.changes: Dict[Optional[str], bytes] = {}
+
+    def next_version(self, version: int, patterns: List[str]) -> 'ServiceResponses':
+        previous, current = set(self.patterns), set(patterns)
+        added = [pattern for pattern in patterns if pattern not in previous]
+        removed = [pattern for pattern in self.patterns if pattern not in current]
+        history = deque(self.history, maxlen=MAX_VERSION_HISTORY)
+        history.append((self.version, PatternChanges(version, added, removed)))
+        return ServiceResponses(self.service, version, patterns, history)
+
+    def get_changes(self, since_version: str) -> bytes:
+        response = self.changes.get(since_version)
+        if response is not None:
+            return response
+        since_versions = [version_name(version) for version, _ in self.history]
+        full = False
+        if since_version == self.version_name:
+            added, removed = [], []
+        elif since_version in since_versions:
+            index = since_versions.index(since_version)
+            added, removed = merge_pattern_changes(changes for _, changes in list(self.history)[index:])
+        else:
+            # too old, or from before a restart, all these versions share the full response
+            response = self.changes.get(None)
+            if response is not None:
+                return response
+            since_version, added, removed, full = None, self.patterns, [], True
+        response = HttpUriRecognitionChangesResponse(added=[Pattern(pattern=pattern) for pattern in added],
+                                                     removed=[Pattern(pattern=pattern) for pattern in removed],
+                                                     version=self.version_name, full=full,
+                                                     service=self.service).SerializeToString()
+        self.changes[since_version] = response
+        return response
+
 
 class HttpUriRecognitionServicer(ai_http_uri_recognition_pb2_grpc.HttpUriRecognitionServiceServicer):
     """
@@ -41,37 +113,86 @@ class HttpUriRecognitionServicer(ai_http_uri_recognition_pb2_grpc.HttpUriRecogni
         self.uri_main_queue = uri_main_queue
         self.known_services = defaultdict(int)  # service_name: received_count
         self.conf = conf
+        # service -> its responses at the latest version seen
+        self.responses: Dict[str, ServiceResponses] = {}
+        self.hub = PatternHub(self.get_responses, getattr(shared_results_object, 'get_publish_count', None))
+        # the queue of each worker, or the queue of the single worker
+        uri_queues = uri_main_queue if isinstance(uri_main_queue, list) else [uri_main_queue]
+        self.coalescer = FeedCoalescer(uri_queues, conf.feed_coalesce_window_sec, conf.feed_coalesce_max_uris,
+                                       conf.feed_max_wait_sec)
 
     async def fetchAllPatterns(self, request, context):
+        """
+        Returns the serialized HttpUriRecognitionResponse, registered by add_servicer_to_server without a serializer
+        """
         # TODO OAP SIDE OR THIS SIDE must save the version, e.g. oap should check if version is > got version,  since
         #  this is a stateful service and it may crash and restart
         logger.info(
             f'> Received fetchAllPatterns request for service <{request.service}>, '
             f'oap side version is: {request.version}')
 
-        version = str(self.shared_results_object.get_version(service=request.service))
-        if version == '0':
-            version = 'NULL'  # OAP side is NULL, so we must not return NULL otherwise it will always be NULL
+        responses = self.get_responses(request.service)
 
         # https://github.com/apache/skywalking/blob/master/oap-server/ai-pipeline/src/main/java/org
         # /apache/skywalking/oap/server/ai/pipeline/services/HttpUriRecognitionService.java#LL39C32-L39C32
-        if version == request.version:  # Initial version is NULL
+        if responses.version_name == request.version:  # Initial version is NULL
             logger.info('Version match, returning empty response')
-            return ai_http_uri_recognition_pb2.HttpUriRecognitionResponse(patterns=[], version=version)
+            return responses.unchanged
 
-        logger.info(f'Version do not match, local:{version} vs oap:{request.version}')
+        logger.info(f'Version do not match, local:{responses.version_name} vs oap:{request.version}')
+        return responses.full
 
-        cluster_candidates = self.shared_results_object.get_dict_field(request.service)
-        patterns = []
-        count = 0
-        for cluster in cluster_candidates:
-            if '{var}' in cluster:
-                patterns.append(Pattern(pattern=cluster))
-            else:  # TODO this is for post processing feature to be added
-                count += 1
-        logger.info(f'Returning {len(patterns)} patterns, ignore {count} patterns without var urls')
+    async def fetchPatternChanges(self, request, context):
+        """
+        Returns the serialized HttpUriRecognitionChangesResponse, registered by add_servicer_to_server without
+        a serializer
+        """
+        logger.info(
+            f'> Received fetchPatternChanges request for service <{request.service}>, '
+            f'oap side version is: {request.version}')
+        return self.get_responses(request.service).get_changes(request.version)
 
-        return ai_http_uri_recognition_pb2.HttpUriRecognitionResponse(patterns=patterns, version=version)
+    async def subscribePatterns(self, request, context):
+        """
+        Yields the serialized HttpUriRecognitionChangesResponse, registered by add_servicer_to_server without
+        a serializer
+        """
+        subscription = Subscription({sync.service: sync.version for sync in request.services})
+        logger.info(f'> Received subscribePatterns request for {len(subscription.versions)} services')
+        self.hub.subscribe(subscription)
+        try:
+            # the changes since the versions at the OAP side first, then the new versions handed by the hub
+            pending = {service: self.get_responses(service) for service in subscription.versions}
+            while True:
+                for service, responses in pending.items():
+                    since_version = subscription.versions[service]
+                    if responses.version_name != since_version:
+                        subscription.versions[service] = responses.version_name
+                        yield responses.get_changes(since_version)
+                try:
+                    await asyncio.wait_for(subscription.event.wait(), HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield HEARTBEAT
+                pending = subscription.take_pending()
+        finally:
+            self.hub.unsubscribe(subscription)
+
+    def get_responses(self, service: str) -> ServiceResponses:
+        version = self.shared_results_object.get_version(service=service)
+        responses = self.responses.get(service)
+        # the responses are built once per version of the service, for all the OAP nodes polling it
+        if responses is None or responses.version != version:
+            cluster_candidates = self.shared_results_object.get_dict_field(service)
+            patterns = [cluster for cluster in cluster_candidates if '{var}' in cluster]
+            # TODO the patterns without var urls are for post processing feature to be added
+            logger.info(f'Caching {len(patterns)} patterns of version {version} of service <{service}>, '
+                        f'ignore {len(cluster_candidates) - len(patterns)} patterns without var urls')
+            if responses is None:
+                responses = ServiceResponses(service, version, patterns, deque(maxlen=MAX_VERSION_HISTORY))
+            else:
+                responses = responses.next_version(version, patterns)
+            self.responses[service] = responses
+        return responses
 
     async def feedRawData(self, request, context):
         """
@@ -93,14 +214,98 @@ class HttpUriRecognitionServicer(ai_http_uri_recognition_pb2_grpc.HttpUriRecogni
             logger.info(
                 f'Unique Uri count too low({self.known_services[service]} < {self.conf.drain_analysis_min_url_count}) for service {service}, skipping')
             return Empty()
-        self.uri_main_queue.put((uris, service))
+        # merged with the other feeds of the service, acknowledged once queued when the worker is behind
+        await self.coalescer.feed(service, uris)
         return Empty()
 
+    async def feedRawDataStream(self, request_iterator, context):
+        """
+        Pass the streamed uris of a service on to the worker in batches of FEED_BATCH_SIZE uris, the stream isn't read
+        further while the worker queue is full, so grpc flow control holds the client back
+        """
+        service = None
+        batch = []
+        received_uris = queued_uris = queued_batches = 0
+        async for request in request_iterator:
+            if service is None:
+                service = str(request.service)
+                logger.info(f'> Received feedRawDataStream request for service {service}')
+            elif request.service and request.service != service:
+                await context.abort(grpc.StatusCode.INVALID_ARGUMENT,
+                                    f'chunk of service {request.service} in the stream of service {service}')
+            uris = [str(uri.name) for uri in request.unrecognizedUris if uri and uri.name]
+            received_uris += len(uris)
+            batch.extend(uris)
+            while len(batch) >= FEED_BATCH_SIZE:
+                if await self.queue_feed_batch(service, batch[:FEED_BATCH_SIZE]):
+                    queued_uris += FEED_BATCH_SIZE
+                    queued_batches += 1
+                del batch[:FEED_BATCH_SIZE]
+        if batch and await self.queue_feed_batch(service, batch):
+            queued_uris += len(batch)
+            queued_batches += 1
+        logger.info(f'Received {received_uris} uris of service {service} in a stream, '
+                    f'queued {queued_uris} uris in {queued_batches} batches')
+        return HttpUriRecognitionFeedSummary(service=service or '', receivedUris=received_uris,
+                                             queuedUris=queued_uris, queuedBatches=queued_batches)
+
+    async def queue_feed_batch(self, service: str, uris: List[str]) -> bool:
+        """Queue a batch of streamed uris like feedRawData, False if it is skipped"""
+        if service == 'User':
+            return False
+        # This is an experimental mechanism to avoid identifying non-restful uris unnecessarily.
+        self.known_services[service] += len(set(uris))
+        if self.known_services[service] < self.conf.drain_analysis_min_url_count:
+            logger.info(f'Unique Uri count too low({self.known_services[service]} < '
+                        f'{self.conf.drain_analysis_min_url_count}) for service {service}, skipping')
+            return False
+        # never dropped, the stream isn't read further while the worker queue is full
+        return await self.coalescer.put(service, uris, shed=False)
+
+
+def add_servicer_to_server(servicer, server):
+    """
+    Same as the generated add_HttpUriRecognitionServiceServicer_to_server, but the responses of fetchAllPatterns,
+    fetchPatternChanges and subscribePatterns are serialized already, so they are sent as they are
+    """
+    rpc_method_handlers = {
+        'fetchAllPatterns': grpc.unary_unary_rpc_method_handler(
+            servicer.fetchAllPatterns,
+            request_deserializer=ai_http_uri_recognition_pb2.HttpUriRecognitionSyncRequest.FromString,
+            response_serializer=None,
+        ),
+        'fetchPatternChanges': grpc.unary_unary_rpc_method_handler(
+            servicer.fetchPatternChanges,
+            request_deserializer=ai_http_uri_recognition_pb2.HttpUriRecognitionSyncRequest.FromString,
+            response_serializer=None,
+        ),
+        'subscribePatterns': grpc.unary_stream_rpc_method_handler(
+            servicer.subscribePatterns,
+            request_deserializer=ai_http_uri_recognition_pb2.HttpUriRecognitionSubscribeRequest.FromString,
+            response_serializer=None,
+        ),
+        'feedRawData': grpc.unary_unary_rpc_method_handler(
+            servicer.feedRawData,
+            request_deserializer=ai_http_uri_recognition_pb2.HttpUriRecognitionRequest.FromString,
+            response_serializer=Empty.SerializeToString,
+        ),
+        'feedRawDataStream': grpc.stream_unary_rpc_method_handler(
+            servicer.feedRawDataStream,
+            request_deserializer=ai_http_uri_recognition_pb2.HttpUriRecognitionRequest.FromString,
+            response_serializer=HttpUriRecognitionFeedSummary.SerializeToString,
+        ),
+    }
+    generic_handler = grpc.method_handlers_generic_handler('HttpUriRecognitionService', rpc_method_handlers)
+    server.add_generic_rpc_handlers((generic_handler,))
+    # looked up before the generic handlers, only available in recent grpc versions
+    if hasattr(server, 'add_registered_method_handlers'):
+        server.add_registered_method_handlers('HttpUriRecognitionService', rpc_method_handlers)
+
 
 async def serve(uri_main_queue, shared_results_object, conf):
     server = grpc.aio.server(futures.ThreadPoolExecutor(max_workers=10))
 
-    ai_http_uri_recognition_pb2_grpc.add_HttpUriRecognitionServiceServicer_to_server(
+    add_servicer_to_server(
         HttpUriRecognitionServicer(uri_main_queue=uri_main_queue, shared_results_object=shared_results_object,
                                    conf=conf), server)
 
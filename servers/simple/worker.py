@@ -12,12 +12,17 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 import logger
+import math
 import queue
 import time
+import zlib
 from collections import defaultdict
 
-from models.uri_drain.persistence_handler import ServiceFilePersistenceHandler
-from models.uri_drain.template_miner import TemplateMiner
+from cachetools import LRUCache
+
+from models.uri_drain.template_miner import TemplateMiner, create_persistence_handler, iter_existing_miners, \
+    load_existing_patterns
+from servers.simple.pattern_store import PatternStoreError
 
 logger = logger.init_logger(name=__name__)
 
@@ -32,13 +37,119 @@ def create_defaultdict_with_key(factory):
     return CustomDefaultDict(lambda key: factory(key))
 
 
-def run_worker(uri_main_queue, shared_results_object, config, existing_miners):
-    drain_instances = create_defaultdict_with_key(lambda key:  # URIDrain instances
-                                                  TemplateMiner(ServiceFilePersistenceHandler(config.snapshot_file_dir,
-                                                                                              key) if config.snapshot_file_dir else None,
-                                                                config))
-    for service in existing_miners:
-        drain_instances[service] = existing_miners[service]
+class MinerCache(LRUCache):
+    """
+    Template miners of the services, the least recently fed ones are saved and unloaded once the estimated memory
+    of the miners exceeds maxsize. An unloaded miner is loaded again from its snapshot on the next feed of its service.
+    """
+
+    def __init__(self, factory, maxsize, on_evict=None):
+        # a miner larger than the whole budget takes it all, instead of being refused
+        super().__init__(maxsize, getsizeof=lambda miner: min(miner.drain.estimate_memory_size(), maxsize))
+        self.factory = factory
+        self.on_evict = on_evict
+
+    def __missing__(self, key):
+        value = self.factory(key)
+        self[key] = value
+        return value
+
+    def popitem(self):
+        service, miner = super().popitem()
+        logger.info(f'Unloading the miner of service <{service}>, '
+                    f'{miner.drain.estimate_memory_size() / 1024 / 1024:.1f} MB estimated')
+        # a miner not fed since its last save, e.g. restored at startup, is already up to date on disk
+        if miner.unsaved_message_count > 0:
+            miner.save_state("unloaded")
+        # the snapshot must be written before the service is loaded again
+        miner.flush()
+        if self.on_evict is not None:
+            self.on_evict(service)
+        return service, miner
+
+
+def publish_patterns(shared_results_object, service, drain, published_revision):
+    """
+    Publish the pattern changes of the drain since published_revision, the full pattern set is only sent
+    when the drain no longer keeps the history of that revision.
+    :param published_revision: None if no revision of the drain is published yet, e.g. a drain loaded from disk
+        on its first feed, whose patterns published at startup were loaded aside
+    :return: the revision published
+    """
+    changes = None if published_revision is None else drain.get_pattern_changes(published_revision)
+    if changes is None:
+        shared_results_object.set_dict_field(service=service, value=drain.cluster_patterns)
+        return drain.pattern_revision
+    if changes.added or changes.removed:
+        shared_results_object.update_dict_field(service=service, added=changes.added, removed=changes.removed)
+    return changes.revision
+
+
+def restore_existing_miners(drain_instances, shared_results_object, config, published_revisions, owns_service=None):
+    """
+    Load and publish the existing services until the memory budget of a MinerCache is full, the other services are
+    published from their saved patterns and loaded on their first feed, as in lazy mode. Inserting them would unload
+    the miners restored just before.
+    :param published_revisions: filled with the pattern revision published of each service loaded
+    :param owns_service: whether the worker owns the service, None if it owns all of them
+    """
+    for service, miner in iter_existing_miners(config, owns_service):
+        if isinstance(drain_instances, MinerCache) and \
+                drain_instances.currsize + drain_instances.getsizeof(miner) > drain_instances.maxsize:
+            loaded_services = set(drain_instances.keys())
+            loaded_services.add(service)
+
+            def unloaded(other):
+                return other not in loaded_services and (owns_service is None or owns_service(other))
+
+            existing_patterns = {service: miner.drain.cluster_patterns}
+            existing_patterns.update(load_existing_patterns(config, unloaded))
+            for other, patterns in existing_patterns.items():
+                try:
+                    shared_results_object.set_dict_field(service=other, value=patterns)
+                except PatternStoreError as e:
+                    logger.error(e)
+            return
+        drain_instances[service] = miner
+        try:
+            published_revisions[service] = publish_patterns(shared_results_object, service, miner.drain, None)
+        except PatternStoreError as e:
+            # the other services are still restored, the rejected ones are counted by the store
+            logger.error(e)
+
+
+def worker_index(service: str, worker_count: int) -> int:
+    """The worker owning the service, by a hash stable across processes and restarts"""
+    return zlib.crc32(service.encode('utf-8')) % worker_count
+
+
+def run_worker(uri_main_queue, shared_results_object, config, index=0):
+    """
+    :param index: index of the worker among the config.worker_count workers, it owns, loads and saves the services
+        routed to it by worker_index only
+    """
+    def create_miner(key):  # URIDrain instances
+        return TemplateMiner(create_persistence_handler(config, key), config)
+
+    def owns_service(service):
+        return worker_index(service, config.worker_count) == index
+
+    # service -> pattern revision of its drain that has been published to the shared results,
+    # the services loaded lazily or unloaded get the full pattern set published on their next feed
+    published_revisions = {}
+    if config.snapshot_file_dir and config.snapshot_memory_budget_mb > 0:
+        # the budget is shared by the workers
+        memory_budget = config.snapshot_memory_budget_mb / config.worker_count
+        drain_instances = MinerCache(create_miner, math.ceil(memory_budget * 1024 * 1024),
+                                     on_evict=lambda service: published_revisions.pop(service, None))
+    else:
+        drain_instances = create_defaultdict_with_key(create_miner)
+
+    if not config.snapshot_lazy_load:
+        # the worker loads the existing services itself, so the server is up meanwhile and each service is published
+        # as soon as it is loaded, the uris fed meanwhile wait in the queue
+        restore_existing_miners(drain_instances, shared_results_object, config, published_revisions,
+                                owns_service if config.worker_count > 1 else None)
 
     counter = 0
     while True:
@@ -50,12 +161,22 @@ def run_worker(uri_main_queue, shared_results_object, config, existing_miners):
             uris, service = uri_package[0], uri_package[1]
             # print(uri_main_queue.get(timeout=1))
             start_time = time.time()
-            sorted_uris = sorted(uris)
-            for uri in sorted_uris:
-                drain_instances[service].add_log_message(uri)
-            logger.info(f'Processed {len(uris)} uris of service {service} in {time.time() - start_time} seconds')
-            patterns = drain_instances[service].drain.cluster_patterns
-            shared_results_object.set_dict_field(service=service, value=patterns)  # TODO add version
+            # the uris arrive in no particular order, sorting them makes the templates reproducible, unless
+            # max_clusters is set: then the order they arrived in decides the clusters evicted, as it would fed one
+            # by one
+            if config.drain_max_clusters is None:
+                uris = sorted(uris)
+            result = drain_instances[service].add_log_messages(uris)
+            logger.info(f'Processed {len(uris)} uris ({result["unique_message_count"]} unique) of service {service} '
+                        f'in {time.time() - start_time} seconds, changes: {result["change_counts"]}')
+            miner = drain_instances[service]
+            try:
+                published_revisions[service] = publish_patterns(shared_results_object, service, miner.drain,
+                                                                published_revisions.get(service))
+            except PatternStoreError as e:
+                logger.error(e)
+            # the miner has grown, its size is estimated again
+            drain_instances[service] = miner
             # increment here
             counter += 1
         except Exception as e:
@@ -15,6 +15,8 @@
 import asyncio
 import logging
 import os
+import random
+import sys
 import time
 
 import grpc
@@ -180,6 +182,40 @@ async def run() -> None:
         print('-------------- Done ---------------')
 
 
+async def benchmark(service_count: int) -> None:
+    """
+    Throughput of the workers: feeds service_count services with 3000 unique uris each, then polls their patterns
+    until every service is published. Run the server with WORKER_COUNT=1, 2, 4... to compare:
+
+    python mock_client.py benchmark [service count]
+    """
+    async with grpc.aio.insecure_channel('localhost:17128') as channel:
+        stub = ai_http_uri_recognition_pb2_grpc.HttpUriRecognitionServiceStub(channel)
+
+        from dataset_constructor import get_mock_data
+
+        random.seed(42)
+        services = [f'benchmark_service_{random.getrandbits(32)}' for _ in range(service_count)]
+        # unique uris, so the drains cluster every one of them
+        requests = [HttpUriRecognitionRequest(service=service, unrecognizedUris=[
+            HttpRawUri(name=f'{uri}/{random.getrandbits(32)}') for uri in get_mock_data()]) for service in services]
+        uri_count = sum(len(request.unrecognizedUris) for request in requests)
+
+        start_time = time.time()
+        await asyncio.gather(*(stub.feedRawData(request) for request in requests))
+        fed_time = time.time() - start_time
+        pending = set(services)
+        while pending:
+            responses = await asyncio.gather(*(stub.fetchAllPatterns(
+                ai_http_uri_recognition_pb2.HttpUriRecognitionSyncRequest(service=service, version='NULL'))
+                for service in pending))
+            pending = {service for service, response in zip(pending, responses) if response.version == 'NULL'}
+            await asyncio.sleep(0.1)
+        took = time.time() - start_time
+        print(f'{uri_count} uris of {service_count} services fed in {fed_time:.2f} seconds, '
+              f'all published in {took:.2f} seconds: {uri_count / took:.0f} uris/sec')
+
+
 async def main():
     task1 = asyncio.create_task(
         run())
@@ -189,4 +225,7 @@ async def main():
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
-    asyncio.run(main())
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        asyncio.run(benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 50))
+    else:
+        asyncio.run(main())
@@ -0,0 +1,183 @@
+# Copyright 2023 SkyAPM org
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import queue
+
+import grpc
+
+from servers.protos.generated import ai_http_uri_recognition_pb2_grpc
+from models.uri_drain.template_miner_config import TemplateMinerConfig
+from servers.protos.generated.ai_http_uri_recognition_pb2 import HttpRawUri, HttpUriRecognitionRequest, \
+    HttpUriRecognitionSubscribeRequest, HttpUriRecognitionSyncRequest
+from servers.simple import server
+from servers.simple.pattern_store import SharedPatternStore
+from servers.simple.results_manager import URIDrainResults
+from servers.simple.server import HttpUriRecognitionServicer, add_servicer_to_server
+
+
+async def serve_and_call(results, call, uri_main_queue=None, conf=None):
+    servicer = HttpUriRecognitionServicer(uri_main_queue=uri_main_queue, shared_results_object=results,
+                                          conf=conf or TemplateMinerConfig())
+    server = grpc.aio.server()
+    add_servicer_to_server(servicer, server)
+    port = server.add_insecure_port('127.0.0.1:0')
+    await server.start()
+    try:
+        async with grpc.aio.insecure_channel(f'127.0.0.1:{port}') as channel:
+            await call(servicer, results, ai_http_uri_recognition_pb2_grpc.HttpUriRecognitionServiceStub(channel))
+    finally:
+        await server.stop(None)
+
+
+async def fetch_patterns(servicer, results, stub):
+    empty = await stub.fetchAllPatterns(HttpUriRecognitionSyncRequest(service='test', version='NULL'))
+    assert empty.version == 'NULL' and not empty.patterns
+
+    results.set_dict_field('test', ['/api/{var}', '/api/users'])
+    first = await stub.fetchAllPatterns(HttpUriRecognitionSyncRequest(service='test', version='NULL'))
+    cached = servicer.responses['test']
+    second = await stub.fetchAllPatterns(HttpUriRecognitionSyncRequest(service='test', version='NULL'))
+    # built once for the version
+    assert servicer.responses['test'] is cached
+    assert first == second
+    assert first.version == '1' and [pattern.pattern for pattern in first.patterns] == ['/api/{var}']
+
+    unchanged = await stub.fetchAllPatterns(HttpUriRecognitionSyncRequest(service='test', version='1'))
+    assert unchanged.version == '1' and not unchanged.patterns
+
+    results.set_dict_field('test', ['/api/{var}', '/api/{var}/users'])
+    updated = await stub.fetchAllPatterns(HttpUriRecognitionSyncRequest(service='test', version='1'))
+    assert updated.version == '2' and len(updated.patterns) == 2
+
+
+def test_fetch_all_patterns_cached_per_version():
+    asyncio.run(serve_and_call(URIDrainResults(), fetch_patterns))
+
+
+def patterns_of(response):
+    return sorted(pattern.pattern for pattern in response)
+
+
+async def fetch_pattern_changes(servicer, results, stub):
+    versions = []
+    for patterns in (['/a/{var}'], ['/a/{var}', '/b/{var}', '/c'], ['/b/{var}', '/c/{var}'], ['/c/{var}', '/d/{var}']):
+        results.set_dict_field('test', patterns)
+        response = await stub.fetchPatternChanges(HttpUriRecognitionSyncRequest(service='test', version='NULL'))
+        versions.append(response.version)
+
+    changes = await stub.fetchPatternChanges(HttpUriRecognitionSyncRequest(service='test', version=versions[1]))
+    assert not changes.full and changes.version == versions[-1]
+    assert patterns_of(changes.added) == ['/c/{var}', '/d/{var}']
+    assert patterns_of(changes.removed) == ['/a/{var}', '/b/{var}']
+
+    changes = await stub.fetchPatternChanges(HttpUriRecognitionSyncRequest(service='test', version=versions[-1]))
+    assert not changes.full and not changes.added and not changes.removed
+
+    # unknown to the server, e.g. from before it restarted
+    changes = await stub.fetchPatternChanges(HttpUriRecognitionSyncRequest(service='test', version='100'))
+    assert changes.full and patterns_of(changes.added) == ['/c/{var}', '/d/{var}'] and not changes.removed
+
+
+def test_fetch_pattern_changes():
+    asyncio.run(serve_and_call(URIDrainResults(), fetch_pattern_changes))
+
+
+async def subscribe_patterns(servicer, results, stub):
+    results.set_dict_field('a', ['/a/{var}'])
+    stream = stub.subscribePatterns(HttpUriRecognitionSubscribeRequest(services=[
+        HttpUriRecognitionSyncRequest(service='a', version='NULL'),
+        HttpUriRecognitionSyncRequest(service='b', version='NULL')]))
+    # the changes since the versions of the subscriber first
+    update = await stream.read()
+    assert update.service == 'a' and update.version == '1' and patterns_of(update.added) == ['/a/{var}']
+
+    # then pushed once published
+    results.set_dict_field('b', ['/b/{var}'])
+    update = await stream.read()
+    assert update.service == 'b' and update.version == '1' and patterns_of(update.added) == ['/b/{var}']
+    results.set_dict_field('a', ['/a/{var}/x'])
+    update = await stream.read()
+    assert update.service == 'a' and update.version == '2'
+    assert patterns_of(update.added) == ['/a/{var}/x'] and patterns_of(update.removed) == ['/a/{var}']
+
+    heartbeat = await stream.read()
+    assert not heartbeat.service
+    stream.cancel()
+
+
+def test_subscribe_patterns(monkeypatch):
+    monkeypatch.setattr(server, 'HEARTBEAT_INTERVAL', 0.2)
+    asyncio.run(serve_and_call(URIDrainResults(), subscribe_patterns))
+    # the versions are only checked once something is published
+    store = SharedPatternStore.create(max_services=4)
+    try:
+        asyncio.run(serve_and_call(store, subscribe_patterns))
+    finally:
+        store.unlink()
+
+
+def test_feed_raw_data_stream(monkeypatch):
+    monkeypatch.setattr(server, 'FEED_BATCH_SIZE', 40)
+    uri_main_queue = queue.Queue(maxsize=2)
+    chunks = [HttpUriRecognitionRequest(service='test', unrecognizedUris=[
+        HttpRawUri(name=f'/api/users/{chunk}{index}') for index in range(30)]) for chunk in range(3)]
+
+    async def feed(servicer, results, stub):
+        call = stub.feedRawDataStream(iter(chunks))
+        # the stream waits while the queue is full
+        await asyncio.sleep(0.2)
+        assert uri_main_queue.qsize() == 2
+        batches = [uri_main_queue.get() for _ in range(2)]
+        summary = await call
+        batches.append(uri_main_queue.get())
+        assert (summary.receivedUris, summary.queuedUris, summary.queuedBatches) == (90, 90, 3)
+        assert [len(uris) for uris, _ in batches] == [40, 40, 10]
+        assert [uri for uris, _ in batches for uri in uris] == [uri.name for chunk in chunks
+                                                                for uri in chunk.unrecognizedUris]
+
+    asyncio.run(serve_and_call(URIDrainResults(), feed, uri_main_queue))
+
+
+def test_feed_raw_data_coalesced():
+    conf = TemplateMinerConfig()
+    conf.feed_coalesce_window_sec = 0.1
+    conf.feed_max_wait_sec = 0.1
+    uri_main_queue = queue.Queue(maxsize=1)
+
+    def request(service, start, stop):
+        return HttpUriRecognitionRequest(service=service, unrecognizedUris=[
+            HttpRawUri(name=f'/api/users/{index}') for index in range(start, stop)])
+
+    async def feed(servicer, results, stub):
+        await stub.feedRawData(request('a', 0, 30))
+        await stub.feedRawData(request('a', 20, 50))
+        await asyncio.sleep(0.2)
+        # merged into one batch without the duplicates
+        assert uri_main_queue.get_nowait() == ([f'/api/users/{index}' for index in range(50)], 'a')
+
+        # the queue stays full, the batch of b is dropped once it has waited max_wait_sec
+        await stub.feedRawData(request('a', 0, 30))
+        await stub.feedRawData(request('b', 0, 30))
+        await asyncio.sleep(0.5)
+        assert uri_main_queue.get_nowait()[1] in ('a', 'b') and uri_main_queue.empty()
+        assert servicer.coalescer.shed_batches == 1 and servicer.coalescer.shed_uris == 30
+
+        # while the queue is full, the feed is acknowledged once its batch is queued, without waiting the window
+        uri_main_queue.put_nowait(([], 'c'))
+        asyncio.get_running_loop().call_later(0.05, uri_main_queue.get_nowait)
+        await stub.feedRawData(request('b', 0, 30))
+        assert uri_main_queue.get_nowait() == ([f'/api/users/{index}' for index in range(30)], 'b')
+
+    asyncio.run(serve_and_call(URIDrainResults(), feed, uri_main_queue, conf))
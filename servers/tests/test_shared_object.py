@@ -12,10 +12,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import time
 from collections import defaultdict
 from multiprocessing import Process
 import pytest
 
+from servers.simple.pattern_store import SLOT, PatternStoreError, SharedPatternStore
 from servers.simple.results_manager import ProxyURIDrainResultsManager, URIDrainResults
 
 
@@ -43,5 +45,53 @@ def test_shared_object_basic():
     manager.shutdown()
 
 
+def publish_function(store):
+    store.set_dict_field("test", ['a', 'b', 'c'])
+    store.update_dict_field("test", added=['/api/{var}' * 1000], removed=['b'])
+    store.set_dict_field("other", ['d'])
+
+
+def test_shared_pattern_store():
+    store = SharedPatternStore.create(max_services=4)
+    try:
+        assert store.get_version("test") == 0
+        assert store.get_dict_field("test") == []
+
+        process = Process(target=publish_function, args=(store,))
+        process.start()
+        process.join()
+
+        # the patterns outgrew their first segment
+        assert store.get_version("test") == 2
+        assert store.get_dict_field("test") == ['a', 'c', '/api/{var}' * 1000]
+        assert store.get_dict_field("other") == ['d']
+
+        # publishing the same patterns again is not a new version
+        store.set_dict_field("other", ['d'])
+        assert store.get_version("other") == 1
+        store.update_dict_field("other", added=['e'], removed=[])
+        assert store.get_version("other") == 2
+        assert store.get_dict_field("other") == ['d', 'e']
+
+        # the publishes that get no slot fail and are counted
+        store.set_dict_field("third", ['f'])
+        store.set_dict_field("fourth", ['g'])
+        with pytest.raises(PatternStoreError, match='full'):
+            store.set_dict_field("fifth", ['h'])
+        with pytest.raises(PatternStoreError, match='name'):
+            store.set_dict_field("x" * 300, ['i'])
+        assert store.get_rejected_count() == 2 and store.get_dict_field("fifth") == []
+
+        # a slot left half written by a dead writer is given up on without spinning for long
+        slot = store.find_slot("other")
+        offset = store.slot_offset(slot)
+        SLOT.pack_into(store.index.buf, offset, 1, *SLOT.unpack_from(store.index.buf, offset)[1:])
+        start_time = time.monotonic()
+        assert store.get_dict_field("other") == ['d', 'e']
+        assert time.monotonic() - start_time < 0.5
+    finally:
+        store.unlink()
+
+
 if __name__ == '__main__':
     pytest.main([__file__])
@@ -0,0 +1,120 @@
+# Copyright 2023 SkyAPM org
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import os
+import queue
+
+import pytest
+
+from models.tests.test_uri_drain import load_demo_uris
+from models.uri_drain.persistence_handler import ServiceFilePersistenceHandler
+from models.uri_drain.template_miner import TemplateMiner
+from models.uri_drain.template_miner_config import TemplateMinerConfig
+from servers.simple.feed_coalescer import FeedCoalescer
+from servers.simple.pattern_store import SharedPatternStore
+from servers.simple.worker import MinerCache, restore_existing_miners, worker_index
+
+
+def test_miner_cache_unloads_least_recently_fed(tmp_path):
+    config = TemplateMinerConfig()
+    config.drain_extra_delimiters = ['/']
+    config.snapshot_file_dir = str(tmp_path)
+    uris = load_demo_uris('Endpoint200_hard.txt')
+    unloaded = []
+    miners = MinerCache(lambda service: TemplateMiner(ServiceFilePersistenceHandler(str(tmp_path), service), config),
+                        maxsize=1, on_evict=unloaded.append)
+    miners['a'].add_log_messages(uris)
+    patterns = miners['a'].drain.cluster_patterns
+    miners['a'] = miners['a']
+    miners['b'].add_log_messages(uris[:10])
+    assert unloaded == ['a'] and list(miners) == ['b']
+
+    # loaded again from its snapshot
+    assert sorted(miners['a'].drain.cluster_patterns) == sorted(patterns)
+    assert unloaded == ['a', 'b']
+
+    # not fed since it was loaded, its state isn't saved again when it is unloaded
+    persistence_handler = ServiceFilePersistenceHandler(str(tmp_path), 'a')
+    os.remove(persistence_handler.file_path)
+    assert len(miners['b'].drain.cluster_patterns) > 0
+    assert unloaded == ['a', 'b', 'a'] and not os.path.isfile(persistence_handler.file_path)
+
+
+def test_restore_stops_once_memory_budget_full(tmp_path):
+    config = TemplateMinerConfig()
+    config.drain_extra_delimiters = ['/']
+    config.snapshot_file_dir = str(tmp_path)
+    uris = load_demo_uris('Endpoint200_hard.txt')
+    for service in ('a', 'b', 'c'):
+        miner = TemplateMiner(ServiceFilePersistenceHandler(str(tmp_path), service), config)
+        miner.add_log_messages(uris)
+        miner.save_state('test')
+    patterns = sorted(miner.drain.cluster_patterns)
+
+    def create_miner(service):
+        return TemplateMiner(ServiceFilePersistenceHandler(str(tmp_path), service), config)
+
+    # room for one restored miner and a half
+    miners = MinerCache(create_miner, maxsize=create_miner('a').drain.estimate_memory_size() * 3 // 2,
+                        on_evict=pytest.fail)
+    store = SharedPatternStore.create(max_services=4)
+    try:
+        published_revisions = {}
+        restore_existing_miners(miners, store, config, published_revisions)
+        # the first service fills the budget, the others are published without being kept loaded
+        assert len(miners) == 1 and published_revisions.keys() == miners.keys()
+        for service in ('a', 'b', 'c'):
+            assert sorted(store.get_dict_field(service)) == patterns
+    finally:
+        store.unlink()
+
+
+def test_services_sharded_across_workers():
+    uri_queues = [queue.Queue(), queue.Queue(), queue.Queue()]
+    coalescer = FeedCoalescer(uri_queues, window_sec=0, max_uris=1, max_wait_sec=0)
+    services = [f'service-{index}' for index in range(30)]
+    for service in services:
+        asyncio.run(coalescer.feed(service, ['/api/users']))
+
+    for index, uri_queue in enumerate(uri_queues):
+        queued = [service for _, service in uri_queue.queue]
+        assert queued == [service for service in services if worker_index(service, 3) == index]
+        # every worker gets a share
+        assert queued
+
+
+def test_full_queue_holds_back_its_own_services_only():
+    uri_queues = [queue.Queue(maxsize=1), queue.Queue(maxsize=1)]
+    coalescer = FeedCoalescer(uri_queues, window_sec=0.05, max_uris=100, max_wait_sec=1)
+    services = [f'service-{index}' for index in range(10)]
+    blocked = next(service for service in services if worker_index(service, 2) == 0)
+    free = next(service for service in services if worker_index(service, 2) == 1)
+
+    async def feed():
+        # pending before the queue of the first worker fills up
+        await coalescer.feed(blocked, ['/api/a'])
+        await coalescer.feed(free, ['/api/b'])
+        uri_queues[0].put_nowait(([], 'other'))
+        await asyncio.sleep(0.3)
+        assert uri_queues[1].get_nowait() == (['/api/b'], free)
+        uri_queues[0].get_nowait()
+        await asyncio.sleep(0.1)
+        assert uri_queues[0].get_nowait() == (['/api/a'], blocked)
+
+    asyncio.run(feed())
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
@@ -28,6 +28,9 @@ service_name = sys.argv[2]
 channel = grpc.insecure_channel('localhost:17128')
 stub = HttpUriRecognitionServiceStub(channel)
 
+# number of uris sent per message by stream_data
+stream_chunk_size = 1000
+
 
 def feed_data():
     file_path = sys.argv[3]
@@ -38,6 +41,28 @@ def feed_data():
     print("ok")
 
 
+def read_chunks():
+    # the file is read a chunk at a time, so files of any size can be streamed
+    file_path = sys.argv[3]
+    with open(file_path, 'r') as file:
+        chunk = []
+        for line in file:
+            uri = line.rstrip('\n')
+            if uri:
+                chunk.append(HttpRawUri(name=uri))
+            if len(chunk) >= stream_chunk_size:
+                yield HttpUriRecognitionRequest(service=service_name, unrecognizedUris=chunk)
+                chunk = []
+        if chunk:
+            yield HttpUriRecognitionRequest(service=service_name, unrecognizedUris=chunk)
+
+
+def stream_data():
+    summary = stub.feedRawDataStream(read_chunks())
+    print(f"ok, received {summary.receivedUris} uris, queued {summary.queuedUris} uris "
+          f"in {summary.queuedBatches} batches")
+
+
 def fetch_data():
     patterns = stub.fetchAllPatterns(HttpUriRecognitionRequest(service=service_name))
     print(yaml.dump(HTTPUriRecognitionResp(sorted([p.pattern for p in patterns.patterns]), patterns.version), Dumper=NoTagDumper))
@@ -64,5 +89,7 @@ yaml.add_representer(HTTPUriRecognitionResp, remove_representer, Dumper=NoTagDum
 if __name__ == '__main__':
     if mode == 'feed':
         feed_data()
+    elif mode == 'stream':
+        stream_data()
     elif mode == 'fetch':
         fetch_data()